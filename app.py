@@ -1,20 +1,25 @@
-from bio_model import BioEngine, StreamlitLogger, analyze_event_with_deepseek, analyze_event_with_gemini
+from bio_model import (BioEngine, StreamlitLogger, analyze_event_with_deepseek, analyze_event_with_gemini,
+                       optimize_parameters)
 import numpy as np
-from scipy.integrate import solve_ivp
-from scipy.optimize import minimize
-import pandas as pd
-from datetime import datetime, timedelta
-import requests
+from datetime import datetime
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 import time
-import matplotlib.pyplot as plt
 import plotly.graph_objects as go
-import io
-import sys
 import json
-from contextlib import redirect_stdout
 import os
+from live_chart import live_chart, ring_source
+from ring_buffer import RingBuffer, datetime_to_seconds, seconds_to_datetime64
+from refresh_policy import RefreshPolicy
+from refresh_timer import refresh_timer
+from metrics import observe_session_state, start_exporters
+from chart_markers import cluster_gap, cluster_markers, marker_shapes, marker_trace, marker_values, summarize_clusters
+
+# 曲线历史容量（点数，默认 288：最近 48 小时、每 10 分钟一点）
+HISTORY_CAPACITY = int(os.environ.get("HISTORY_CAPACITY", "288"))
+# 实时曲线的预测轨迹段长度（真实秒，默认 300），浏览器每秒播放一点，剩余 10 秒时请求下一段
+PLAYBACK_CHUNK_SECONDS = float(os.environ.get("PLAYBACK_CHUNK_SECONDS", "300"))
+PLAYBACK_STEP_SECONDS = 1.0
+PLAYBACK_LEAD_SECONDS = 10.0
 # --- 页面配置 ---
 st.set_page_config(page_title="Bio-Mood Digital Twin", layout="wide")
 
@@ -29,7 +34,10 @@ if 'engine' not in st.session_state:
     st.session_state['start_real_time'] = time.time()
     
 if 'history' not in st.session_state:
-    st.session_state['history'] = {'time': [], 'mood': [], 'baseline': []}
+    # 环形缓冲区 (time, mood, baseline, S, x)，time 为墙上时间的秒数；
+    # history.total 与序列标识供增量实时曲线只发送新增的点
+    st.session_state['history'] = RingBuffer(HISTORY_CAPACITY)
+    st.session_state['history_series'] = time.time()
 
 if 'feedback_data' not in st.session_state:
     st.session_state['feedback_data'] = []
@@ -43,8 +51,16 @@ if 'logger' not in st.session_state:
 if 'ai_model' not in st.session_state:
     st.session_state['ai_model'] = 'SiliconFlow'
 
+if 'refresh_policy' not in st.session_state:
+    st.session_state['refresh_policy'] = RefreshPolicy()
+
+# Prometheus 指标导出（按 METRICS_PORT / METRICS_FILE，进程内只启动一次）
+start_exporters()
+
 # 为了简化，定义一个全局logger
 logger = st.session_state['logger']
+# 自适应刷新：施加事件后调用 refresh_policy.notify_event() 立即回到最快刷新
+refresh_policy = st.session_state['refresh_policy']
 
 # 默认加载硅基流动模型
 st.sidebar.title("模型设置")
@@ -92,6 +108,7 @@ with st.sidebar:
     hrv_input = st.slider("当前 HRV (rMSSD)", 10, 100, 50, key="hrv_slider")
     if st.button("更新 HRV"):
         st.session_state['engine'].apply_event('hrv_update', hrv_input)
+        refresh_policy.notify_event()
         st.success(f"HRV参数已映射: k={st.session_state['engine'].params['k']:.1f}, c={st.session_state['engine'].params['c']:.1f}")
         st.info("HRV 越低，可能导致情绪波动更大；HRV 越高，情绪更稳定。")
         # 记录事件
@@ -109,7 +126,9 @@ with st.sidebar:
         if st.button("☕ 喝咖啡"):
             # 咖啡因生效：暂时降低睡眠压力
             st.session_state['engine'].state[0] *= 0.6 
+            st.session_state['engine'].mark_changed()
             st.toast("咖啡因生效：睡眠压力暂时降低")
+            refresh_policy.notify_event()
             # 记录事件
             st.session_state.setdefault('event_markers', []).append({
                 'time': datetime.now(), 'event': '喝咖啡', 'amplitude': -0.5
@@ -119,6 +138,7 @@ with st.sidebar:
         if st.button("🤯 压力事件"):
             st.session_state['engine'].apply_event('stress_event')
             st.toast("受到压力冲击！")
+            refresh_policy.notify_event()
             st.session_state.setdefault('event_markers', []).append({
                 'time': datetime.now(), 'event': '压力事件', 'amplitude': -1.0
             })
@@ -127,6 +147,7 @@ with st.sidebar:
          if st.button("🏃 运动"):
             st.session_state['engine'].apply_event('exercise')
             st.toast("运动释放内啡肽！")
+            refresh_policy.notify_event()
             st.session_state.setdefault('event_markers', []).append({
                 'time': datetime.now(), 'event': '运动', 'amplitude': 1.0
             })
@@ -136,7 +157,9 @@ with st.sidebar:
             # 冥想增加阻尼，减缓速度
             st.session_state['engine'].state[2] = 0 # 速度归零
             st.session_state['engine'].params['c'] += 2.0
+            st.session_state['engine'].mark_changed()
             st.toast("系统强制平静 (阻尼增加)")
+            refresh_policy.notify_event()
             st.session_state.setdefault('event_markers', []).append({
                 'time': datetime.now(), 'event': '冥想', 'amplitude': 0.2
             })
@@ -150,6 +173,7 @@ with st.sidebar:
             st.session_state['engine'].apply_event('sleep_start')
         else:
             st.session_state['engine'].apply_event('sleep_end')
+        refresh_policy.notify_event()
         st.rerun()
         # 记录睡眠切换事件
         st.session_state.setdefault('event_markers', []).append({
@@ -179,6 +203,8 @@ with st.sidebar:
 
                     # Apply the impact to the model
                     st.session_state['engine'].state[2] += amplitude  # Adjust velocity
+                    st.session_state['engine'].mark_changed()
+                    refresh_policy.notify_event()
                     logger.info(f"📊 应用参数调整...")
                     
                     # Apply parameter adjustments with bounds checking
@@ -221,226 +247,250 @@ with st.sidebar:
                     with st.expander("调试信息"):
                         st.write("返回数据:", analysis)
 
-# --- 3. 核心循环 (自动刷新) ---
-# 每 1 秒刷新一次页面，模拟时间的流逝
-count = st_autorefresh(interval=1000, key="fizzbuzz")
+# --- 3. 核心循环 (片段自适应刷新) ---
+# 只有随时间变化的部分（引擎步进、仪表盘、曲线、诊断）放在 st.fragment 中单独重跑；
+# 侧边栏、校准、日志和导出只在用户交互时随整页重跑。
+# 片段内的 refresh_timer 组件按 refresh_policy 选择的间隔触发重跑：曲线变化快或刚施加事件时
+# 最快 0.5 秒，平稳时最慢 10 秒，标签页在后台时 60 秒
 
-# 计算时间步进
-current_real_time = time.time()
 # 缩放时间：现实 1 秒 = 模拟 10 分钟 (为了演示效果能看到曲线变化)
 time_scale = 1
-elapsed_real = current_real_time - st.session_state['start_real_time']
-sim_time_now = 8.0 + (elapsed_real * time_scale / 3600.0) # 小时
 
-# 运行物理引擎步进 [cite: 122]
-dt = sim_time_now - st.session_state['engine'].last_update_time
-if dt > 0:
-    st.session_state['engine'].step(dt)
-    
-    # 记录数据用于绘图（使用实际时间作为横轴）
-    mood, base, x, S = st.session_state['engine'].get_mood_value(sim_time_now)
-    now_dt = datetime.now()
-    st.session_state['history']['time'].append(now_dt)
-    st.session_state['history']['mood'].append(mood)
-    st.session_state['history']['baseline'].append(base)
-    
-    # 保持历史数据不无限增长 (最近48小时，假设每10分钟记录一次 => 288点)
-    if len(st.session_state['history']['time']) > 288:
-        for k in st.session_state['history']:
-            st.session_state['history'][k].pop(0)
+def current_sim_time():
+    """当前模拟时间（小时）"""
+    elapsed_real = time.time() - st.session_state['start_real_time']
+    return 8.0 + (elapsed_real * time_scale / 3600.0)
+
+def advance_engine():
+    """推进物理引擎到当前模拟时间并记录曲线点，返回当前模拟时间 [cite: 122]"""
+    sim_time_now = current_sim_time()
+    dt = sim_time_now - st.session_state['engine'].last_update_time
+    if dt > 0:
+        st.session_state['engine'].step(dt)
+        
+        # 记录数据用于绘图（使用实际时间作为横轴）
+        mood, base, x, S = st.session_state['engine'].get_mood_value(sim_time_now)
+        # 环形缓冲区固定容量，写满后覆盖最旧的点
+        st.session_state['history'].append(datetime_to_seconds(datetime.now()), mood, base, S, x)
+    return sim_time_now
+
+def forecast_chunk():
+    """
+    实时曲线的预测轨迹段：从当前状态积分出接下来 PLAYBACK_CHUNK_SECONDS 秒的曲线，
+    由浏览器按真实时间播放。施加事件、修改参数或切换睡眠（engine.revision_key() 变化）后重算，
+    否则只在浏览器请求下一段或该段已过期时重算。
+    """
+    engine = st.session_state['engine']
+    chunk = st.session_state.get('forecast_chunk')
+    request = st.session_state.get('live_chart')
+    if (chunk is not None and chunk['key'] == engine.revision_key() and time.time() < chunk['expires']
+            and not (isinstance(request, dict) and request.get('need') == chunk['forecast']['id'])):
+        return chunk['forecast']
+
+    advance_engine()
+    count = max(int(PLAYBACK_CHUNK_SECONDS / PLAYBACK_STEP_SECONDS), 1)
+    trajectory = engine.predict_trajectory(count * PLAYBACK_STEP_SECONDS * time_scale / 3600.0, count + 1)
+    # 与 history 相同的时间刻度（墙上时间的秒数），起点即引擎当前时刻，已在历史中
+    now = datetime_to_seconds(datetime.now())
+    t = now + np.arange(1, count + 1) * PLAYBACK_STEP_SECONDS
+    forecast = {
+        'id': f"{engine.revision}-{now:.3f}",
+        'now': now,
+        'lead': PLAYBACK_LEAD_SECONDS,
+        'points': list(zip(t.tolist(), seconds_to_datetime64(t).tolist(),
+                           trajectory['mood'][1:].tolist(), trajectory['baseline'][1:].tolist())),
+    }
+    st.session_state['forecast_chunk'] = {
+        'key': engine.revision_key(),
+        'expires': time.time() + count * PLAYBACK_STEP_SECONDS - PLAYBACK_LEAD_SECONDS,
+        'forecast': forecast,
+    }
+    return forecast
 
-# --- 4. 主界面展示 ---
+@st.fragment
+def render_dashboard():
+    sim_time_now = advance_engine()
+    refresh_interval = refresh_policy.next_interval(st.session_state['engine'], sim_time_now, time_scale)
 
-# 4.1 仪表盘
-mood_now, base_now, x_now, S_now = st.session_state['engine'].get_mood_value(sim_time_now)
+    # --- 4. 主界面展示 ---
 
-col_a, col_b, col_c, col_d = st.columns(4)
-col_a.metric("当前心情值", f"{mood_now:.2f}", delta=f"{x_now:.2f} (偏差)")
-col_b.metric("能量基线 (Energy)", f"{base_now:.2f}")
-col_c.metric("睡眠压力 (Process S)", f"{S_now:.2f}")
-col_d.metric("模拟时间", f"{int(sim_time_now)%24:02d}:{int((sim_time_now%1)*60):02d}")
+    # 4.1 仪表盘
+    mood_now, base_now, x_now, S_now = st.session_state['engine'].get_mood_value(sim_time_now)
 
-# 4.2 实时曲线图 - 使用 Baseline 样式
-st.subheader("📈 心情动力学曲线")
+    col_a, col_b, col_c, col_d, col_e = st.columns(5)
+    col_a.metric("当前心情值", f"{mood_now:.2f}", delta=f"{x_now:.2f} (偏差)")
+    col_b.metric("能量基线 (Energy)", f"{base_now:.2f}")
+    col_c.metric("睡眠压力 (Process S)", f"{S_now:.2f}")
+    col_d.metric("模拟时间", f"{int(sim_time_now)%24:02d}:{int((sim_time_now%1)*60):02d}")
+    col_e.metric("刷新间隔", f"{refresh_interval:.1f} s", delta=refresh_policy.reason, delta_color="off",
+                 help=f"标签页在后台时 {refresh_policy.hidden_interval:.0f} s")
+    refresh_timer("dashboard_timer", refresh_interval, refresh_policy.hidden_interval)
 
-if len(st.session_state['history']['time']) > 0:
-    # 创建 Plotly Baseline 样式图表
-    fig = go.Figure()
+    # 4.2 实时曲线图 - 使用 Baseline 样式
+    st.subheader("📈 心情动力学曲线")
+
+    if len(st.session_state['history']) > 0:
+        # 创建 Plotly Baseline 样式图表
+        fig = go.Figure()
     
-    # 获取基线和心情数据
-    times = st.session_state['history']['time']
-    moods = st.session_state['history']['mood']
-    baselines = st.session_state['history']['baseline']
+        # 获取基线和心情数据（缓冲区的零拷贝视图）
+        history = st.session_state['history']
+        time_seconds = history.view('time')
+        times = seconds_to_datetime64(time_seconds)
+        moods = history.view('mood')
+        baselines = history.view('baseline')
     
-    # 设置基线值（使用当前基线的平均值）
-    baseline_value = sum(baselines) / len(baselines) if baselines else 0
+        # 设置基线值（使用当前基线的平均值）
+        baseline_value = float(baselines.mean())
     
-    # 添加心情数据 - 绿色（积极情绪）
-    fig.add_trace(go.Scatter(
-        x=times,
-        y=moods,
-        name='Mood (Total)',
-        mode='lines',
-        line=dict(color='rgba(38, 166, 154, 1)', width=2),
-        fill='tozeroy',
-        fillcolor='rgba(38, 166, 154, 0.28)',
-        hovertemplate='<b>时间</b>: %{x|%Y-%m-%d %H:%M:%S}<br><b>心情值</b>: %{y:.2f}<extra></extra>'
-    ))
+        # 添加心情数据 - 绿色（积极情绪）
+        fig.add_trace(go.Scatter(
+            x=times,
+            y=moods,
+            name='Mood (Total)',
+            mode='lines',
+            line=dict(color='rgba(38, 166, 154, 1)', width=2),
+            fill='tozeroy',
+            fillcolor='rgba(38, 166, 154, 0.28)',
+            hovertemplate='<b>时间</b>: %{x|%Y-%m-%d %H:%M:%S}<br><b>心情值</b>: %{y:.2f}<extra></extra>'
+        ))
     
-    # 添加基线数据 - 红色（基础生物节律）
-    fig.add_trace(go.Scatter(
-        x=times,
-        y=baselines,
-        name='Baseline (Bio-Rhythm)',
-        mode='lines',
-        line=dict(color='rgba(239, 83, 80, 1)', width=2),
-        fill='tozeroy',
-        fillcolor='rgba(239, 83, 80, 0.28)',
-        hovertemplate='<b>时间</b>: %{x|%Y-%m-%d %H:%M:%S}<br><b>基线</b>: %{y:.2f}<extra></extra>'
-    ))
+        # 添加基线数据 - 红色（基础生物节律）
+        fig.add_trace(go.Scatter(
+            x=times,
+            y=baselines,
+            name='Baseline (Bio-Rhythm)',
+            mode='lines',
+            line=dict(color='rgba(239, 83, 80, 1)', width=2),
+            fill='tozeroy',
+            fillcolor='rgba(239, 83, 80, 0.28)',
+            hovertemplate='<b>时间</b>: %{x|%Y-%m-%d %H:%M:%S}<br><b>基线</b>: %{y:.2f}<extra></extra>'
+        ))
     
-    # 添加中线（0值线）用于参考
-    fig.add_hline(
-        y=0, 
-        line_dash="dash", 
-        line_color="rgba(150, 150, 150, 0.5)",
-        annotation_text="情绪中线",
-        annotation_position="right"
-    )
+        # 添加中线（0值线）用于参考
+        fig.add_hline(
+            y=0, 
+            line_dash="dash", 
+            line_color="rgba(150, 150, 150, 0.5)",
+            annotation_text="情绪中线",
+            annotation_position="right"
+        )
     
-    # 添加状态区域标记
-    # 积极区域 (y > 0.5)
-    fig.add_hrect(
-        y0=0.5, y1=max(moods) if moods else 1,
-        fillcolor="rgba(76, 175, 80, 0.1)", line_width=0,
-        annotation_text="✨ 积极区域", annotation_position="right",
-        layer="below"
-    )
+        # 添加状态区域标记
+        # 积极区域 (y > 0.5)
+        fig.add_hrect(
+            y0=0.5, y1=float(moods.max()),
+            fillcolor="rgba(76, 175, 80, 0.1)", line_width=0,
+            annotation_text="✨ 积极区域", annotation_position="right",
+            layer="below"
+        )
     
-    # 消极区域 (y < -0.5)
-    fig.add_hrect(
-        y0=min(moods) if moods else -1, y1=-0.5,
-        fillcolor="rgba(244, 67, 54, 0.1)", line_width=0,
-        annotation_text="🔴 消极区域", annotation_position="right",
-        layer="below"
-    )
+        # 消极区域 (y < -0.5)
+        fig.add_hrect(
+            y0=float(moods.min()), y1=-0.5,
+            fillcolor="rgba(244, 67, 54, 0.1)", line_width=0,
+            annotation_text="🔴 消极区域", annotation_position="right",
+            layer="below"
+        )
     
-    # 添加事件标记
-    if 'event_markers' in st.session_state and st.session_state['event_markers']:
-        for marker in st.session_state['event_markers']:
-            marker_time = marker['time']
-            marker_event = marker['event']
-            marker_amplitude = marker['amplitude']
-
-            # 在图表上添加竖线标记（marker_time 为 datetime）
-            fig.add_vline(
-                x=marker_time,
-                line_dash="dash",
-                line_color="rgba(255, 152, 0, 0.7)",
-                annotation_text=f"📍 {marker_event[:10]}",
-                annotation_position="top",
-                annotation_font_size=10,
-                annotation_font_color="orange"
-            )
-
-            # 找到与事件时间最接近的历史点用于标记 y 值
-            y_val = 0
-            try:
-                if times:
-                    closest_idx = min(range(len(times)), key=lambda i: abs((times[i] - marker_time).total_seconds()))
-                    y_val = moods[closest_idx]
-            except Exception:
-                y_val = 0
-
-            # 添加事件标记点
-            fig.add_trace(go.Scatter(
-                x=[marker_time],
-                y=[y_val],
-                mode='markers',
-                marker=dict(size=12, color='orange', symbol='star'),
-                name=f"事件: {marker_event[:15]}",
-                hovertemplate=f"<b>事件</b>: {marker_event}<br><b>幅度</b>: {marker_amplitude:+.2f}<extra></extra>",
-                showlegend=False
-            ))
+        # 添加事件标记：二分定位 y 值，按整个窗口的缩放聚合后画为一条散点轨迹 + 每组一条竖线
+        events = [m for m in st.session_state.get('event_markers', []) if isinstance(m.get('time'), datetime)]
+        if events:
+            event_seconds = np.array([datetime_to_seconds(m['time']) for m in events])
+            event_moods = marker_values(time_seconds, moods, event_seconds)
+            event_points = [{
+                'x': m['time'],
+                'y': float(y),
+                'label': f"📍 {m['event'][:10]}",
+                'text': f"<b>事件</b>: {m['event']}<br><b>幅度</b>: {m['amplitude']:+.2f}",
+                'color': 'rgba(255, 152, 0, 0.8)',
+            } for m, y in zip(events, event_moods)]
+            span = (max(time_seconds.max(), event_seconds.max())
+                    - min(time_seconds.min(), event_seconds.min()))
+            merged = summarize_clusters(event_points, cluster_markers(event_seconds, cluster_gap(span)))
+            fig.add_trace(marker_trace(merged))
+            fig.update_layout(shapes=list(fig.layout.shapes) + marker_shapes(merged))
     
-    # 更新图表布局 - 仿 lightweight-charts 样式
-    fig.update_layout(
-        title=dict(text='', x=0.5, xanchor='center'),
-        xaxis=dict(
-            title='模拟时间 (小时)',
-            gridcolor='rgba(200, 200, 200, 0.3)',
-            showgrid=True,
-            zeroline=False,
-            color='black'
-        ),
-        yaxis=dict(
-            title='心情值',
-            gridcolor='rgba(200, 200, 200, 0.3)',
-            showgrid=True,
-            zeroline=False,
-            color='black'
-        ),
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        font=dict(family='Arial', size=12, color='black'),
-        hovermode='x unified',
-        margin=dict(l=50, r=120, t=40, b=50),
-        height=450,
-        showlegend=True,
-        legend=dict(
-            x=0.02,
-            y=0.98,
-            bgcolor='rgba(255, 255, 255, 0.8)',
-            bordercolor='rgba(200, 200, 200, 0.5)',
-            borderwidth=1
+        # 更新图表布局 - 仿 lightweight-charts 样式
+        fig.update_layout(
+            title=dict(text='', x=0.5, xanchor='center'),
+            xaxis=dict(
+                title='模拟时间 (小时)',
+                gridcolor='rgba(200, 200, 200, 0.3)',
+                showgrid=True,
+                zeroline=False,
+                color='black'
+            ),
+            yaxis=dict(
+                title='心情值',
+                gridcolor='rgba(200, 200, 200, 0.3)',
+                showgrid=True,
+                zeroline=False,
+                color='black'
+            ),
+            plot_bgcolor='white',
+            paper_bgcolor='white',
+            font=dict(family='Arial', size=12, color='black'),
+            hovermode='x unified',
+            margin=dict(l=50, r=120, t=40, b=50),
+            height=450,
+            showlegend=True,
+            legend=dict(
+                x=0.02,
+                y=0.98,
+                bgcolor='rgba(255, 255, 255, 0.8)',
+                bordercolor='rgba(200, 200, 200, 0.5)',
+                borderwidth=1
+            )
         )
-    )
     
-    st.plotly_chart(fig, width='stretch')
-else:
-    st.info("等待数据更新中...")
-
-# 4.3 诊断与建议 [cite: 129]
-st.subheader("🩺 实时生物反馈与建议")
-
-# 获取诊断信息
-advice_list, state_tags = st.session_state['engine'].get_diagnosis()
-
-# 显示当前状态标签
-if state_tags:
-    st.markdown("**当前状态：**")
-    cols = st.columns(len(state_tags))
-    for idx, tag in enumerate(state_tags):
-        with cols[idx % len(cols)]:
-            if "积极" in tag:
-                st.success(f"✨ {tag}")
-            elif "疲劳" in tag or "消极" in tag:
-                st.error(f"🔴 {tag}")
-            elif "反刍" in tag:
-                st.warning(f"🟠 {tag}")
-            elif "波动" in tag:
-                st.warning(f"⚡ {tag}")
-            else:
-                st.info(f"ℹ️ {tag}")
+        st.plotly_chart(fig, width='stretch')
+    else:
+        st.info("等待数据更新中...")
+
+    # 4.3 诊断与建议 [cite: 129]
+    st.subheader("🩺 实时生物反馈与建议")
+
+    # 获取诊断信息
+    advice_list, state_tags = st.session_state['engine'].get_diagnosis()
+
+    # 显示当前状态标签
+    if state_tags:
+        st.markdown("**当前状态：**")
+        cols = st.columns(len(state_tags))
+        for idx, tag in enumerate(state_tags):
+            with cols[idx % len(cols)]:
+                if "积极" in tag:
+                    st.success(f"✨ {tag}")
+                elif "疲劳" in tag or "消极" in tag:
+                    st.error(f"🔴 {tag}")
+                elif "反刍" in tag:
+                    st.warning(f"🟠 {tag}")
+                elif "波动" in tag:
+                    st.warning(f"⚡ {tag}")
+                else:
+                    st.info(f"ℹ️ {tag}")
 
-st.divider()
+    st.divider()
 
-# 显示详细建议
-if advice_list:
-    for advice in advice_list:
-        # 根据内容类型选择显示方式
-        if "紧急" in advice or "强效干" in advice:
-            st.error(advice)
-        elif "严重" in advice:
-            st.warning(advice)
-        elif "缓解建议" in advice or "建议" in advice or "维持建议" in advice:
-            st.info(advice)
-        elif "积极" in advice or "✨" in advice:
-            st.success(advice)
-        else:
-            st.markdown(advice)
-else:
-    st.success("✅ 系统运行平稳，情绪处于健康平衡状态。")
+    # 显示详细建议
+    if advice_list:
+        for advice in advice_list:
+            # 根据内容类型选择显示方式
+            if "紧急" in advice or "强效干" in advice:
+                st.error(advice)
+            elif "严重" in advice:
+                st.warning(advice)
+            elif "缓解建议" in advice or "建议" in advice or "维持建议" in advice:
+                st.info(advice)
+            elif "积极" in advice or "✨" in advice:
+                st.success(advice)
+            else:
+                st.markdown(advice)
+    else:
+        st.success("✅ 系统运行平稳，情绪处于健康平衡状态。")
+
+render_dashboard()
 
 # --- 5. 参数自适应与反馈 (Optimize) ---
 st.divider()
@@ -450,13 +500,14 @@ with st.expander("告诉我你现在的真实感觉，帮助我学习"):
     user_feel = st.slider("你现在感觉如何？(-1 悲伤/疲惫, 1 兴奋/精力充沛)", -1.0, 1.0, 0.0)
     if st.button("提交反馈"):
         # 记录反馈
-        st.session_state['feedback_data'].append((sim_time_now, user_feel))
+        st.session_state['feedback_data'].append((current_sim_time(), user_feel))
         st.success("反馈已记录！")
         
         # 触发优化 [cite: 89]
         if len(st.session_state['feedback_data']) >= 3:
             new_params = optimize_parameters(st.session_state['engine'], st.session_state['feedback_data'])
             st.session_state['engine'].params = new_params
+            refresh_policy.notify_event()
             st.toast(f"参数已更新！个性化刚度 k: {new_params['k']:.2f}, 阻尼 c: {new_params['c']:.2f}")
             st.success("模型校准完成！参数已优化。")
 
@@ -507,7 +558,8 @@ if logs:
             '信息': log['message']
         })
     
-    # 显示为表格
+    # 显示为表格（pandas 在首次需要表格时才导入）
+    import pandas as pd
     with log_placeholder.container():
         st.dataframe(
             pd.DataFrame(log_data),
@@ -525,6 +577,7 @@ col_export1, col_export2 = st.columns(2)
 with col_export1:
     if st.button("📄 导出为CSV"):
         if logs:
+            import pandas as pd
             df_logs = pd.DataFrame([
                 {
                     '时间': log['timestamp'],
@@ -558,46 +611,45 @@ with col_export2:
 
 # 实时更新图表（使用 session history，非阻塞）
 st.title("实时更新图表")
-chart_placeholder = st.empty()
 
-# 从 session history 绘制最新的心情轨迹（随 autorefresh 更新）
+# 从 session history 绘制最新的心情轨迹，之后由浏览器按真实时间播放预测轨迹段（引擎由 render_dashboard 推进）
+# 增量组件：浏览器缓存图表，片段只在请求下一段、施加事件或重新同步时重跑
+@st.fragment
 def render_live_chart():
-    times = st.session_state['history']['time']
-    moods = st.session_state['history']['mood']
-    baselines = st.session_state['history']['baseline']
+    # 不再定时重跑：浏览器播放预测轨迹段，只在段快播完或施加事件后重跑
+    forecast = forecast_chunk()
+    history = st.session_state['history']
 
-    if not times:
-        chart_placeholder.info("等待数据更新中（历史为空）...")
+    if not len(history):
+        st.info("等待数据更新中（历史为空）...")
         return
-
-    fig_live = go.Figure()
-    fig_live.add_trace(go.Scatter(
-        x=times, y=moods, name='Mood (Total)', mode='lines+markers',
-        line=dict(color='rgba(38, 166, 154, 1)', width=2)
-    ))
-    fig_live.add_trace(go.Scatter(
-        x=times, y=baselines, name='Baseline', mode='lines',
-        line=dict(color='rgba(239, 83, 80, 1)', width=1)
-    ))
-
-    # 绘制事件标记（如果有）
-    for marker in st.session_state.get('event_markers', []):
-        t = marker.get('time')
-        ev = marker.get('event')
-        amp = marker.get('amplitude', 0)
-        try:
-            y_val = 0
-            if times:
-                closest_idx = min(range(len(times)), key=lambda i: abs((times[i] - t).total_seconds()))
-                y_val = moods[closest_idx]
-            fig_live.add_vline(x=t, line_dash='dash', line_color='rgba(255,152,0,0.7)')
-            fig_live.add_trace(go.Scatter(x=[t], y=[y_val], mode='markers', marker=dict(size=10, color='orange', symbol='star'),
-                                         name=f'事件: {ev}', hovertemplate=f"{ev}<br>幅度: {amp}"))
-        except Exception:
-            pass
-
-    fig_live.update_layout(title='实时心情曲线', xaxis_title='实际时间', yaxis_title='心情值', height=420)
-    chart_placeholder.plotly_chart(fig_live, width='stretch')
+    time_seconds = history.view('time')
+    moods = history.view('mood')
+
+    # 事件标记（如果有）：二分定位 y 值，浏览器端按当前缩放聚合为一条散点轨迹
+    events = [m for m in st.session_state.get('event_markers', []) if isinstance(m.get('time'), datetime)]
+    event_moods = marker_values(time_seconds, moods, [datetime_to_seconds(m['time']) for m in events])
+    markers = [{'x': m['time'], 'y': float(y), 'color': 'rgba(255,152,0,0.7)',
+                'text': f"{m.get('event')}<br>幅度: {m.get('amplitude', 0)}"}
+               for m, y in zip(events, event_moods)]
+
+    live_chart(
+        key="live_chart",
+        source=ring_source(history, 'time', ('mood', 'baseline'), seconds_to_datetime64),
+        traces=[
+            dict(name='Mood (Total)', mode='lines+markers',
+                 line=dict(color='rgba(38, 166, 154, 1)', width=2)),
+            dict(name='Baseline', mode='lines',
+                 line=dict(color='rgba(239, 83, 80, 1)', width=1)),
+        ],
+        layout=dict(title=dict(text='实时心情曲线'), xaxis=dict(title=dict(text='实际时间')),
+                    yaxis=dict(title=dict(text='心情值'))),
+        markers=markers,
+        window=history.capacity,
+        height=420,
+        series_id=st.session_state['history_series'],
+        forecast=forecast,
+    )
 
 render_live_chart()
 
@@ -626,15 +678,17 @@ def save_model_params(params, filename="model_params.json"):
         json.dump(params, f, ensure_ascii=False, indent=4)
     st.sidebar.success(f"建模参数已保存到 {filepath}")
 
+def _history_columns(history):
+    """按时间顺序导出曲线历史（time 为 ISO 字符串）"""
+    columns = history.to_dict()
+    columns['time'] = [t.isoformat() for t in seconds_to_datetime64(history.view('time')).tolist()]
+    return columns
+
 def save_session_data(filename="session_data.json"):
     """保存整个会话数据（history + event_markers + params）到JSON"""
     filepath = os.path.join(SAVE_DIR, filename)
     data = {
-        'history': {
-            'time': [t.isoformat() for t in st.session_state['history']['time']],
-            'mood': st.session_state['history']['mood'],
-            'baseline': st.session_state['history']['baseline']
-        },
+        'history': _history_columns(st.session_state['history']),
         'event_markers': [
             {**{k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in m.items()}}
             for m in st.session_state.get('event_markers', [])
@@ -654,18 +708,15 @@ def load_session_data(filename="session_data.json"):
         data = json.load(f)
 
     # 恢复 history
-    hist = data.get('history', {})
-    times = hist.get('time', [])
-    moods = hist.get('mood', [])
-    baselines = hist.get('baseline', [])
+    hist = dict(data.get('history', {}))
     try:
-        st.session_state['history'] = {
-            'time': [datetime.fromisoformat(t) for t in times],
-            'mood': moods,
-            'baseline': baselines
-        }
+        hist['time'] = [datetime_to_seconds(datetime.fromisoformat(t)) for t in hist.get('time', [])]
+        # 旧格式只有 time/mood/baseline，缺少的字段记为 NaN
+        st.session_state['history'] = RingBuffer.from_columns(
+            HISTORY_CAPACITY, hist, fields=st.session_state['history'].fields)
     except Exception:
-        st.session_state['history'] = {'time': [], 'mood': [], 'baseline': []}
+        st.session_state['history'] = RingBuffer(HISTORY_CAPACITY)
+    st.session_state['history_series'] = time.time()
 
     # 恢复 events
     events = data.get('event_markers', [])
@@ -698,13 +749,10 @@ if st.sidebar.button("加载会话数据"):
 
 if st.sidebar.button("导出会话为CSV"):
     # 导出 history 和 events 为 CSV 并提供下载
-    hist = st.session_state.get('history', {'time': [], 'mood': [], 'baseline': []})
-    if hist['time']:
-        df_hist = pd.DataFrame({
-            'time': [t.isoformat() for t in hist['time']],
-            'mood': hist['mood'],
-            'baseline': hist['baseline']
-        })
+    import pandas as pd
+    hist = st.session_state['history']
+    if len(hist):
+        df_hist = pd.DataFrame(_history_columns(hist))
         csv_hist = df_hist.to_csv(index=False)
         st.sidebar.download_button(label='⬇️ 下载 history CSV', data=csv_hist, file_name='history.csv')
     else:
@@ -725,4 +773,7 @@ if st.sidebar.button("导出会话为CSV"):
 if st.sidebar.button('备份会话数据（带时间戳）'):
     ts = datetime.now().strftime('%Y%m%d_%H%M%S')
     save_session_data(filename=f'session_data_{ts}.json')
-    st.sidebar.success('已备份会话数据')
\ No newline at end of file
+    st.sidebar.success('已备份会话数据')
+
+# 本会话 session_state 的估算内存（Prometheus 指标 bio_session_state_bytes）
+observe_session_state(st.session_state)
@@ -4,17 +4,23 @@
 """
 
 import streamlit as st
-import time
-import json
-import pandas as pd
-import numpy as np
+import os
 from datetime import datetime, timedelta
+from functools import partial
 import plotly.graph_objects as go
 
 # 导入自定义模块
 from bio_model import BioEngine, StreamlitLogger, analyze_event_with_deepseek, analyze_event_with_gemini
 from db_module import Database
 from auth import AuthManager
+from wearable_import import EngineReplayer, import_wearable_file
+from query_stats import query_stats
+from simulation_scheduler import get_scheduler
+from shared_state import get_state_plane
+from live_chart import live_chart
+from downsample import METHODS, mood_trend
+from perf_timing import PerfTimings, perf_timings, profiler, timer
+from metrics import observe_session_state, start_exporters
 
 # ===== 页面配置 =====
 st.set_page_config(
@@ -48,9 +54,32 @@ st.markdown("""
 
 # ===== 初始化 =====
 
+def create_database() -> Database:
+    """按环境变量创建数据库连接（会话与仿真调度线程各自持有一个；MySQL 连接池在进程内共享）"""
+    if os.environ.get("DATABASE_TYPE") == "mysql":
+        return Database(
+            db_type="mysql",
+            mysql_config={
+                'host': os.environ.get("DATABASE_HOST", "localhost"),
+                'port': int(os.environ.get("DATABASE_PORT", "3306")),
+                'user': os.environ.get("DATABASE_USER", "root"),
+                'password': os.environ.get("DATABASE_PASSWORD", ""),
+                'database': os.environ.get("DATABASE_NAME", "bio_mood"),
+                'pool_size': int(os.environ.get("DATABASE_POOL_SIZE", "8")),
+            },
+            archive_dir=os.environ.get("MOOD_ARCHIVE_DIR") or None
+        )
+    return Database(
+        db_type="sqlite",
+        db_path="bio_mood.db",
+        archive_dir=os.environ.get("MOOD_ARCHIVE_DIR") or None,
+        shard_count=int(os.environ["DATABASE_SHARDS"]) if os.environ.get("DATABASE_SHARDS") else None
+    )
+
+
 # 初始化数据库
 if 'db' not in st.session_state:
-    st.session_state.db = Database(db_type="sqlite", db_path="bio_mood.db")
+    st.session_state.db = create_database()
 
 # 初始化认证管理器
 if 'auth_manager' not in st.session_state:
@@ -59,9 +88,23 @@ if 'auth_manager' not in st.session_state:
 db = st.session_state.db
 auth_manager = st.session_state.auth_manager
 
+# 进程级仿真调度器：后台线程按固定 tick 批量推进所有在线孪生（1秒 = 10分钟模拟时间）
+# 设置 STATE_PLANE_NAME 后，同机的多个服务进程通过共享内存状态平面共享孪生状态
+scheduler = get_scheduler(tick_seconds=1.0, time_scale=10 * 60, persist_every=10,
+                          db_factory=create_database,
+                          state_plane=get_state_plane() if os.environ.get("STATE_PLANE_NAME") else None)
+
 # 初始化会话状态
 auth_manager.init_session_state()
 
+# Prometheus 指标导出（按 METRICS_PORT / METRICS_FILE，进程内只启动一次）
+start_exporters()
+
+# 会话级计时：本次重跑中各计时点的耗时同时计入当前会话自己的统计
+if 'perf_timings' not in st.session_state:
+    st.session_state.perf_timings = PerfTimings()
+perf_timings.bind_session(st.session_state.perf_timings)
+
 # ===== 主程序逻辑 =====
 
 def main():
@@ -88,22 +131,30 @@ def main():
         return
     
     # ===== 已认证用户的主界面 =====
+    # pandas 只在登录后的表格和导出中使用，登录页不为它付出导入时间
+    import pandas as pd
     
     # 显示用户资料和登出按钮
     auth_manager.show_user_profile()
     
-    # 初始化用户特定的引擎和数据
-    if 'engine' not in st.session_state:
+    user_id = st.session_state.user_id
+    
+    def create_engine():
         # 从数据库加载用户的个性化参数
-        user_params = db.get_user_parameters(st.session_state.user_id)
+        user_params = db.get_user_parameters(user_id)
         
         engine = BioEngine()
         if user_params:
             engine.params.update(user_params)
-        
-        st.session_state['engine'] = engine
-        st.session_state['start_real_time'] = time.time()
-        st.session_state['history'] = {'time': [], 'mood': [], 'baseline': []}
+        return engine
+    
+    # 每次重跑都从调度器取得孪生（同一用户的多个标签页共用一个；闲置时换出到数据库，再次访问自动恢复）
+    # 引擎归调度器所有，这里只读；修改必须经 scheduler.locked()
+    twin = scheduler.register(user_id, create_engine)
+    
+    # 初始化用户特定的会话数据
+    if st.session_state.get('twin_user_id') != user_id:
+        st.session_state['twin_user_id'] = user_id
         st.session_state['feedback_data'] = []
         st.session_state['event_markers'] = []
         st.session_state['logger'] = StreamlitLogger()
@@ -135,8 +186,25 @@ def main():
         st.subheader("生理数据")
         hrv_input = st.slider("当前 HRV (rMSSD)", 10, 100, 50)
         if st.button("更新 HRV"):
-            st.session_state['engine'].apply_event('hrv_update', hrv_input)
-            st.success(f"HRV参数已映射: k={st.session_state['engine'].params['k']:.1f}, c={st.session_state['engine'].params['c']:.1f}")
+            with scheduler.locked(user_id) as engine:
+                engine.apply_event('hrv_update', hrv_input)
+            st.success(f"HRV参数已映射: k={engine.params['k']:.1f}, c={engine.params['c']:.1f}")
+        
+        # 可穿戴设备批量导入（流式分块写入并回放到引擎）
+        wearable_file = st.file_uploader("导入可穿戴设备数据", type=['csv', 'json', 'jsonl'],
+                                         help="HRV (rMSSD) / 睡眠时段导出文件")
+        if wearable_file is not None and st.button("📥 导入并回放"):
+            with st.spinner("正在导入..."):
+                try:
+                    # 只在复制引擎与写回校准参数时持有孪生锁，解析、入库与回放都在锁外
+                    with twin.lock:
+                        replayer = EngineReplayer(twin.engine)
+                    result = import_wearable_file(db, user_id, wearable_file, replayer=replayer)
+                    with scheduler.locked(user_id) as engine:
+                        replayer.apply(engine)
+                    st.success(f"已导入 {result['imported']} 个样本（拒绝 {result['rejected']} 条）")
+                except Exception as e:
+                    st.error(f"❌ 导入失败: {e}")
         
         # 快速事件按钮
         st.subheader("快速事件")
@@ -144,37 +212,41 @@ def main():
         
         with col1:
             if st.button("☕ 喝咖啡"):
-                st.session_state['engine'].state[0] *= 0.6
+                with scheduler.locked(user_id) as engine:
+                    engine.state[0] *= 0.6
                 db.add_event(st.session_state.user_id, 'caffeine', '喝咖啡')
                 st.toast("咖啡因生效：睡眠压力暂时降低")
             
             if st.button("🏃 运动"):
-                st.session_state['engine'].apply_event('exercise')
+                with scheduler.locked(user_id) as engine:
+                    engine.apply_event('exercise')
                 db.add_event(st.session_state.user_id, 'exercise', '运动')
                 st.toast("运动释放内啡肽！")
         
         with col2:
             if st.button("🤯 压力事件"):
-                st.session_state['engine'].apply_event('stress_event')
+                with scheduler.locked(user_id) as engine:
+                    engine.apply_event('stress_event')
                 db.add_event(st.session_state.user_id, 'stress', '压力事件')
                 st.toast("受到压力冲击！")
             
             if st.button("🧘 冥想"):
-                st.session_state['engine'].state[2] = 0
-                st.session_state['engine'].params['c'] += 2.0
+                with scheduler.locked(user_id) as engine:
+                    engine.state[2] = 0
+                    engine.params['c'] += 2.0
                 db.add_event(st.session_state.user_id, 'meditation', '冥想')
                 st.toast("系统强制平静 (阻尼增加)")
         
         st.divider()
         
         # 睡眠切换
-        is_sleeping = st.toggle("正在睡眠模式", value=st.session_state['engine'].is_asleep)
-        if is_sleeping != st.session_state['engine'].is_asleep:
+        is_sleeping = st.toggle("正在睡眠模式", value=twin.engine.is_asleep)
+        if is_sleeping != twin.engine.is_asleep:
+            with scheduler.locked(user_id) as engine:
+                engine.apply_event('sleep_start' if is_sleeping else 'sleep_end')
             if is_sleeping:
-                st.session_state['engine'].apply_event('sleep_start')
                 db.add_event(st.session_state.user_id, 'sleep_start', '开始睡眠')
             else:
-                st.session_state['engine'].apply_event('sleep_end')
                 db.add_event(st.session_state.user_id, 'sleep_end', '睡眠结束')
             st.rerun()
         
@@ -210,7 +282,7 @@ def main():
         if st.session_state['ai_analysis_status'] == 'analyzing':
             with st.spinner("AI正在分析事件影响..."):
                 try:
-                    hrv = st.session_state['engine'].params['c']
+                    hrv = twin.engine.params['c']
                     feedback = st.session_state['feedback_data'][-5:]
                     logger = st.session_state['logger']
                     
@@ -226,7 +298,9 @@ def main():
                         explanation = analysis.get('explanation', '')
                         
                         # 应用事件影响
-                        st.session_state['engine'].state[2] += amplitude
+                        with scheduler.locked(user_id) as engine:
+                            engine.state[2] += amplitude
+                            current_time = engine.last_update_time
                         
                         # 保存到数据库
                         db.add_event(
@@ -242,7 +316,6 @@ def main():
                         if 'event_markers' not in st.session_state:
                             st.session_state['event_markers'] = []
                         
-                        current_time = st.session_state['engine'].last_update_time
                         st.session_state['event_markers'].append({
                             'time': current_time,
                             'event': custom_event,
@@ -293,41 +366,12 @@ def main():
             st.info("💭 输入事件描述，点击分析获得AI评估")
     
     # ===== 核心循环 =====
-    # 使用Streamlit的自动刷新而非st_autorefresh库（避免频繁刷新问题）
-    # 时间推进
-    current_real_time = time.time()
-    time_scale = 10 * 60  # 1秒 = 10分钟模拟时间
-    elapsed_real = current_real_time - st.session_state['start_real_time']
-    sim_time_now = 8.0 + (elapsed_real * time_scale / 3600.0)
-    
-    # 引擎步进
-    dt = sim_time_now - st.session_state['engine'].last_update_time
-    if dt > 0:
-        st.session_state['engine'].step(dt)
-        
-        mood, base, x, S = st.session_state['engine'].get_mood_value(sim_time_now)
-        st.session_state['history']['time'].append(sim_time_now)
-        st.session_state['history']['mood'].append(mood)
-        st.session_state['history']['baseline'].append(base)
-        
-        # 每10步保存一次到数据库
-        if len(st.session_state['history']['time']) % 10 == 0:
-            db.add_mood_record(
-                st.session_state.user_id,
-                mood,
-                baseline=base,
-                sleep_pressure=S,
-                hrv_value=st.session_state['engine'].params['c'],
-                parameters=st.session_state['engine'].params.copy()
-            )
-        
-        # 限制历史数据
-        if len(st.session_state['history']['time']) > 288:
-            for k in st.session_state['history']:
-                st.session_state['history'][k].pop(0)
+    # 引擎由后台调度线程推进并持久化，页面重跑只读取最新快照
+    snapshot = scheduler.snapshot(user_id)
+    sim_time_now = snapshot.sim_time
     
     # ===== 仪表盘 =====
-    mood_now, base_now, x_now, S_now = st.session_state['engine'].get_mood_value(sim_time_now)
+    mood_now, base_now, x_now, S_now = snapshot.mood, snapshot.baseline, snapshot.x, snapshot.S
     
     col_a, col_b, col_c, col_d = st.columns(4)
     col_a.metric("当前心情值", f"{mood_now:.2f}", delta=f"{x_now:.2f} (偏差)")
@@ -338,82 +382,69 @@ def main():
     # ===== 曲线图 =====
     st.subheader("📈 心情动力学曲线")
     
-    if len(st.session_state['history']['time']) > 0:
-        fig = go.Figure()
-        
-        times = st.session_state['history']['time']
-        moods = st.session_state['history']['mood']
-        baselines = st.session_state['history']['baseline']
-        
-        # 主曲线
-        fig.add_trace(go.Scatter(
-            x=times, y=moods,
-            name='Mood (Total)',
-            mode='lines',
-            line=dict(color='rgba(38, 166, 154, 1)', width=3),
-            fill='tozeroy',
-            fillcolor='rgba(38, 166, 154, 0.2)'
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=times, y=baselines,
-            name='Baseline (Bio-Rhythm)',
-            mode='lines',
-            line=dict(color='rgba(239, 83, 80, 1)', width=2, dash='dash')
-        ))
-        
-        fig.add_hline(y=0, line_dash="dash", line_color="rgba(150, 150, 150, 0.3)", annotation_text="基准线")
-        
-        # 添加事件标记（增强版）
-        if 'event_markers' in st.session_state and st.session_state['event_markers']:
-            for i, marker in enumerate(st.session_state['event_markers']):
-                marker_time = marker['time']
-                marker_event = marker['event']
-                amplitude = marker['amplitude']
-                
-                # 根据影响确定颜色和符号
-                if amplitude > 0:
-                    marker_color = 'rgba(76, 175, 80, 0.8)'  # 绿色：积极
-                    marker_symbol = '▲'
-                elif amplitude < 0:
-                    marker_color = 'rgba(244, 67, 54, 0.8)'   # 红色：消极
-                    marker_symbol = '▼'
-                else:
-                    marker_color = 'rgba(255, 193, 7, 0.8)'   # 黄色：中性
-                    marker_symbol = '●'
-                
-                # 竖线标记
-                fig.add_vline(
-                    x=marker_time,
-                    line_dash="dash",
-                    line_color=marker_color,
-                    line_width=2,
-                    annotation_text=f"{marker_symbol} {marker_event[:8]}",
-                    annotation_position="top",
-                    annotation_font=dict(size=10, color=marker_color)
-                )
-        
-        fig.update_layout(
-            title="实时心情变化曲线 (事件自动标记)",
-            xaxis_title='模拟时间 (小时)',
-            yaxis_title='心情值',
-            plot_bgcolor='rgba(240, 240, 240, 0.5)',
-            paper_bgcolor='white',
-            hovermode='x unified',
+    if twin.history.total > 0:
+        # 事件标记（增强版）
+        markers = []
+        for marker in st.session_state.get('event_markers', []):
+            amplitude = marker['amplitude']
+            
+            # 根据影响确定颜色和符号
+            if amplitude > 0:
+                marker_color = 'rgba(76, 175, 80, 0.8)'  # 绿色：积极
+                marker_symbol = '▲'
+            elif amplitude < 0:
+                marker_color = 'rgba(244, 67, 54, 0.8)'   # 红色：消极
+                marker_symbol = '▼'
+            else:
+                marker_color = 'rgba(255, 193, 7, 0.8)'   # 黄色：中性
+                marker_symbol = '●'
+            
+            markers.append({
+                'x': marker['time'],
+                'label': f"{marker_symbol} {marker['event'][:8]}",
+                'color': marker_color,
+            })
+        
+        # 增量图表：浏览器缓存布局和已有的点，每次重跑只发送新增的点
+        live_chart(
+            key="dynamics_chart",
+            source=partial(scheduler.history_since, user_id),
+            traces=[
+                # 主曲线
+                dict(name='Mood (Total)', mode='lines',
+                     line=dict(color='rgba(38, 166, 154, 1)', width=3),
+                     fill='tozeroy', fillcolor='rgba(38, 166, 154, 0.2)'),
+                dict(name='Baseline (Bio-Rhythm)', mode='lines',
+                     line=dict(color='rgba(239, 83, 80, 1)', width=2, dash='dash')),
+            ],
+            layout=dict(
+                title=dict(text="实时心情变化曲线 (事件自动标记)"),
+                xaxis=dict(title=dict(text='模拟时间 (小时)')),
+                yaxis=dict(title=dict(text='心情值')),
+                plot_bgcolor='rgba(240, 240, 240, 0.5)',
+                paper_bgcolor='white',
+                hovermode='x unified',
+                showlegend=True,
+                legend=dict(
+                    orientation="v",
+                    yanchor="top",
+                    y=0.99,
+                    xanchor="left",
+                    x=0.01,
+                    bgcolor="rgba(255, 255, 255, 0.8)"
+                ),
+                # 基准线
+                shapes=[dict(type='line', xref='paper', x0=0, x1=1, yref='y', y0=0, y1=0,
+                             line=dict(dash='dash', color='rgba(150, 150, 150, 0.3)'))],
+                annotations=[dict(xref='paper', x=1, yref='y', y=0, text='基准线', showarrow=False,
+                                  xanchor='right', yanchor='bottom')],
+            ),
+            markers=markers,
+            window=scheduler.history_size,
             height=500,
-            showlegend=True,
-            legend=dict(
-                orientation="v",
-                yanchor="top",
-                y=0.99,
-                xanchor="left",
-                x=0.01,
-                bgcolor="rgba(255, 255, 255, 0.8)"
-            )
+            series_id=twin.series_id,
         )
         
-        st.plotly_chart(fig, width='stretch')
-        
         # 显示事件列表
         if 'event_markers' in st.session_state and st.session_state['event_markers']:
             st.markdown("#### 📍 标记事件列表")
@@ -433,7 +464,7 @@ def main():
     # ===== 诊断建议 =====
     st.subheader("🩺 实时生物反馈与建议")
     
-    advice_list, state_tags = st.session_state['engine'].get_diagnosis()
+    advice_list, state_tags = twin.engine.get_diagnosis()
     
     if state_tags:
         cols = st.columns(len(state_tags))
@@ -466,7 +497,10 @@ def main():
     st.divider()
     st.subheader("📊 我的数据中心")
     
-    tab1, tab2, tab3, tab4 = st.tabs(["📈 统计分析", "📝 心情历史", "📅 事件记录", "⚙️ 参数设置"])
+    tab_names = ["📈 统计分析", "📝 心情历史", "📅 事件记录", "⚙️ 参数设置"]
+    if auth_manager.is_admin():
+        tab_names += ["🛠 查询统计", "⏱ 性能计时"]
+    tab1, tab2, tab3, tab4, *admin_tabs = st.tabs(tab_names)
     
     with tab1:
         st.markdown("### 心情统计")
@@ -475,6 +509,13 @@ def main():
         col1, col2, col3 = st.columns(3)
         with col1:
             days = st.selectbox("选择时间范围", [7, 14, 30], index=0)
+        with col2:
+            # 图表宽度（像素）决定降采样的目标点数
+            trend_width = st.selectbox("曲线分辨率", [600, 1200, 2400], index=1,
+                                       format_func=lambda w: f"{w} px")
+        with col3:
+            trend_method = st.selectbox("降采样方法", METHODS, index=0,
+                                        format_func={'lttb': 'LTTB', 'minmax': '最小/最大'}.get)
         
         # 获取统计数据
         stats = db.get_mood_statistics(st.session_state.user_id, days=days)
@@ -487,26 +528,76 @@ def main():
         
         st.markdown("---")
         
-        # 心情分布图
-        mood_history = db.get_mood_history(st.session_state.user_id, days=days, limit=100)
+        # 心情趋势：降采样折线 + 最小/最大包络（冲击窄峰保留在包络中）
+        trend = mood_trend(db, st.session_state.user_id, days, width_px=trend_width, method=trend_method)
+        if trend['raw_points']:
+            envelope = trend['envelope']
+            with timer('figure.mood_trend'):
+                fig_trend = go.Figure()
+                fig_trend.add_trace(go.Scatter(
+                    x=envelope['x'], y=envelope['max'], mode='lines', line=dict(width=0),
+                    showlegend=False, hoverinfo='skip'
+                ))
+                fig_trend.add_trace(go.Scatter(
+                    x=envelope['x'], y=envelope['min'], mode='lines', line=dict(width=0),
+                    fill='tonexty', fillcolor='rgba(38, 166, 154, 0.2)', name='最小/最大包络',
+                    hoverinfo='skip'
+                ))
+                fig_trend.add_trace(go.Scatter(
+                    x=trend['x'], y=trend['y'], mode='lines', name='心情值',
+                    line=dict(color='rgba(38, 166, 154, 1)', width=1.5)
+                ))
+                fig_trend.update_layout(
+                    title=f"心情趋势（{trend['raw_points']} 条记录 → {len(trend['x'])} 点）",
+                    xaxis_title="时间 (UTC)",
+                    yaxis_title="心情值",
+                    height=400
+                )
+            st.plotly_chart(fig_trend, width='stretch')
         
-        if mood_history:
-            mood_values = [m['mood_value'] for m in mood_history]
-            
-            fig_dist = go.Figure()
-            fig_dist.add_trace(go.Histogram(x=mood_values, nbinsx=20, name='Mood Distribution'))
-            fig_dist.update_layout(
-                title="心情值分布",
-                xaxis_title="心情值",
-                yaxis_title="频次",
-                height=400
-            )
+        # 心情分布图（列式读取，直接得到 NumPy 数组）
+        series = db.get_mood_series(
+            st.session_state.user_id,
+            start=datetime.utcnow() - timedelta(days=days),
+            columns=('mood_value',)
+        )
+        mood_values = series['mood_value']
+        
+        if len(mood_values):
+            with timer('figure.mood_distribution'):
+                fig_dist = go.Figure()
+                fig_dist.add_trace(go.Histogram(x=mood_values, nbinsx=20, name='Mood Distribution'))
+                fig_dist.update_layout(
+                    title="心情值分布",
+                    xaxis_title="心情值",
+                    yaxis_title="频次",
+                    height=400
+                )
             st.plotly_chart(fig_dist, width='stretch')
     
     with tab2:
         st.markdown("### 心情记录")
         
-        mood_history = db.get_mood_history(st.session_state.user_id, limit=50)
+        # 键集分页：保存每一页的起始游标，支持前后翻页
+        if 'mood_page_cursors' not in st.session_state:
+            st.session_state['mood_page_cursors'] = [None]
+        mood_cursors = st.session_state['mood_page_cursors']
+        
+        mood_history, next_mood_cursor = db.get_mood_history_page(
+            st.session_state.user_id, page_size=50, cursor=mood_cursors[-1]
+        )
+        
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("← 上一页", key="mood_prev", disabled=len(mood_cursors) == 1):
+                mood_cursors.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"第 {len(mood_cursors)} 页")
+        with col_next:
+            if st.button("下一页 →", key="mood_next", disabled=next_mood_cursor is None):
+                mood_cursors.append(next_mood_cursor)
+                st.rerun()
         
         if mood_history:
             df_mood = pd.DataFrame([
@@ -536,7 +627,25 @@ def main():
     with tab3:
         st.markdown("### 事件记录")
         
-        events = db.get_events(st.session_state.user_id, limit=50)
+        if 'event_page_cursors' not in st.session_state:
+            st.session_state['event_page_cursors'] = [None]
+        event_cursors = st.session_state['event_page_cursors']
+        
+        events, next_event_cursor = db.get_events_page(
+            st.session_state.user_id, page_size=50, cursor=event_cursors[-1]
+        )
+        
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("← 上一页", key="event_prev", disabled=len(event_cursors) == 1):
+                event_cursors.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"第 {len(event_cursors)} 页")
+        with col_next:
+            if st.button("下一页 →", key="event_next", disabled=next_event_cursor is None):
+                event_cursors.append(next_event_cursor)
+                st.rerun()
         
         if events:
             df_events = pd.DataFrame([
@@ -587,10 +696,85 @@ def main():
                 
                 if success:
                     # 更新本地引擎参数
-                    st.session_state['engine'].params.update(new_params)
+                    with scheduler.locked(user_id) as engine:
+                        engine.params.update(new_params)
                     st.success("✅ 参数已保存！")
                 else:
                     st.error(f"❌ {msg}")
+    
+    # 管理员：数据库查询统计
+    if admin_tabs:
+        with admin_tabs[0]:
+            st.markdown(f"### 数据库查询统计（慢查询阈值 {query_stats.slow_ms:.0f} ms）")
+            
+            by_tag = query_stats.by_tag()
+            if by_tag:
+                st.markdown("**按方法汇总**")
+                st.dataframe(pd.DataFrame(by_tag), width='stretch', hide_index=True)
+                
+                st.markdown("**按语句**")
+                statements = pd.DataFrame(query_stats.snapshot())
+                statements['tags'] = statements['tags'].apply(', '.join)
+                statements['plan'] = statements['plan'].apply(lambda p: '; '.join(p) if p else '')
+                st.dataframe(
+                    statements[['tags', 'count', 'rows', 'errors', 'total_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'sql', 'plan']],
+                    width='stretch', hide_index=True
+                )
+            else:
+                st.info("暂无统计数据")
+            
+            col_dump, col_reset = st.columns([3, 1])
+            with col_dump:
+                st.download_button("📥 导出 JSON", query_stats.dump_json(),
+                                   file_name="query_stats.json", mime="application/json")
+            with col_reset:
+                if st.button("🔄 重置统计"):
+                    query_stats.reset()
+                    st.rerun()
+        
+        with admin_tabs[1]:
+            render_perf_panel()
+
+# 管理员：热点路径计时与采样剖析
+def render_perf_panel():
+    import pandas as pd
+    st.markdown("### 热点路径计时")
+    st.caption(f"分位数按每个计时点最近 {perf_timings.window} 个样本计算；次数、总耗时、最大值为累计值")
+    columns = ['name', 'count', 'total_ms', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'last_ms']
+    for title, timings in (("**本进程**", perf_timings), ("**当前会话**", st.session_state.perf_timings)):
+        st.markdown(title)
+        rows = timings.snapshot()
+        if rows:
+            st.dataframe(pd.DataFrame(rows)[columns], width='stretch', hide_index=True)
+        else:
+            st.info("暂无计时数据")
+
+    st.markdown("### 采样剖析")
+    enabled = st.toggle(f"开启采样剖析（间隔 {profiler.interval_ms:.0f} ms，只采计时区间内的线程）",
+                        value=profiler.running)
+    if enabled and not profiler.running:
+        profiler.start()
+    elif not enabled and profiler.running:
+        profiler.stop()
+    report = profiler.report()
+    if report:
+        st.caption(f"共 {profiler.samples} 次采样")
+        st.dataframe(pd.DataFrame(report), width='stretch', hide_index=True)
+    elif enabled:
+        st.info("采样中，刷新页面查看结果")
+
+    col_dump, col_reset = st.columns([3, 1])
+    with col_dump:
+        st.download_button("📥 导出原始计时 (JSONL)", perf_timings.dump_jsonl(),
+                           file_name="perf_timings.jsonl", mime="application/x-ndjson")
+    with col_reset:
+        if st.button("🔄 重置计时"):
+            perf_timings.reset()
+            st.session_state.perf_timings.reset()
+            profiler.reset()
+            st.rerun()
 
 if __name__ == "__main__":
-    main()
+    with timer('rerun'):
+        main()
+    observe_session_state(st.session_state)
@@ -5,8 +5,13 @@
 
 import streamlit as st
 import hashlib
+import os
 from datetime import datetime
-from database import Database
+from db_module import Database
+from session_tokens import token_signer
+
+# 会话令牌所在的 URL 查询参数名
+SESSION_PARAM = "session"
 
 class AuthManager:
     """认证和会话管理"""
@@ -30,6 +35,32 @@ class AuthManager:
             st.session_state.username = None
         if 'user_info' not in st.session_state:
             st.session_state.user_info = None
+        
+        # 新标签页/断线重连：用签名令牌在内存中恢复登录，不查询密码、不写数据库
+        if not st.session_state.authenticated:
+            self.resume_session()
+    
+    def resume_session(self) -> bool:
+        """校验 URL 中的会话令牌，有效时恢复登录状态"""
+        verified = token_signer.verify(st.query_params.get(SESSION_PARAM))
+        if verified is None:
+            return False
+        
+        user_id, username, epoch = verified
+        # 账户状态与会话纪元每次直接查库：用户已被删除、禁用或已登出时令牌作废
+        if self.db.get_session_epoch(user_id) != epoch:
+            return False
+        user_info = self.db.get_user_info(user_id)
+        if user_info is None:
+            return False
+        
+        st.session_state.authenticated = True
+        st.session_state.user_id = user_id
+        st.session_state.username = username
+        st.session_state.user_info = user_info
+        # last_login 仅记入批量写入队列
+        self.db.record_login(user_id)
+        return True
     
     def register_page(self):
         """注册页面"""
@@ -116,6 +147,8 @@ class AuthManager:
                     st.session_state.user_id = user_id
                     st.session_state.username = username
                     st.session_state.user_info = self.db.get_user_info(user_id)
+                    st.query_params[SESSION_PARAM] = token_signer.issue(
+                        user_id, username, self.db.get_session_epoch(user_id) or 0)
                     
                     st.success(f"✅ {message}")
                     st.balloons()
@@ -137,14 +170,23 @@ class AuthManager:
         </div>
         """, unsafe_allow_html=True)
     
+    @staticmethod
+    def is_admin() -> bool:
+        """当前用户是否为管理员（环境变量 ADMIN_USERNAMES，逗号分隔）"""
+        admins = {name.strip() for name in os.environ.get("ADMIN_USERNAMES", "").split(",") if name.strip()}
+        return bool(st.session_state.get('authenticated')) and st.session_state.get('username') in admins
+    
     def logout(self):
         """登出"""
+        # 持久化作废：递增会话纪元，其它进程和重启后的进程同样拒绝旧令牌
+        if st.session_state.get('user_id') is not None:
+            self.db.revoke_sessions(st.session_state.user_id)
+        st.query_params.pop(SESSION_PARAM, None)
         st.session_state.authenticated = False
         st.session_state.user_id = None
         st.session_state.username = None
         st.session_state.user_info = None
-        st.session_state.pop('engine', None)
-        st.session_state.pop('history', None)
+        st.session_state.pop('twin_user_id', None)
         st.rerun()
     
     def show_user_profile(self):
@@ -0,0 +1,123 @@
+"""
+冷启动导入时间基准
+
+用 python -X importtime 测量各入口在打开页面之前必须付出的导入时间，并与
+cold_start_budget.json 中记录的预算比较，超出预算时以非零状态退出（可放进 CI）。
+
+  - 模块（bio_model.py）: 直接 import
+  - 入口脚本（app.py / app_multiuser.py）: 执行时会渲染页面，这里只按源码顺序执行其
+    模块顶层的 import 语句（ast 提取），函数内的延迟导入不计入
+  - 每个入口在独立的新进程中测量，减去空解释器（-c pass）的导入时间，取多次的中位数
+
+用法:
+    python bench_cold_start.py                      # 每个入口测 5 次，与预算比较
+    python bench_cold_start.py --repeat 9 --top 15  # 同时列出最慢的 15 个顶层导入
+    python bench_cold_start.py --update-budget      # 以当前中位数 × 1.25 重写预算文件
+"""
+
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BUDGET_FILE = os.path.join(ROOT, "cold_start_budget.json")
+ENTRY_POINTS = ("app.py", "app_multiuser.py", "bio_model.py")
+# --update-budget 时在中位数之上预留的余量
+BUDGET_HEADROOM = 1.25
+
+
+def import_code(entry: str) -> str:
+    """入口对应的导入代码：模块直接导入，入口脚本只取顶层 import 语句"""
+    if entry == "bio_model.py":
+        return "import bio_model"
+    with open(os.path.join(ROOT, entry), encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=entry)
+    return "\n".join(ast.unparse(node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def measure(code: str):
+    """
+    在新进程中执行 code 并解析 -X importtime 输出
+
+    返回: (总导入时间 ms, {顶层模块: 累计 ms})
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    total_us = 0
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total_us += int(self_us)
+        if not name[1:].startswith(" "):
+            # 缩进为 0 的是本次直接触发的导入
+            top_level[name.strip()] = int(cumulative_us) / 1000
+    return total_us / 1000, top_level
+
+
+def bench(entry: str, repeat: int, baseline_ms: float):
+    """返回 (中位数 ms, 各次 ms, 最后一次的顶层导入明细)"""
+    code = import_code(entry)
+    measure(code)  # 预热: 生成 .pyc，避免首轮计入编译时间
+    runs, top_level = [], {}
+    for _ in range(repeat):
+        total, top_level = measure(code)
+        runs.append(total - baseline_ms)
+    return statistics.median(runs), runs, top_level
+
+
+def load_budget() -> dict:
+    if not os.path.exists(BUDGET_FILE):
+        return {}
+    with open(BUDGET_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口冷启动导入时间基准")
+    parser.add_argument("entries", nargs="*", default=list(ENTRY_POINTS), help="要测量的入口")
+    parser.add_argument("--repeat", type=int, default=5, help="每个入口测量次数")
+    parser.add_argument("--top", type=int, default=8, help="列出最慢的顶层导入个数")
+    parser.add_argument("--update-budget", action="store_true", help="按本次结果重写预算文件")
+    args = parser.parse_args()
+
+    baseline_ms = statistics.median(measure("pass")[0] for _ in range(args.repeat))
+    print(f"解释器基线: {baseline_ms:.1f} ms（已从下列结果中扣除）")
+
+    budget = load_budget()
+    over = []
+    for entry in args.entries:
+        median, runs, top_level = bench(entry, args.repeat, baseline_ms)
+        limit = budget.get(entry, {}).get("budget_ms")
+        status = "无预算" if limit is None else ("超出预算" if median > limit else "通过")
+        limit_text = "-" if limit is None else f"{limit:.0f} ms"
+        print(f"\n{entry}: 中位数 {median:.1f} ms（{min(runs):.1f} ~ {max(runs):.1f}），"
+              f"预算 {limit_text}，{status}")
+        for name, ms in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {ms:9.1f} ms  {name}")
+        if limit is not None and median > limit:
+            over.append(entry)
+        if args.update_budget:
+            budget[entry] = {"measured_ms": round(median, 1),
+                             "budget_ms": round(median * BUDGET_HEADROOM)}
+
+    if args.update_budget:
+        with open(BUDGET_FILE, "w", encoding="utf-8") as f:
+            json.dump(budget, f, ensure_ascii=False, indent=4)
+            f.write("\n")
+        print(f"\n预算已写入 {BUDGET_FILE}")
+    elif over:
+        print(f"\n超出预算: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
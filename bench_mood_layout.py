@@ -0,0 +1,192 @@
+"""
+心情记录存储布局基准测试
+
+对比两种布局在同一份合成数据上的用户时间范围查询性能:
+  rowid:     mood_records (文本时间戳) + idx_mood_user_time 二级索引
+  clustered: mood_timeseries (user_id, ts_epoch_ms) WITHOUT ROWID 聚簇表
+
+合成数据模拟多用户交替写入（与线上一致：每个用户每隔固定间隔写一条），
+因此 rowid 布局中同一用户的行分散在整棵 B-tree 上。
+
+用法:
+    python bench_mood_layout.py                      # 默认 5000 万行（需较长时间和约 10GB 磁盘）
+    python bench_mood_layout.py --rows 2000000 --users 200 --keep
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+ROWID_DDL = """
+    CREATE TABLE mood_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        mood_value REAL NOT NULL,
+        baseline REAL,
+        sleep_pressure REAL,
+        hrv_value REAL,
+        parameters TEXT,
+        notes TEXT
+    )
+"""
+ROWID_INDEX = "CREATE INDEX idx_mood_user_time ON mood_records(user_id, timestamp DESC)"
+
+CLUSTERED_DDL = """
+    CREATE TABLE mood_timeseries (
+        user_id INTEGER NOT NULL,
+        ts_epoch_ms INTEGER NOT NULL,
+        mood_value REAL NOT NULL,
+        baseline REAL,
+        sleep_pressure REAL,
+        hrv_value REAL,
+        parameters TEXT,
+        notes TEXT,
+        PRIMARY KEY (user_id, ts_epoch_ms)
+    ) WITHOUT ROWID
+"""
+
+# 每条记录都携带一份参数快照，与 add_mood_record 的实际写入一致
+PARAMS_JSON = ('{"tau_r": 17.0, "tau_d": 5.5, "circadian_k": 0.1, "circadian_amplitude": 0.3, '
+               '"k": 12.0, "c": 3.5, "m": 1.0, "phi": 0.0, "base_hrv": 50.0}')
+
+
+def synthetic_rows(n_rows, n_users, interval_s, start_s, chunk=100_000):
+    """按时间交替生成各用户的记录，分块产出 (user_id, epoch_s, mood, baseline, S, hrv)"""
+    rng = np.random.default_rng(42)
+    produced = 0
+    while produced < n_rows:
+        n = min(chunk, n_rows - produced)
+        idx = np.arange(produced, produced + n)
+        user_ids = idx % n_users + 1
+        epoch_s = start_s + (idx // n_users) * interval_s
+        values = rng.normal(0.5, 0.3, size=(n, 4))
+        yield user_ids, epoch_s, values
+        produced += n
+
+
+def open_bulk(path):
+    """批量导入时关闭日志与同步，只为缩短建库时间"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    return conn
+
+
+def build_rowid(path, args, start_s):
+    conn = open_bulk(path)
+    conn.execute(ROWID_DDL)
+    conn.execute(ROWID_INDEX)
+    for user_ids, epoch_s, values in synthetic_rows(args.rows, args.users, args.interval, start_s):
+        stamps = np.datetime_as_string(epoch_s.astype('datetime64[s]'), unit='s')
+        conn.executemany(
+            "INSERT INTO mood_records (user_id, timestamp, mood_value, baseline, sleep_pressure, hrv_value, parameters)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((int(u), str(t).replace('T', ' '), *map(float, v), PARAMS_JSON)
+             for u, t, v in zip(user_ids, stamps, values))
+        )
+        conn.commit()
+    conn.close()
+
+
+def build_clustered(path, args, start_s):
+    conn = open_bulk(path)
+    conn.execute(CLUSTERED_DDL)
+    for user_ids, epoch_s, values in synthetic_rows(args.rows, args.users, args.interval, start_s):
+        conn.executemany(
+            "INSERT INTO mood_timeseries (user_id, ts_epoch_ms, mood_value, baseline, sleep_pressure, hrv_value, parameters)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((int(u), int(t) * 1000, *map(float, v), PARAMS_JSON)
+             for u, t, v in zip(user_ids, epoch_s, values))
+        )
+        conn.commit()
+    conn.close()
+
+
+def run_queries(path, layout, queries):
+    """对每个 (user_id, 起, 止) 查询取出 mood_value 列，返回每次耗时 (ms) 与总行数"""
+    conn = sqlite3.connect(path)
+    if layout == 'rowid':
+        sql = ("SELECT timestamp, mood_value FROM mood_records "
+               "WHERE user_id=? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp")
+    else:
+        sql = ("SELECT ts_epoch_ms, mood_value FROM mood_timeseries "
+               "WHERE user_id=? AND ts_epoch_ms >= ? AND ts_epoch_ms < ? ORDER BY ts_epoch_ms")
+
+    timings = []
+    total_rows = 0
+    for user_id, lo_s, hi_s in queries:
+        if layout == 'rowid':
+            lo = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(lo_s))
+            hi = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(hi_s))
+        else:
+            lo, hi = lo_s * 1000, hi_s * 1000
+        t0 = time.perf_counter()
+        rows = conn.execute(sql, (user_id, lo, hi)).fetchall()
+        timings.append((time.perf_counter() - t0) * 1000)
+        total_rows += len(rows)
+    conn.close()
+    return np.array(timings), total_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rowid vs 聚簇布局 心情记录查询基准")
+    parser.add_argument('--rows', type=int, default=50_000_000, help="合成记录总数")
+    parser.add_argument('--users', type=int, default=2000, help="用户数")
+    parser.add_argument('--interval', type=int, default=60, help="同一用户两条记录的间隔 (秒)")
+    parser.add_argument('--queries', type=int, default=200, help="随机范围查询次数")
+    parser.add_argument('--range-days', type=float, default=7.0, help="每次查询的时间跨度 (天)")
+    parser.add_argument('--dir', default=None, help="数据库文件目录 (默认临时目录)")
+    parser.add_argument('--keep', action='store_true', help="保留生成的数据库文件")
+    args = parser.parse_args()
+
+    workdir = args.dir or tempfile.mkdtemp(prefix='bio_mood_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    start_s = 1_700_000_000
+    span_s = (args.rows // args.users) * args.interval
+
+    rng = random.Random(7)
+    range_s = int(args.range_days * 86400)
+    queries = []
+    for _ in range(args.queries):
+        lo = start_s + rng.randint(0, max(span_s - range_s, 0))
+        queries.append((rng.randint(1, args.users), lo, lo + range_s))
+
+    print(f"数据: {args.rows:,} 行, {args.users} 个用户, 每用户跨度 {span_s / 86400:.1f} 天")
+    print(f"查询: {args.queries} 次随机用户的 {args.range_days:g} 天范围\n")
+
+    results = {}
+    for layout, builder in (('rowid', build_rowid), ('clustered', build_clustered)):
+        path = os.path.join(workdir, f"{layout}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        t0 = time.perf_counter()
+        builder(path, args, start_s)
+        build_s = time.perf_counter() - t0
+        size_mb = os.path.getsize(path) / 1e6
+
+        # 第一轮预热页缓存，第二轮计时
+        run_queries(path, layout, queries)
+        timings, n_rows = run_queries(path, layout, queries)
+        results[layout] = timings
+        print(f"[{layout:9s}] 建库 {build_s:7.1f}s | 文件 {size_mb:9.1f} MB | "
+              f"查询 p50 {np.percentile(timings, 50):7.2f} ms  p95 {np.percentile(timings, 95):7.2f} ms  "
+              f"| 平均返回 {n_rows / len(queries):.0f} 行")
+
+        if not args.keep:
+            os.remove(path)
+
+    speedup = np.median(results['rowid']) / max(np.median(results['clustered']), 1e-9)
+    print(f"\n聚簇布局中位数加速比: {speedup:.2f}x")
+    if args.keep:
+        print(f"数据库文件保留在: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+分片存储写入吞吐基准
+
+模拟多个在线会话并发写心情记录：每个线程持有自己的 Database 实例
+（与 Streamlit 每个会话一个实例一致），为各自的用户循环调用 add_mood_record。
+对比不同分片数下的总写入吞吐与失败（锁超时）次数。
+
+用法:
+    python bench_shard_writes.py                          # 1 / 2 / 4 / 8 分片, 8 个写线程
+    python bench_shard_writes.py --threads 16 --writes 500 --shards 1 4 16
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from db_module import Database
+
+
+def run(shard_count, args, workdir):
+    path = os.path.join(workdir, f"shards{shard_count}", "bio_mood.db")
+    os.makedirs(os.path.dirname(path))
+
+    setup = Database(db_type="sqlite", db_path=path, shard_count=shard_count)
+    user_ids = []
+    for i in range(args.threads):
+        setup.register_user_simple(f"bench{i}", f"bench{i}@example.com", "pw")
+        user_ids.append(setup.login_user_simple(f"bench{i}", "pw")[1])
+    setup.close()
+
+    failures = [0] * args.threads
+    barrier = threading.Barrier(args.threads + 1)
+
+    def writer(slot, user_id):
+        db = Database(db_type="sqlite", db_path=path)
+        barrier.wait()
+        for n in range(args.writes):
+            ok, _ = db.add_mood_record(user_id, 0.5, 0.5, 0.3, 50.0, {'k': 12.0}, notes=str(n))
+            if not ok:
+                failures[slot] += 1
+        db.close()
+
+    threads = [threading.Thread(target=writer, args=(i, uid)) for i, uid in enumerate(user_ids)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    used = len({Database.shard_index(uid, shard_count) for uid in user_ids}) if shard_count > 1 else 1
+    total = args.threads * args.writes - sum(failures)
+    return total / elapsed, sum(failures), used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片数 vs 并发写入吞吐")
+    parser.add_argument('--threads', type=int, default=8, help="并发写线程（会话）数")
+    parser.add_argument('--writes', type=int, default=200, help="每个线程的写入次数")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8], help="要测试的分片数")
+    parser.add_argument('--dir', default=None, help="数据库目录 (默认临时目录)")
+    args = parser.parse_args()
+
+    workdir = args.dir or tempfile.mkdtemp(prefix='bio_mood_shards_')
+    print(f"{args.threads} 个写线程 × {args.writes} 次 add_mood_record\n")
+
+    baseline = None
+    try:
+        for shard_count in args.shards:
+            rate, failures, used = run(shard_count, args, workdir)
+            baseline = baseline or rate
+            print(f"[{shard_count:3d} 分片] 实际使用 {used:3d} 个 | {rate:9.0f} 条/秒 "
+                  f"| 相对 {rate / baseline:5.2f}x | 失败 {failures}")
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
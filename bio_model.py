@@ -1,19 +1,15 @@
 import numpy as np
-from scipy.integrate import solve_ivp
-from scipy.optimize import minimize
-import pandas as pd
-from datetime import datetime, timedelta
-import requests
-import streamlit as st
-from streamlit_autorefresh import st_autorefresh
+from datetime import datetime
 import time
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import io
-import sys
-import json
-from contextlib import redirect_stdout
-import os
+
+from metrics import ai_errors_total, engine_steps_total
+from perf_timing import timed
+
+# 冷启动: scipy（积分器、矩阵指数、优化器）和 requests 在首次使用时才导入，
+# 登录页和只做批量积分（step_engines）的调度器不为它们付出导入时间
+
+# NumPy 2.0 起 trapz 更名为 trapezoid
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
 
 
 # ... 初始化部分保持不变 ...
@@ -129,6 +125,16 @@ class BioEngine:
         self.state = [0.1, 0.0, 0.0] 
         self.is_asleep = False
         self.last_update_time = 0 # 模拟时间的追踪
+        # 修订号：施加事件时递增；与参数、睡眠状态一起构成 revision_key，用于判断预测轨迹是否失效
+        self.revision = 0
+
+    def mark_changed(self):
+        """在 apply_event 之外直接修改 state 后调用，使已发出的预测轨迹失效"""
+        self.revision += 1
+
+    def revision_key(self):
+        """事件、参数或睡眠状态任一变化都会改变的标识（两次事件之间动力学是确定的）"""
+        return (self.revision, self.is_asleep, tuple(sorted(self.params.items())))
 
     def circadian_process(self, t):
         """
@@ -228,11 +234,13 @@ class BioEngine:
         
         return [dS, dx, dv]
 
+    @timed('engine.step')
     def step(self, duration_hours):
         """向前模拟指定时长的步进"""
         t_span = (self.last_update_time, self.last_update_time + duration_hours)
         
         # 求解微分方程 [cite: 118]
+        from scipy.integrate import solve_ivp
         sol = solve_ivp(
             fun=self.derivatives,
             t_span=t_span,
@@ -244,8 +252,69 @@ class BioEngine:
         # 更新状态
         self.state = sol.y[:, -1]
         self.last_update_time += duration_hours
+        engine_steps_total.labels(mode='single').inc()
         return sol
 
+    def predict_trajectory(self, duration_hours, points):
+        """
+        从当前状态预测未来轨迹（不修改引擎）
+
+        假设期间没有新事件：一次积分得到稠密解，再在 points 个等间隔时刻（含起点）取值。
+        返回: {'t': 模拟时间, 'mood', 'baseline', 'S', 'x'}（NumPy 数组）
+        """
+        t0 = self.last_update_time
+        t = np.linspace(t0, t0 + duration_hours, points)
+        from scipy.integrate import solve_ivp
+        sol = solve_ivp(
+            fun=self.derivatives,
+            t_span=(t0, t0 + duration_hours),
+            y0=np.array(self.state, dtype=float),
+            method='RK45',
+            dense_output=True
+        )
+        S, x, _ = sol.sol(t)
+        baseline = self.circadian_process(t) - self.params.get('circadian_k', 0.1) * S + 0.5
+        return {'t': t, 'mood': baseline + x, 'baseline': baseline, 'S': S, 'x': x}
+
+    def fast_forward(self, duration_hours):
+        """
+        解析快进指定时长（不做逐步积分），用于恢复长时间离线的孪生
+
+        - S: 清醒期为闭式指数解；睡眠期 S = S0 * exp(-∫dt / (tau_d * 调制)),
+             昼夜调制以 24 小时为周期，整周期部分只积分一次
+        - (x, v): 线性 DHO，用矩阵指数 exp(A*t) 精确推进
+        """
+        if duration_hours <= 0:
+            return
+        t0 = self.last_update_time
+        S, x, v = self.state
+
+        if self.is_asleep:
+            S = S * np.exp(-self._sleep_rate_integral(t0, t0 + duration_hours) / self.params['tau_d'])
+        else:
+            S = 1.0 - (1.0 - S) * np.exp(-duration_hours / self.params['tau_r'])
+
+        from scipy.linalg import expm
+        k, c, m = self.params['k'], self.params['c'], self.params['m']
+        A = np.array([[0.0, 1.0], [-k / m, -c / m]])
+        x, v = expm(A * duration_hours) @ np.array([x, v], dtype=float)
+
+        self.state = np.array([S, x, v], dtype=float)
+        self.last_update_time = t0 + duration_hours
+
+    def _sleep_rate_integral(self, t0, t1, points_per_hour=60):
+        """睡眠期衰减速率 1/调制 在 [t0, t1] 上的积分"""
+        def integrate(a, b):
+            t = np.linspace(a, b, max(int((b - a) * points_per_hour), 1) + 1)
+            C = self.circadian_process(t)
+            return _trapezoid(np.where(C < 0, 1.0 / (1.0 + 0.3 * np.abs(C)), 1.0), t)
+
+        periods, remainder = divmod(t1 - t0, 24.0)
+        total = integrate(t0, t0 + remainder)
+        if periods:
+            total += periods * integrate(t0, t0 + 24.0)
+        return total
+
     def get_mood_value(self, t_now):
         """
         计算综合心情值
@@ -313,6 +382,7 @@ class BioEngine:
         4. stress_event: 应激事件 -> 施加负向脉冲
         5. exercise: 运动 -> 施加正向脉冲
         """
+        self.revision += 1
         S, x, v = self.state
         
         if event_type == 'sleep_start':
@@ -557,6 +627,60 @@ class BioEngine:
             
         return advice, state_tags
 
+
+@timed('engine.step_batch')
+def step_engines(engines, durations, max_substep=0.05):
+    """
+    批量步进多个引擎（向量化固定步长 RK4）
+
+    与 BioEngine.derivatives 相同的方程，所有引擎的状态和参数拼成数组后一起积分，
+    调度器每个 tick 只做一次 NumPy 计算，而不是每个引擎各调用一次 solve_ivp。
+
+    参数:
+        engines: BioEngine 列表
+        durations: 每个引擎的步进时长 (小时)，标量或与 engines 等长的序列
+        max_substep: 最大积分步长 (小时)，DHO 周期约 1.8h，0.05h 足以保证精度
+    """
+    if not engines:
+        return
+
+    durations = np.broadcast_to(np.asarray(durations, dtype=float), (len(engines),))
+    n_sub = max(1, int(np.ceil(durations.max() / max_substep)))
+    h = durations / n_sub
+
+    y = np.array([engine.state for engine in engines], dtype=float)
+    t = np.array([engine.last_update_time for engine in engines], dtype=float)
+    asleep = np.array([engine.is_asleep for engine in engines])
+
+    def param(name):
+        return np.array([engine.params[name] for engine in engines], dtype=float)
+
+    tau_r, tau_d = param('tau_r'), param('tau_d')
+    k, c, m = param('k'), param('c'), param('m')
+    phi, amplitude = param('phi'), param('circadian_amplitude')
+    omega = 2 * np.pi / 24.0
+
+    def derivatives(t, y):
+        S, x, v = y[:, 0], y[:, 1], y[:, 2]
+        C = amplitude * np.sin(omega * t + phi) + (amplitude / 3.0) * np.sin(2 * omega * t + phi + np.pi)
+        dS = np.where(asleep, -S / tau_d, (1.0 - S) / tau_r)
+        dS = np.where(asleep & (C < 0), dS / (1.0 + 0.3 * np.abs(C)), dS)
+        return np.stack([dS, v, -(c * v + k * x) / m], axis=1)
+
+    hc = h[:, None]
+    for _ in range(n_sub):
+        k1 = derivatives(t, y)
+        k2 = derivatives(t + h / 2, y + hc / 2 * k1)
+        k3 = derivatives(t + h / 2, y + hc / 2 * k2)
+        k4 = derivatives(t + h, y + hc * k3)
+        y = y + hc / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        t = t + h
+
+    for i, engine in enumerate(engines):
+        engine.state = y[i]
+        engine.last_update_time += durations[i]
+    engine_steps_total.labels(mode='batch').inc(len(engines))
+
 def optimize_parameters(engine, feedback_history):
     """
     engine: 当前的 BioEngine 实例
@@ -564,6 +688,8 @@ def optimize_parameters(engine, feedback_history):
     """
     if len(feedback_history) < 3:
         return engine.params # 数据太少，不优化
+
+    from scipy.optimize import minimize
         
     print("正在根据用户反馈优化参数...")
     
@@ -616,7 +742,18 @@ def optimize_parameters(engine, feedback_history):
     else:
         return engine.params
 
+def _default_analysis(event_description, provider):
+    """API 不可用时的默认分析（计入该提供方的失败次数）"""
+    ai_errors_total.labels(provider=provider).inc()
+    return {
+        "amplitude": -2.0 if "压力" in event_description or "吵架" in event_description else 1.0,
+        "duration": 1.0,
+        "parameters": {},
+        "explanation": "默认分析 - API暂时不可用"
+    }
+
 # Function to query SiliconFlow API for event analysis
+@timed('ai.siliconflow')
 def analyze_event_with_deepseek(event_description, hrv, feedback_history, logger=None):
     """
     Analyze the impact of an event on mood modeling using SiliconFlow API.
@@ -631,6 +768,7 @@ def analyze_event_with_deepseek(event_description, hrv, feedback_history, logger
         dict: Impact analysis including amplitude, duration, and parameter adjustments.
     """
     import json as json_module
+    import requests
     import urllib3
     
     # 压制SSL警告
@@ -742,14 +880,10 @@ def analyze_event_with_deepseek(event_description, hrv, feedback_history, logger
             break
     
     # 返回默认分析
-    return {
-        "amplitude": -2.0 if "压力" in event_description or "吵架" in event_description else 1.0,
-        "duration": 1.0,
-        "parameters": {},
-        "explanation": "默认分析 - API暂时不可用"
-    }
+    return _default_analysis(event_description, 'siliconflow')
 
 # Function to query Gemini API for event analysis
+@timed('ai.gemini')
 def analyze_event_with_gemini(event_description, hrv, feedback_history, logger=None):
     """
     Analyze the impact of an event on mood modeling using Google Gemini API.
@@ -771,6 +905,7 @@ def analyze_event_with_gemini(event_description, hrv, feedback_history, logger=N
     except ImportError:
         if logger:
             logger.error("❌ google-genai 包未安装，请运行: pip install google-genai")
+        ai_errors_total.labels(provider='gemini').inc()
         return {}
     
     if logger:
@@ -850,9 +985,4 @@ def analyze_event_with_gemini(event_description, hrv, feedback_history, logger=N
                 break
     
     # 返回默认分析
-    return {
-        "amplitude": -2.0 if "压力" in event_description or "吵架" in event_description else 1.0,
-        "duration": 1.0,
-        "parameters": {},
-        "explanation": "默认分析 - API暂时不可用"
-    }
+    return _default_analysis(event_description, 'gemini')
@@ -0,0 +1,120 @@
+"""
+事件标记布局
+  - 定位: nearest_indices 在有序时间轴上二分查找（np.searchsorted）最近的历史点，
+    每个标记 O(log n)，不再逐点比较整个历史
+  - 聚合: cluster_markers 把在当前缩放下相距不足 min_gap_px 像素的标记合并为一组，
+    图上每组只画一个点、一条竖线
+  - 单一轨迹: marker_trace 把全部（聚合后的）标记放进一条 Scatter，每个点有独立的悬停文本
+
+浏览器端增量图表（live_chart_frontend/index.html）用同样的规则在缩放时重新聚合。
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+import plotly.graph_objects as go
+
+# 默认绘图区宽度（像素）与标记最小间距（像素）
+DEFAULT_WIDTH_PX = 800
+DEFAULT_MIN_GAP_PX = 14
+# 多个颜色不同的标记聚合后使用的颜色
+MIXED_COLOR = 'rgba(120, 120, 120, 0.8)'
+
+
+def nearest_indices(times: Sequence[float], targets: Sequence[float]) -> np.ndarray:
+    """
+    各目标时间在有序时间轴上最近点的下标（二分查找）
+
+    参数:
+        times: 升序时间轴（数值）
+        targets: 目标时间
+    返回: 与 targets 等长的下标数组；times 为空时返回空数组
+    """
+    times = np.asarray(times, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    if times.size == 0:
+        return np.empty(0, dtype=int)
+    right = np.minimum(np.searchsorted(times, targets), times.size - 1)
+    left = np.maximum(right - 1, 0)
+    return np.where(np.abs(targets - times[left]) <= np.abs(times[right] - targets), left, right)
+
+
+def marker_values(times: Sequence[float], values: Sequence[float], targets: Sequence[float]) -> np.ndarray:
+    """各目标时间处曲线的值（取最近的历史点）；历史为空时全为 NaN"""
+    index = nearest_indices(times, targets)
+    if index.size == 0:
+        return np.full(len(targets), np.nan)
+    return np.asarray(values, dtype=float)[index]
+
+
+def cluster_gap(span: float, width_px: float = DEFAULT_WIDTH_PX,
+                min_gap_px: float = DEFAULT_MIN_GAP_PX) -> float:
+    """当前缩放下 min_gap_px 像素对应的横轴距离（span 为可见范围的横轴长度）"""
+    return span * min_gap_px / width_px if width_px > 0 else 0.0
+
+
+def cluster_markers(xs: Sequence[float], gap: float) -> List[List[int]]:
+    """
+    按横轴位置聚合标记
+
+    从最早的标记开始，与组内第一个标记相距不超过 gap 的标记并入同一组（不会无限串联）。
+    返回: 每组的标记下标（按时间排序）
+    """
+    xs = np.asarray(xs, dtype=float)
+    clusters: List[List[int]] = []
+    anchor = None
+    for index in np.argsort(xs, kind='stable').tolist():
+        if anchor is None or xs[index] - anchor > gap:
+            clusters.append([])
+            anchor = xs[index]
+        clusters[-1].append(index)
+    return clusters
+
+
+def summarize_clusters(markers: List[Dict], clusters: List[List[int]]) -> List[Dict]:
+    """
+    把每组标记合并为一个绘制点
+
+    参数:
+        markers: [{'x', 'y'(可选), 'label', 'text', 'color'}]
+    返回: [{'x', 'y', 'label', 'text', 'color', 'count'}]，位置取组内居中的标记
+    """
+    merged = []
+    for members in clusters:
+        center = markers[members[len(members) // 2]]
+        colors = {markers[i].get('color') for i in members}
+        texts = [markers[i].get('text') or markers[i].get('label', '') for i in members]
+        merged.append({
+            'x': center['x'],
+            'y': center.get('y'),
+            'label': center.get('label', '') if len(members) == 1 else f"{len(members)} 个事件",
+            'text': '<br>'.join(texts),
+            'color': colors.pop() if len(colors) == 1 else MIXED_COLOR,
+            'count': len(members),
+        })
+    return merged
+
+
+def marker_trace(merged: List[Dict], name: str = '事件', symbol: str = 'star') -> go.Scatter:
+    """全部（聚合后的）标记的单条散点轨迹，点大小随组内标记数增大"""
+    points = [m for m in merged if m.get('y') is not None and not np.isnan(m['y'])]
+    return go.Scatter(
+        x=[m['x'] for m in points],
+        y=[m['y'] for m in points],
+        mode='markers+text',
+        text=[m['label'] for m in points],
+        textposition='top center',
+        textfont=dict(size=10),
+        hovertext=[m['text'] for m in points],
+        hovertemplate='%{hovertext}<extra></extra>',
+        marker=dict(size=[min(10 + 2 * (m['count'] - 1), 24) for m in points],
+                    color=[m['color'] for m in points], symbol=symbol),
+        name=name,
+        showlegend=False,
+    )
+
+
+def marker_shapes(merged: List[Dict], dash: str = 'dash', width: int = 2) -> List[Dict]:
+    """每组一条贯穿绘图区的竖线（布局 shapes）"""
+    return [dict(type='line', xref='x', yref='paper', x0=m['x'], x1=m['x'], y0=0, y1=1,
+                 line=dict(dash=dash, width=width, color=m['color'])) for m in merged]
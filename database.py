@@ -6,11 +6,17 @@
 
 import sqlite3
 import os
+import sys
+import logging
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 import hashlib
 import json
 
+from query_stats import InstrumentedCursor, query_stats
+
+logger = logging.getLogger(__name__)
+
 class Database:
     """数据库操作类"""
     
@@ -27,6 +33,7 @@ class Database:
         self.db_type = db_type
         self.db_path = db_path
         self.mysql_config = mysql_config
+        self.query_stats = query_stats
         
         if db_type == "sqlite":
             self.conn = sqlite3.connect(db_path, check_same_thread=False)
@@ -46,6 +53,11 @@ class Database:
         
         self.init_tables()
     
+    def _cursor(self) -> InstrumentedCursor:
+        """计时游标：以调用方方法名作为统计标签（见 query_stats.py）"""
+        return InstrumentedCursor(self.conn.cursor(), self.query_stats, conn=self.conn,
+                                  db_type=self.db_type, tag=sys._getframe(1).f_code.co_name)
+    
     @staticmethod
     def hash_password(password: str) -> str:
         """简单的SHA256密码哈希"""
@@ -53,7 +65,7 @@ class Database:
     
     def init_tables(self):
         """初始化数据表"""
-        cursor = self.conn.cursor()
+        cursor = self._cursor()
         
         if self.db_type == "sqlite":
             # 用户表
@@ -140,7 +152,7 @@ class Database:
         返回: (成功, 消息)
         """
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             # 检查用户是否存在
             cursor.execute("SELECT id FROM users WHERE username=? OR email=?", 
@@ -178,7 +190,7 @@ class Database:
         返回: (成功, user_id, 消息)
         """
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             # 查询用户
             cursor.execute("""
@@ -216,7 +228,7 @@ class Database:
         返回: (成功, 消息)
         """
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             # 检查用户是否存在
             cursor.execute("SELECT id FROM users WHERE username=? OR email=?", 
@@ -254,7 +266,7 @@ class Database:
         返回: (成功, user_id, 消息)
         """
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             # 查询用户
             cursor.execute("""
@@ -289,7 +301,7 @@ class Database:
     def get_user_info(self, user_id: int) -> Optional[Dict]:
         """获取用户信息"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             cursor.execute("""
                 SELECT id, username, email, created_at, last_login, preferences 
                 FROM users WHERE id=?
@@ -318,7 +330,7 @@ class Database:
                     'preferences': json.loads(row[5] or '{}')
                 }
         except Exception as e:
-            print(f"获取用户信息失败: {e}")
+            logger.error("获取用户信息失败: %s", e)
             return None
     
     # ===== 心情记录 =====
@@ -329,7 +341,7 @@ class Database:
                        notes: str = None) -> Tuple[bool, str]:
         """添加心情记录"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             params_json = json.dumps(parameters) if parameters else None
             
@@ -356,7 +368,7 @@ class Database:
             days: 过去N天的记录 (None=全部)
         """
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             if days:
                 query = """
@@ -405,13 +417,13 @@ class Database:
             return records
             
         except Exception as e:
-            print(f"获取心情历史失败: {e}")
+            logger.error("获取心情历史失败: %s", e)
             return []
     
     def get_mood_statistics(self, user_id: int, days: int = 7) -> Dict:
         """获取心情统计数据"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             cursor.execute("""
                 SELECT 
@@ -440,7 +452,7 @@ class Database:
                     'count': row[3]
                 }
         except Exception as e:
-            print(f"获取统计数据失败: {e}")
+            logger.error("获取统计数据失败: %s", e)
             return {'average': 0, 'max': 0, 'min': 0, 'count': 0}
     
     # ===== 事件记录 =====
@@ -450,7 +462,7 @@ class Database:
                  duration: float = None, ai_analysis: dict = None) -> Tuple[bool, str]:
         """添加事件记录"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             ai_json = json.dumps(ai_analysis) if ai_analysis else None
             
@@ -470,7 +482,7 @@ class Database:
                   days: int = None) -> List[Dict]:
         """获取用户事件历史"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             if days:
                 cursor.execute("""
@@ -515,7 +527,7 @@ class Database:
             return events
             
         except Exception as e:
-            print(f"获取事件历史失败: {e}")
+            logger.error("获取事件历史失败: %s", e)
             return []
     
     # ===== 用户参数 =====
@@ -523,7 +535,7 @@ class Database:
     def get_user_parameters(self, user_id: int) -> Dict:
         """获取用户个性化参数"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             cursor.execute("""
                 SELECT tau_r, tau_d, circadian_k, circadian_amplitude, k, c, m, base_hrv, phi
                 FROM user_parameters 
@@ -560,13 +572,13 @@ class Database:
                     'phi': row[8]
                 }
         except Exception as e:
-            print(f"获取用户参数失败: {e}")
+            logger.error("获取用户参数失败: %s", e)
             return None
     
     def update_user_parameters(self, user_id: int, params: Dict) -> Tuple[bool, str]:
         """更新用户个性化参数"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             update_fields = []
             values = []
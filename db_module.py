@@ -6,36 +6,404 @@
 
 import sqlite3
 import os
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+import sys
+import logging
+import time
+import threading
+import weakref
+import atexit
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, List, Dict, Optional, Tuple, Iterator
 import hashlib
 import json
+import numpy as np
+
+from query_stats import InstrumentedCursor, query_stats
+from metrics import register_cache
+
+logger = logging.getLogger(__name__)
+
+# 列式查询支持的心情记录列及其 NumPy 类型
+MOOD_SERIES_DTYPES = {
+    'id': np.int64,
+    'timestamp': 'datetime64[ms]',
+    'mood_value': np.float64,
+    'baseline': np.float64,
+    'sleep_pressure': np.float64,
+    'hrv_value': np.float64,
+    'parameters': object,
+    'notes': object,
+}
+DEFAULT_SERIES_COLUMNS = ('timestamp', 'mood_value', 'baseline', 'sleep_pressure', 'hrv_value')
+
+# 心情记录存储布局
+#   rowid:     mood_records，文本时间戳 + (user_id, timestamp) 二级索引
+#   clustered: mood_timeseries，以 (user_id, ts_epoch_ms) 为主键的 WITHOUT ROWID 聚簇表，
+#              同一用户的时间范围在 B-tree 中连续存放
+MOOD_LAYOUTS = ('rowid', 'clustered')
+
+# 按 user_id 分片存放的用户数据表（分片模式下只有 users 留在主库）
+SHARDED_TABLES = ('mood_records', 'mood_timeseries', 'events', 'user_parameters',
+                  'wearable_samples', 'engine_state')
+
+# 聚簇布局下对外保持与 mood_records 相同的列名（id 即 ts_epoch_ms）
+_CLUSTERED_SELECT = """
+    ts_epoch_ms AS id,
+    strftime('%Y-%m-%d %H:%M:%S', ts_epoch_ms / 1000, 'unixepoch') AS timestamp,
+    mood_value, baseline, sleep_pressure, hrv_value, parameters, notes
+"""
+
+# 聚簇布局表结构：(user_id, ts_epoch_ms) 主键即存储顺序
+_CLUSTERED_DDL = """
+    CREATE TABLE IF NOT EXISTS mood_timeseries (
+        user_id INTEGER NOT NULL,
+        ts_epoch_ms INTEGER NOT NULL,
+        mood_value REAL NOT NULL,
+        baseline REAL,
+        sleep_pressure REAL,
+        hrv_value REAL,
+        parameters TEXT,
+        notes TEXT,
+        PRIMARY KEY (user_id, ts_epoch_ms)
+    ) WITHOUT ROWID
+"""
+
+# 用户个性化参数列（user_parameters 表）
+USER_PARAM_KEYS = ('tau_r', 'tau_d', 'circadian_k', 'circadian_amplitude', 'k', 'c', 'm', 'base_hrv', 'phi')
+
+
+class UserCache:
+    """
+    进程级 LRU 缓存：缓存 user_parameters / user_info 等热路径读取
+    
+    所有 Database 实例（每个 Streamlit 会话一个）共享同一个缓存，
+    键中包含数据库路径以区分不同的库。写操作由 Database 负责写穿/失效。
+    
+    注意：缓存只在本进程内，写穿/失效也只作用于本进程。多进程部署（或其他程序直接
+    改库）时，别的进程写入的参数 / 用户信息要等本进程的条目过期后才能读到，
+    因此条目带有效期 ttl（秒），用户缓存默认只保留 USER_CACHE_TTL=30 秒。
+    
+    参数:
+        ttl: 条目有效期（秒），None 表示不过期
+    """
+    
+    def __init__(self, max_entries: int = 4096, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key → (过期时刻 monotonic, value)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _expires_at(self) -> float:
+        return time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+    
+    def get(self, key):
+        """命中时返回值并刷新 LRU 顺序，未命中（或已过期）返回 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (self._expires_at(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def update(self, key, changes: Dict):
+        """写穿：若已缓存则合并字段（不延长有效期），未缓存则不做任何事"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], {**entry[1], **changes})
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+# 进程内共享的用户缓存实例
+user_cache = UserCache(ttl=float(os.environ.get("USER_CACHE_TTL", "30")))
+register_cache('user', user_cache)
+
+
+class LoginBatcher:
+    """
+    last_login 批量写入
+    
+    登录/会话恢复只在内存中记录 (用户, 时间)，同一用户保留最新一次；
+    攒满 batch_size 个用户时由当时的 Database 实例立即写入，否则最早一条记录
+    max_delay 秒后由后台定时器调用 on_due(path) 写入（一次 executemany + 一次提交）。
+    进程内共享，键为数据库路径。
+    """
+    
+    def __init__(self, batch_size: int = 50, max_delay: float = 30.0,
+                 on_due: Optional[Callable[[str], None]] = None):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.on_due = on_due
+        self._pending: Dict[str, Dict[int, datetime]] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+    
+    def _schedule(self, path: str):
+        """为该库的第一条待写入记录启动定时器（调用方持有锁）"""
+        if self.on_due is None or path in self._timers:
+            return
+        timer = threading.Timer(self.max_delay, self.on_due, args=(path,))
+        timer.daemon = True
+        self._timers[path] = timer
+        timer.start()
+    
+    def add(self, path: str, user_id: int, when: datetime) -> bool:
+        """记录一次登录，返回是否应当立即写入"""
+        with self._lock:
+            pending = self._pending.setdefault(path, {})
+            pending[user_id] = when
+            self._schedule(path)
+            return len(pending) >= self.batch_size
+    
+    def drain(self, path: str) -> List[Tuple[datetime, int]]:
+        """取出某个库待写入的全部记录: [(时间, 用户ID), ...]"""
+        with self._lock:
+            pending = self._pending.pop(path, {})
+            timer = self._timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+        return [(when, user_id) for user_id, when in pending.items()]
+    
+    def pending(self, path: str, user_id: int) -> Optional[datetime]:
+        """该用户尚未写入的最新登录时间"""
+        with self._lock:
+            return self._pending.get(path, {}).get(user_id)
+    
+    def restore(self, path: str, entries: List[Tuple[datetime, int]]):
+        """写入失败时放回（不覆盖期间产生的更新记录），max_delay 秒后重试"""
+        with self._lock:
+            pending = self._pending.setdefault(path, {})
+            for when, user_id in entries:
+                pending.setdefault(user_id, when)
+            if pending:
+                self._schedule(path)
+
+
+def _flush_due_logins(path: str):
+    """LoginBatcher 定时器回调：由该路径上任一打开的 Database 写入"""
+    for db in list(_open_databases):
+        if db.db_path == path:
+            db.flush_logins()
+            return
+
+
+# 进程内共享的登录时间批量写入器
+login_batcher = LoginBatcher(on_due=_flush_due_logins)
+
+# 进程退出前把尚未写入的 last_login 刷到各自的库
+_open_databases = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_pending_logins():
+    for db in list(_open_databases):
+        db.flush_logins()
+
 
 class Database:
     """数据库操作类"""
     
-    def __init__(self, db_type="sqlite", db_path="bio_mood.db", mysql_config=None):
-        """初始化数据库"""
+    def __init__(self, db_type="sqlite", db_path="bio_mood.db", mysql_config=None,
+                 mood_layout=None, archive_dir=None, archive_format=None, shard_count=None):
+        """
+        初始化数据库
+        
+        参数:
+            mood_layout: 心情记录布局 'rowid' / 'clustered'；None 表示沿用库中已有布局。
+                         传入 'clustered' 时会把旧的 mood_records 自动迁移过去。
+            archive_dir: 冷存储归档目录（见 mood_archive.py）；设置后历史查询会同时读取归档
+            archive_format: 归档格式 'parquet' / 'npz'，None 为自动选择
+            mysql_config: {'host', 'user', 'password', 'database', 'port', 'pool_size', ...}，
+                          连接池选项见 mysql_backend.connect
+            shard_count: SQLite 分片数。>1 时 users 表留在 db_path，其余按用户数据
+                         (心情/事件/参数/可穿戴) 按 user_id 哈希分散到 N 个分片文件，
+                         不同分片可并发写入。None 表示沿用库中记录的分片数（默认 1）。
+                         对已有数据的单文件库首次启用分片时，先把主库中的用户数据搬到各分片。
+        """
+        if mood_layout is not None and mood_layout not in MOOD_LAYOUTS:
+            raise ValueError(f"未知的心情记录布局: {mood_layout}")
+        
         self.db_type = db_type
         self.db_path = db_path
+        self.mood_layout = 'rowid'
+        self.archive = None
+        self.query_stats = query_stats
+        self.shards = []
+        
+        if archive_dir:
+            from mood_archive import MoodArchive
+            self.archive = MoodArchive(archive_dir, fmt=archive_format)
         
         if db_type == "sqlite":
-            self.conn = sqlite3.connect(db_path, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
+            self.conn = self._connect_sqlite(db_path)
+            shard_count = self._resolve_shard_count(shard_count)
+            if shard_count > 1:
+                self.shards = [self._connect_sqlite(self.shard_path(i)) for i in range(shard_count)]
+                # 新分片沿用主库已有的心情记录布局
+                if 'mood_timeseries' in self._table_names(self.conn):
+                    self.mood_layout = 'clustered'
         else:
-            try:
-                import pymysql
-                self.conn = pymysql.connect(
-                    host=mysql_config['host'],
-                    user=mysql_config['user'],
-                    password=mysql_config['password'],
-                    database=mysql_config['database'],
-                    charset='utf8mb4'
-                )
-            except ImportError:
-                raise ImportError("MySQL支持需要: pip install pymysql")
+            if shard_count and shard_count > 1:
+                raise ValueError("分片存储仅支持 SQLite")
+            if mood_layout == 'clustered':
+                raise ValueError("聚簇布局仅支持 SQLite（InnoDB 表本身按主键聚簇）")
+            import mysql_backend
+            self.conn = mysql_backend.connect(mysql_config)
         
         self.init_tables()
+        if self.shards:
+            self._record_shard_count()
+        _open_databases.add(self)
+        
+        if mood_layout == 'clustered' and self.mood_layout != 'clustered':
+            self.migrate_mood_layout()
+    
+    @staticmethod
+    def _connect_sqlite(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # 新建的库启用增量回收，归档删除后可用 incremental_vacuum 释放空间
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        return conn
+    
+    def _resolve_shard_count(self, shard_count: Optional[int]) -> int:
+        """
+        读取主库中记录的分片数并与传入值核对
+        
+        分片路由依赖分片数，库一旦按 N 分片写入就不能以其他分片数打开。
+        首次启用分片时由 _record_shard_count 在搬迁已有数据后记录。
+        """
+        self.conn.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.conn.execute("SELECT value FROM db_meta WHERE key='shard_count'").fetchone()
+        stored = int(row[0]) if row else None
+        
+        if shard_count is None:
+            return stored or 1
+        if shard_count < 1:
+            raise ValueError(f"无效的分片数: {shard_count}")
+        if stored is not None and stored != shard_count:
+            raise ValueError(f"数据库已按 {stored} 个分片创建，不能以 {shard_count} 个分片打开")
+        return shard_count
+    
+    def _record_shard_count(self):
+        """首次以分片模式打开时，先把主库中已有的用户数据搬到各分片，再记录分片数"""
+        row = self.conn.execute("SELECT value FROM db_meta WHERE key='shard_count'").fetchone()
+        if row:
+            return
+        moved = self._migrate_into_shards()
+        if moved:
+            logger.info("已把 %d 行用户数据从主库搬迁到 %d 个分片", moved, len(self.shards))
+        self.conn.execute("INSERT INTO db_meta (key, value) VALUES ('shard_count', ?)", (str(len(self.shards)),))
+        self.conn.commit()
+    
+    @staticmethod
+    def _table_names(conn) -> set:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    
+    def _migrate_into_shards(self) -> int:
+        """
+        把主库中的用户数据行按 user_id 复制到所在分片，全部成功后再从主库删除
+        
+        未分片时写入的数据留在主库会被分片路由忽略。复制使用 INSERT OR IGNORE
+        （各表均有主键/唯一键），中途失败后重新打开会从头安全重试。返回搬迁行数。
+        """
+        tables = [t for t in SHARDED_TABLES if t in self._table_names(self.conn)]
+        if not tables:
+            return 0
+        
+        count = len(self.shards)
+        moved = 0
+        for index, conn in enumerate(self.shards):
+            conn.create_function('shard_index', 1, lambda user_id: self.shard_index(user_id, count),
+                                 deterministic=True)
+            conn.execute("ATTACH DATABASE ? AS unsharded", (self.db_path,))
+            try:
+                shard_tables = self._table_names(conn)
+                for table in tables:
+                    if table not in shard_tables:
+                        raise ValueError(f"分片中缺少数据表 {table}，无法搬迁主库中的数据")
+                    columns = ', '.join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+                    cursor = conn.execute(f"""
+                        INSERT OR IGNORE INTO main.{table} ({columns})
+                        SELECT {columns} FROM unsharded.{table} WHERE shard_index(user_id) = ?
+                    """, (index,))
+                    moved += cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute("DETACH DATABASE unsharded")
+        
+        for table in tables:
+            self.conn.execute(f"DELETE FROM {table}")
+        self.conn.commit()
+        return moved
+    
+    def shard_path(self, index: int) -> str:
+        """分片文件路径: bio_mood.db → bio_mood.shard0.db"""
+        root, ext = os.path.splitext(self.db_path)
+        return f"{root}.shard{index}{ext or '.db'}"
+    
+    @staticmethod
+    def shard_index(user_id: int, shard_count: int) -> int:
+        """user_id → 分片编号（乘法哈希，连续 ID 也能均匀打散）"""
+        return ((int(user_id) * 2654435761) & 0xFFFFFFFF) % shard_count
+    
+    def _conn_for(self, user_id: Optional[int]):
+        """用户数据所在的连接；未分片或 user_id 为空时为主库"""
+        if not self.shards or user_id is None:
+            return self.conn
+        return self.shards[self.shard_index(user_id, len(self.shards))]
+    
+    def _data_conns(self) -> List:
+        """存放用户数据表的全部连接"""
+        return self.shards or [self.conn]
+    
+    def _cursor(self, user_id: Optional[int] = None, conn=None) -> InstrumentedCursor:
+        """
+        计时游标：以调用方方法名作为统计标签（见 query_stats.py）
+        
+        传入 user_id 时路由到该用户所在的分片；提交请用 cursor.connection.commit()。
+        """
+        conn = conn or self._conn_for(user_id)
+        return InstrumentedCursor(conn.cursor(), self.query_stats, conn=conn,
+                                  db_type=self.db_type, tag=sys._getframe(1).f_code.co_name)
     
     @staticmethod
     def hash_password(password: str) -> str:
@@ -43,8 +411,18 @@ class Database:
         return hashlib.sha256(password.encode()).hexdigest()
     
     def init_tables(self):
-        """初始化数据表"""
-        cursor = self.conn.cursor()
+        """初始化数据表（分片模式下 users 在主库，用户数据表在每个分片）"""
+        cursor = self._cursor()
+        
+        if self.db_type == "mysql":
+            from mysql_backend import MYSQL_DDL
+            for ddl in MYSQL_DDL:
+                cursor.execute(ddl)
+            cursor.execute("SHOW COLUMNS FROM users LIKE 'session_epoch'")
+            if not cursor.fetchall():
+                cursor.execute("ALTER TABLE users ADD COLUMN session_epoch INT NOT NULL DEFAULT 0")
+            cursor.connection.commit()
+            return
         
         # 用户表
         cursor.execute("""
@@ -56,25 +434,49 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_login TIMESTAMP,
                 is_active BOOLEAN DEFAULT 1,
+                session_epoch INTEGER NOT NULL DEFAULT 0,
                 preferences TEXT DEFAULT '{}'
             )
         """)
+        # 旧库补充会话纪元列（登出时递增，使已签发的会话令牌全部失效）
+        cursor.execute("PRAGMA table_info(users)")
+        if 'session_epoch' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE users ADD COLUMN session_epoch INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
         
-        # 心情记录表
+        for conn in self._data_conns():
+            self._init_data_tables(conn)
+    
+    def _init_data_tables(self, conn):
+        """在一个连接上创建用户数据表（心情/事件/参数/可穿戴）"""
+        cursor = self._cursor(conn=conn)
+        
+        # 已迁移到聚簇布局的库不再创建 mood_records
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mood_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                mood_value REAL NOT NULL,
-                baseline REAL,
-                sleep_pressure REAL,
-                hrv_value REAL,
-                parameters TEXT,
-                notes TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
+            SELECT name FROM sqlite_master WHERE type='table' AND name='mood_timeseries'
         """)
+        if cursor.fetchone():
+            self.mood_layout = 'clustered'
+        elif self.mood_layout == 'clustered':
+            # 聚簇布局库中新增的分片
+            cursor.execute(_CLUSTERED_DDL)
+        
+        # 心情记录表
+        if self.mood_layout == 'rowid':
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS mood_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    mood_value REAL NOT NULL,
+                    baseline REAL,
+                    sleep_pressure REAL,
+                    hrv_value REAL,
+                    parameters TEXT,
+                    notes TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )
+            """)
         
         # 事件记录表
         cursor.execute("""
@@ -111,24 +513,56 @@ class Database:
             )
         """)
         
-        # 创建索引
+        # 可穿戴设备样本表（HRV / 睡眠），与聚簇心情表相同的 WITHOUT ROWID 布局
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_mood_user_time 
-            ON mood_records(user_id, timestamp DESC)
+            CREATE TABLE IF NOT EXISTS wearable_samples (
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                ts_epoch_ms INTEGER NOT NULL,
+                value REAL NOT NULL,
+                end_epoch_ms INTEGER,
+                source TEXT,
+                PRIMARY KEY (user_id, kind, ts_epoch_ms)
+            ) WITHOUT ROWID
         """)
+        
+        # 引擎状态表（孪生的紧凑状态 + 模拟时钟锚点，version 用于乐观并发控制）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS engine_state (
+                user_id INTEGER PRIMARY KEY,
+                sleep_pressure REAL NOT NULL,
+                deviation REAL NOT NULL,
+                velocity REAL NOT NULL,
+                is_asleep INTEGER NOT NULL,
+                sim_time REAL NOT NULL,
+                parameters TEXT NOT NULL,
+                anchor_real REAL NOT NULL,
+                anchor_sim REAL NOT NULL,
+                version INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+        """)
+        
+        # 创建索引
+        if self.mood_layout == 'rowid':
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_mood_user_time 
+                ON mood_records(user_id, timestamp DESC)
+            """)
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_events_user_time 
             ON events(user_id, timestamp DESC)
         """)
         
-        self.conn.commit()
+        conn.commit()
     
     # ===== 用户管理 =====
     
     def register_user_simple(self, username: str, email: str, password: str) -> Tuple[bool, str]:
         """注册新用户"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             cursor.execute("SELECT id FROM users WHERE username=? OR email=?", (username, email))
             if cursor.fetchone():
@@ -143,21 +577,25 @@ class Database:
             
             user_id = cursor.lastrowid
             
-            cursor.execute("""
+            # 分片模式下参数行写入用户所在分片，分片提交成功后再提交主库
+            params_cursor = self._cursor(user_id)
+            params_cursor.execute("""
                 INSERT INTO user_parameters (user_id)
                 VALUES (?)
             """, (user_id,))
             
+            params_cursor.connection.commit()
             self.conn.commit()
             return True, "注册成功"
             
         except Exception as e:
+            self.conn.rollback()
             return False, f"注册失败: {str(e)}"
     
     def login_user_simple(self, username: str, password: str) -> Tuple[bool, Optional[int], str]:
         """用户登录"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             
             cursor.execute("""
                 SELECT id, password_hash, is_active FROM users 
@@ -168,7 +606,7 @@ class Database:
             if not row:
                 return False, None, "用户不存在"
             
-            user_id, password_hash, is_active = row if self.db_type == "sqlite" else (row[0], row[1], row[2])
+            user_id, password_hash, is_active = row
             
             if not is_active:
                 return False, None, "账户已禁用"
@@ -176,20 +614,72 @@ class Database:
             if self.hash_password(password) != password_hash:
                 return False, None, "密码错误"
             
-            cursor.execute("""
-                UPDATE users SET last_login=? WHERE id=?
-            """, (datetime.now(), user_id))
-            self.conn.commit()
-            
+            self.record_login(user_id)
             return True, user_id, "登录成功"
             
         except Exception as e:
             return False, None, f"登录失败: {str(e)}"
     
+    def record_login(self, user_id: int):
+        """记录登录时间（批量写入，见 LoginBatcher），同时更新已缓存的用户信息"""
+        now = datetime.now()
+        user_cache.update(self._cache_key('info', user_id), {'last_login': str(now)})
+        if login_batcher.add(self.db_path, user_id, now):
+            self.flush_logins()
+    
+    def flush_logins(self) -> int:
+        """把待写入的 last_login 一次性提交，返回写入的用户数"""
+        entries = login_batcher.drain(self.db_path)
+        if not entries:
+            return 0
+        try:
+            cursor = self._cursor()
+            cursor.executemany("UPDATE users SET last_login=? WHERE id=?", entries)
+            cursor.connection.commit()
+            return len(entries)
+        except Exception as e:
+            login_batcher.restore(self.db_path, entries)
+            logger.error("写入登录时间失败: %s", e)
+            return 0
+    
+    def get_session_epoch(self, user_id: int) -> Optional[int]:
+        """
+        账户当前的会话纪元（直接读库，不经过进程缓存）
+        
+        账户不存在或已禁用时返回 None。会话令牌中带有签发时的纪元，不一致即已被登出。
+        """
+        try:
+            cursor = self._cursor()
+            cursor.execute("SELECT is_active, session_epoch FROM users WHERE id=?", (user_id,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                return None
+            return int(row[1] or 0)
+        except Exception as e:
+            logger.error("读取账户状态失败: %s", e)
+            return None
+    
+    def revoke_sessions(self, user_id: int) -> bool:
+        """递增会话纪元，使该用户已签发的全部会话令牌在所有进程中失效（登出时调用）"""
+        cursor = self._cursor()
+        try:
+            cursor.execute("UPDATE users SET session_epoch=session_epoch+1 WHERE id=?", (user_id,))
+            cursor.connection.commit()
+            return True
+        except Exception as e:
+            cursor.connection.rollback()
+            logger.error("作废会话令牌失败: %s", e)
+            return False
+    
     def get_user_info(self, user_id: int) -> Optional[Dict]:
-        """获取用户信息"""
+        """获取用户信息（优先读进程缓存；last_login 以尚未批量写入的最新登录为准）"""
+        key = self._cache_key('info', user_id)
+        cached = user_cache.get(key)
+        if cached is not None:
+            return {**cached, 'preferences': dict(cached['preferences'])}
+        
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor()
             cursor.execute("""
                 SELECT id, username, email, created_at, last_login, preferences 
                 FROM users WHERE id=?
@@ -199,28 +689,34 @@ class Database:
             if not row:
                 return None
             
-            if self.db_type == "sqlite":
-                return {
-                    'id': row['id'],
-                    'username': row['username'],
-                    'email': row['email'],
-                    'created_at': row['created_at'],
-                    'last_login': row['last_login'],
-                    'preferences': json.loads(row['preferences'] or '{}')
-                }
-            else:
-                return {
-                    'id': row[0],
-                    'username': row[1],
-                    'email': row[2],
-                    'created_at': row[3],
-                    'last_login': row[4],
-                    'preferences': json.loads(row[5] or '{}')
-                }
+            info = {
+                'id': row['id'],
+                'username': row['username'],
+                'email': row['email'],
+                'created_at': row['created_at'],
+                'last_login': row['last_login'],
+                'preferences': json.loads(row['preferences'] or '{}')
+            }
+            # 刚登录时 last_login 还在 login_batcher 中，库里是上一次的值
+            pending = login_batcher.pending(self.db_path, user_id)
+            if pending is not None:
+                info['last_login'] = str(pending)
+            user_cache.put(key, info)
+            return {**info, 'preferences': dict(info['preferences'])}
         except Exception as e:
-            print(f"获取用户信息失败: {e}")
+            logger.error("获取用户信息失败: %s", e)
             return None
     
+    def list_user_ids(self) -> List[int]:
+        """全部用户 ID（批处理任务使用）"""
+        cursor = self._cursor()
+        cursor.execute("SELECT id FROM users ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _cache_key(self, kind: str, user_id: int) -> Tuple:
+        """进程缓存键：(库路径, 类别, 用户ID)"""
+        return (self.db_path, kind, user_id)
+    
     # ===== 心情记录 =====
     
     def add_mood_record(self, user_id: int, mood_value: float, 
@@ -228,100 +724,476 @@ class Database:
                        hrv_value: float = None, parameters: dict = None,
                        notes: str = None) -> Tuple[bool, str]:
         """添加心情记录"""
+        cursor = self._cursor(user_id)
         try:
-            cursor = self.conn.cursor()
             params_json = json.dumps(parameters) if parameters else None
             
-            cursor.execute("""
-                INSERT INTO mood_records 
-                (user_id, mood_value, baseline, sleep_pressure, hrv_value, parameters, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, mood_value, baseline, sleep_pressure, hrv_value, params_json, notes))
+            if self.mood_layout == 'clustered':
+                ts_ms = self._next_ts_ms(cursor, user_id)
+                cursor.execute("""
+                    INSERT INTO mood_timeseries 
+                    (user_id, ts_epoch_ms, mood_value, baseline, sleep_pressure, hrv_value, parameters, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (user_id, ts_ms, mood_value, baseline,
+                      sleep_pressure, hrv_value, params_json, notes))
+            else:
+                cursor.execute("""
+                    INSERT INTO mood_records 
+                    (user_id, mood_value, baseline, sleep_pressure, hrv_value, parameters, notes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (user_id, mood_value, baseline, sleep_pressure, hrv_value, params_json, notes))
             
-            self.conn.commit()
+            cursor.connection.commit()
             return True, "心情记录已保存"
             
         except Exception as e:
+            # 失败的写事务必须回滚，否则连接一直持有写锁，其他写入者会报 database is locked
+            cursor.connection.rollback()
             return False, f"保存失败: {str(e)}"
     
+    def add_mood_records(self, records: List[Dict]) -> Tuple[bool, str]:
+        """
+        批量添加心情记录（调度器持久化快照使用）
+        
+        参数:
+            records: [{'user_id', 'mood_value', 'baseline', 'sleep_pressure',
+                       'hrv_value', 'parameters', 'notes'}, ...]，除前两项外均可省略
+        按所在分片分组，每个分片一次 executemany + 一次提交。
+        """
+        by_conn = {}
+        for record in records:
+            by_conn.setdefault(id(self._conn_for(record['user_id'])), []).append(record)
+        
+        conn = None
+        try:
+            for group in by_conn.values():
+                cursor = self._cursor(group[0]['user_id'])
+                conn = cursor.connection
+                rows = [(
+                    r.get('baseline'), r.get('sleep_pressure'), r.get('hrv_value'),
+                    json.dumps(r['parameters']) if r.get('parameters') else None, r.get('notes')
+                ) for r in group]
+                if self.mood_layout == 'clustered':
+                    keys = {}
+                    for r in group:
+                        keys[r['user_id']] = keys.get(r['user_id'], 0) + 1
+                    for uid, count in keys.items():
+                        keys[uid] = self._next_ts_ms(cursor, uid, count)
+                    ts_list = []
+                    for r in group:
+                        ts_list.append(keys[r['user_id']])
+                        keys[r['user_id']] += 1
+                    cursor.executemany("""
+                        INSERT INTO mood_timeseries
+                        (user_id, ts_epoch_ms, mood_value, baseline, sleep_pressure, hrv_value, parameters, notes)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, [(r['user_id'], ts, r['mood_value'], *row)
+                          for r, ts, row in zip(group, ts_list, rows)])
+                else:
+                    cursor.executemany("""
+                        INSERT INTO mood_records
+                        (user_id, mood_value, baseline, sleep_pressure, hrv_value, parameters, notes)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, [(r['user_id'], r['mood_value'], *row) for r, row in zip(group, rows)])
+                conn.commit()
+            return True, f"已保存 {len(records)} 条心情记录"
+        
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            return False, f"保存失败: {str(e)}"
+
     def get_mood_history(self, user_id: int, limit: int = 100, days: int = None) -> List[Dict]:
         """获取用户心情历史"""
+        records, _ = self.get_mood_history_page(user_id, page_size=limit, days=days)
+        return records
+    
+    def get_mood_history_page(self, user_id: int, page_size: int = 100,
+                              cursor: Optional[Tuple] = None,
+                              days: int = None) -> Tuple[List[Dict], Optional[Tuple]]:
+        """
+        按 (timestamp, id) 键集游标分页获取心情历史（新 → 旧）
+        
+        参数:
+            cursor: 上一页返回的游标，None 表示第一页
+        返回: (记录列表, 下一页游标)；没有更多数据时游标为 None
+        """
+        if cursor is not None and cursor[0] == 'archive':
+            return self._archive_history_page(user_id, page_size, cursor[1], days)
+        
         try:
-            cursor = self.conn.cursor()
+            cursor_obj = self._cursor(user_id)
             
-            if days:
-                query = """
-                    SELECT * FROM mood_records 
-                    WHERE user_id=? AND timestamp > datetime('now', '-' || ? || ' days')
-                    ORDER BY timestamp DESC
+            if self.mood_layout == 'clustered':
+                # 聚簇布局: id 即 ts_epoch_ms，主键本身就是游标
+                clauses = ["user_id=?"]
+                args = [user_id]
+                if days:
+                    clauses.append("ts_epoch_ms > ?")
+                    args.append(self._cutoff_ms(days))
+                if cursor is not None:
+                    clauses.append("ts_epoch_ms < ?")
+                    args.append(cursor[1])
+                cursor_obj.execute(f"""
+                    SELECT {_CLUSTERED_SELECT} FROM mood_timeseries
+                    WHERE {' AND '.join(clauses)}
+                    ORDER BY ts_epoch_ms DESC
                     LIMIT ?
-                """
-                cursor.execute(query, (user_id, days, limit))
+                """, args + [page_size])
             else:
-                cursor.execute("""
+                where, args = self._keyset_where(user_id, cursor, days)
+                cursor_obj.execute(f"""
                     SELECT * FROM mood_records 
-                    WHERE user_id=?
-                    ORDER BY timestamp DESC
+                    WHERE {where}
+                    ORDER BY timestamp DESC, id ASC
                     LIMIT ?
-                """, (user_id, limit))
+                """, args + [page_size])
             
-            rows = cursor.fetchall()
-            records = []
-            
-            for row in rows:
-                if self.db_type == "sqlite":
-                    records.append({
-                        'id': row['id'],
-                        'timestamp': row['timestamp'],
-                        'mood_value': row['mood_value'],
-                        'baseline': row['baseline'],
-                        'sleep_pressure': row['sleep_pressure'],
-                        'hrv_value': row['hrv_value'],
-                        'parameters': json.loads(row['parameters'] or '{}'),
-                        'notes': row['notes']
-                    })
-            
-            return records
+            records = [self._mood_row_to_dict(row) for row in cursor_obj.fetchall()]
+            
+            # 热数据读完后，剩余部分从冷存储接续
+            if len(records) < page_size and self.archive is not None:
+                if records:
+                    before_ms = self._record_epoch_ms(records[-1])
+                elif cursor is not None:
+                    before_ms = self._to_epoch_ms(cursor[0])
+                else:
+                    before_ms = None
+                archived, next_cursor = self._archive_history_page(
+                    user_id, page_size - len(records), before_ms, days
+                )
+                return records + archived, next_cursor
+            
+            return records, self._next_cursor(records, page_size)
             
         except Exception as e:
-            print(f"获取心情历史失败: {e}")
-            return []
+            logger.error("获取心情历史失败: %s", e)
+            return [], None
+    
+    def _archive_history_page(self, user_id: int, page_size: int, before_ms: Optional[int],
+                              days: int = None) -> Tuple[List[Dict], Optional[Tuple]]:
+        """从冷存储读取一页（新 → 旧），游标形如 ('archive', ts_epoch_ms)"""
+        if self.archive is None:
+            return [], None
+        
+        from mood_archive import archive_to_records
+        after_ms = self._cutoff_ms(days) if days else None
+        data = self.archive.read_page_desc(user_id, before_ms, after_ms, limit=page_size)
+        records = archive_to_records(data)
+        
+        if len(records) < page_size:
+            return records, None
+        return records, ('archive', records[-1]['id'])
+    
+    def _record_epoch_ms(self, record: Dict) -> int:
+        """记录的毫秒时间戳（聚簇布局下 id 即时间戳）"""
+        if self.mood_layout == 'clustered':
+            return record['id']
+        return self._to_epoch_ms(record['timestamp'])
+    
+    def iter_mood_history(self, user_id: int, page_size: int = 500,
+                          days: int = None) -> Iterator[List[Dict]]:
+        """逐页流式遍历全部心情历史，每页代价恒定（不使用 OFFSET）"""
+        cursor = None
+        while True:
+            records, cursor = self.get_mood_history_page(user_id, page_size, cursor, days)
+            if records:
+                yield records
+            if cursor is None:
+                return
+    
+    def get_mood_series(self, user_id: int, start=None, end=None,
+                        columns=DEFAULT_SERIES_COLUMNS, as_dataframe: bool = False,
+                        decode_json: bool = False, include_archive: bool = True):
+        """
+        列式获取心情时间序列（按时间升序）
+        
+        直接把查询结果转成带类型的 NumPy 数组，不为每行构造字典；
+        parameters 列默认保持原始 JSON 字符串，decode_json=True 时才解析。
+        
+        参数:
+            start/end: datetime 或 'YYYY-MM-DD HH:MM:SS' 字符串（UTC，与 CURRENT_TIMESTAMP 一致）
+            columns: 需要的列，见 MOOD_SERIES_DTYPES
+            as_dataframe: True 时返回 pandas.DataFrame
+            include_archive: 配置了冷存储时，是否把归档中的同范围记录拼接在前面
+        返回: {列名: np.ndarray} 或 DataFrame
+        """
+        columns = tuple(columns)
+        unknown = [c for c in columns if c not in MOOD_SERIES_DTYPES]
+        if unknown:
+            raise ValueError(f"未知的列: {unknown}")
+        
+        clustered = self.mood_layout == 'clustered'
+        if clustered:
+            # 时间列直接取整数毫秒，转换在 NumPy 中完成
+            table, time_col = 'mood_timeseries', 'ts_epoch_ms'
+            select = ['ts_epoch_ms' if c in ('id', 'timestamp') else c for c in columns]
+            bound = self._to_epoch_ms
+            order = 'ts_epoch_ms ASC'
+        else:
+            table, time_col = 'mood_records', 'timestamp'
+            select = list(columns)
+            bound = self._format_timestamp
+            order = 'timestamp ASC, id ASC'
+        
+        clauses = ["user_id=?"]
+        args = [user_id]
+        if start is not None:
+            clauses.append(f"{time_col} >= ?")
+            args.append(bound(start))
+        if end is not None:
+            clauses.append(f"{time_col} < ?")
+            args.append(bound(end))
+        
+        try:
+            cursor = self._cursor(user_id)
+            # 使用普通元组行，避免 sqlite3.Row 对象的分配
+            cursor.row_factory = None
+            cursor.execute(f"""
+                SELECT {', '.join(select)} FROM {table}
+                WHERE {' AND '.join(clauses)}
+                ORDER BY {order}
+            """, args)
+            rows = cursor.fetchall()
+        except Exception as e:
+            logger.error("获取心情序列失败: %s", e)
+            rows = []
+        
+        series = self._rows_to_series(rows, columns, decode_json, epoch_ms_time=clustered)
+        
+        if include_archive and self.archive is not None:
+            archived = self._archive_series(user_id, start, end, columns, decode_json)
+            series = {name: np.concatenate([archived[name], series[name]]) for name in columns}
+        
+        if as_dataframe:
+            import pandas as pd
+            return pd.DataFrame(series, columns=list(columns))
+        return series
+    
+    def _archive_series(self, user_id: int, start, end, columns, decode_json: bool) -> Dict[str, np.ndarray]:
+        """冷存储范围读取 → 与 get_mood_series 相同的列数组"""
+        data = self.archive.read_range(
+            user_id,
+            start_ms=self._to_epoch_ms(start) if start is not None else None,
+            end_ms=self._to_epoch_ms(end) if end is not None else None,
+        )
+        series = {}
+        for name in columns:
+            if name in ('id', 'timestamp'):
+                series[name] = data['ts_epoch_ms'].astype(MOOD_SERIES_DTYPES[name])
+            elif name in ('parameters', 'notes'):
+                arr = np.empty(len(data[name]), dtype=object)
+                if name == 'parameters' and decode_json:
+                    arr[:] = [json.loads(v or '{}') for v in data[name]]
+                else:
+                    arr[:] = [v or None for v in data[name]]
+                series[name] = arr
+            else:
+                series[name] = data[name]
+        return series
+    
+    @staticmethod
+    def _rows_to_series(rows, columns, decode_json: bool = False,
+                        epoch_ms_time: bool = False) -> Dict[str, np.ndarray]:
+        """元组行 → 按列的 NumPy 数组"""
+        if rows:
+            columns_data = list(zip(*rows))
+        else:
+            columns_data = [()] * len(columns)
+        
+        series = {}
+        for name, values in zip(columns, columns_data):
+            dtype = MOOD_SERIES_DTYPES[name]
+            if name == 'timestamp' and epoch_ms_time:
+                arr = np.array(values, dtype=np.int64).astype(dtype)
+            elif name == 'parameters' and decode_json:
+                arr = np.empty(len(values), dtype=object)
+                arr[:] = [json.loads(v or '{}') for v in values]
+            elif dtype is object:
+                arr = np.empty(len(values), dtype=object)
+                arr[:] = values
+            else:
+                arr = np.array(values, dtype=dtype)
+            series[name] = arr
+        return series
+    
+    @staticmethod
+    def _format_timestamp(value) -> str:
+        """datetime → 与 CURRENT_TIMESTAMP 相同的文本格式"""
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return str(value)
+    
+    @staticmethod
+    def _to_epoch_ms(value) -> int:
+        """datetime / 文本时间戳（UTC）/ 数字 → 毫秒时间戳"""
+        if isinstance(value, (int, float)):
+            return int(value)
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(str(value))
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return int(np.datetime64(value, 'ms').astype(np.int64))
+    
+    @staticmethod
+    def _cutoff_ms(days: int) -> int:
+        """距今 days 天的毫秒时间戳"""
+        return int((time.time() - days * 86400) * 1000)
+    
+    def _next_ts_ms(self, cursor, user_id: int, count: int = 1) -> int:
+        """
+        在写事务内为聚簇布局分配 count 个连续的毫秒主键，返回第一个
+        
+        先以 BEGIN IMMEDIATE 取得写锁再读 MAX(ts_epoch_ms)，同一库文件上的其他
+        Database 实例 / 进程在此期间无法写入，分配出的主键不会与它们冲突；
+        同一毫秒内（或时钟回拨）的写入顺延到已有最大值之后。
+        """
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT MAX(ts_epoch_ms) FROM mood_timeseries WHERE user_id=?", (user_id,))
+        last = cursor.fetchone()[0]
+        ts = int(time.time() * 1000)
+        if last is not None and ts <= last:
+            ts = last + 1
+        return ts
     
     def get_mood_statistics(self, user_id: int, days: int = 7) -> Dict:
         """获取心情统计数据"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor(user_id)
             
-            cursor.execute("""
-                SELECT 
-                    AVG(mood_value) as avg_mood,
-                    MAX(mood_value) as max_mood,
-                    MIN(mood_value) as min_mood,
-                    COUNT(*) as count
-                FROM mood_records 
-                WHERE user_id=? AND timestamp > datetime('now', '-' || ? || ' days')
-            """, (user_id, days))
+            if self.mood_layout == 'clustered':
+                cursor.execute("""
+                    SELECT 
+                        AVG(mood_value) as avg_mood,
+                        MAX(mood_value) as max_mood,
+                        MIN(mood_value) as min_mood,
+                        COUNT(*) as count
+                    FROM mood_timeseries 
+                    WHERE user_id=? AND ts_epoch_ms > ?
+                """, (user_id, self._cutoff_ms(days)))
+            else:
+                cursor.execute(f"""
+                    SELECT 
+                        AVG(mood_value) as avg_mood,
+                        MAX(mood_value) as max_mood,
+                        MIN(mood_value) as min_mood,
+                        COUNT(*) as count
+                    FROM mood_records 
+                    WHERE user_id=? AND timestamp > {self._days_ago_sql()}
+                """, (user_id, days))
             
             row = cursor.fetchone()
             
-            if self.db_type == "sqlite":
-                return {
-                    'average': round(row['avg_mood'] or 0, 2),
-                    'max': row['max_mood'],
-                    'min': row['min_mood'],
-                    'count': row['count']
-                }
-            else:
-                return {
-                    'average': round(row[0] or 0, 2),
-                    'max': row[1],
-                    'min': row[2],
-                    'count': row[3]
-                }
+            stats = {
+                'average': round(row['avg_mood'] or 0, 2),
+                'max': row['max_mood'],
+                'min': row['min_mood'],
+                'count': row['count']
+            }
+            if self.archive is not None:
+                stats = self._merge_archive_statistics(user_id, days, stats, row['avg_mood'])
+            return stats
         except Exception as e:
-            print(f"获取统计数据失败: {e}")
+            logger.error("获取统计数据失败: %s", e)
             return {'average': 0, 'max': 0, 'min': 0, 'count': 0}
     
+    def _merge_archive_statistics(self, user_id: int, days: int, stats: Dict, hot_avg) -> Dict:
+        """把冷存储中统计窗口内的记录合并进统计结果"""
+        count, total, max_value, min_value = self.archive.summarize(user_id, self._cutoff_ms(days))
+        if not count:
+            return stats
+        
+        hot_count = stats['count']
+        all_count = hot_count + count
+        return {
+            'average': round(((hot_avg or 0) * hot_count + total) / all_count, 2),
+            'max': max_value if stats['max'] is None else max(stats['max'], max_value),
+            'min': min_value if stats['min'] is None else min(stats['min'], min_value),
+            'count': all_count
+        }
+    
+    def delete_mood_records_before(self, user_id: int, before) -> int:
+        """删除某用户早于 before 的心情记录（归档任务使用），返回删除条数"""
+        cursor = self._cursor(user_id)
+        if self.mood_layout == 'clustered':
+            cursor.execute("DELETE FROM mood_timeseries WHERE user_id=? AND ts_epoch_ms < ?",
+                           (user_id, self._to_epoch_ms(before)))
+        else:
+            cursor.execute("DELETE FROM mood_records WHERE user_id=? AND timestamp < ?",
+                           (user_id, self._format_timestamp(before)))
+        cursor.connection.commit()
+        return cursor.rowcount
+    
+    def incremental_vacuum(self) -> int:
+        """
+        回收空闲页，返回释放的页数
+        
+        旧库若未开启 auto_vacuum=INCREMENTAL，首次调用会切换模式并执行一次完整 VACUUM。
+        分片模式下依次回收每个分片。
+        """
+        if self.db_type != "sqlite":
+            return 0
+        freed = 0
+        for conn in self._data_conns():
+            cursor = self._cursor(conn=conn)
+            free_before = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                cursor.execute("VACUUM")
+            else:
+                cursor.execute("PRAGMA incremental_vacuum").fetchall()
+            freed += free_before - cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        return freed
+    
+    def migrate_mood_layout(self) -> Tuple[bool, str]:
+        """
+        将 mood_records 迁移到聚簇布局 mood_timeseries
+        
+        文本时间戳转换为毫秒整数；同一用户同一秒内的多条记录按 id 顺序
+        依次加 0,1,2... 毫秒以保证主键唯一。原表重命名为 mood_records_legacy 以便回滚。
+        分片模式下逐个分片迁移，已迁移的分片会被跳过，失败后可重新调用。
+        """
+        if self.db_type != "sqlite":
+            return False, "聚簇布局仅支持 SQLite"
+        
+        migrated = 0
+        for conn in self._data_conns():
+            try:
+                migrated += self._migrate_conn(conn)
+            except Exception as e:
+                conn.rollback()
+                return False, f"迁移失败: {str(e)}"
+        
+        self.mood_layout = 'clustered'
+        return True, f"已迁移 {migrated} 条心情记录"
+    
+    def _migrate_conn(self, conn) -> int:
+        """迁移单个连接中的 mood_records，返回迁移条数"""
+        cursor = self._cursor(conn=conn)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='mood_records'")
+        if not cursor.fetchone():
+            return 0
+        
+        # 显式事务：建表、拷贝、改名要么全部生效，要么全部回滚
+        cursor.execute("BEGIN")
+        cursor.execute(_CLUSTERED_DDL)
+        cursor.execute("""
+            INSERT INTO mood_timeseries
+            (user_id, ts_epoch_ms, mood_value, baseline, sleep_pressure, hrv_value, parameters, notes)
+            SELECT user_id,
+                   CAST(strftime('%s', timestamp) AS INTEGER) * 1000
+                       + ROW_NUMBER() OVER (PARTITION BY user_id, timestamp ORDER BY id) - 1,
+                   mood_value, baseline, sleep_pressure, hrv_value, parameters, notes
+            FROM mood_records
+            ORDER BY user_id, timestamp, id
+        """)
+        migrated = cursor.rowcount
+        cursor.execute("DROP INDEX IF EXISTS idx_mood_user_time")
+        cursor.execute("ALTER TABLE mood_records RENAME TO mood_records_legacy")
+        conn.commit()
+        return migrated
+    
     # ===== 事件记录 =====
     
     def add_event(self, user_id: int, event_type: str, 
@@ -329,7 +1201,7 @@ class Database:
                  duration: float = None, ai_analysis: dict = None) -> Tuple[bool, str]:
         """添加事件记录"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor(user_id)
             ai_json = json.dumps(ai_analysis) if ai_analysis else None
             
             cursor.execute("""
@@ -338,7 +1210,7 @@ class Database:
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (user_id, event_type, event_description, amplitude, duration, ai_json))
             
-            self.conn.commit()
+            cursor.connection.commit()
             return True, "事件已记录"
             
         except Exception as e:
@@ -346,51 +1218,173 @@ class Database:
     
     def get_events(self, user_id: int, limit: int = 100, days: int = None) -> List[Dict]:
         """获取用户事件历史"""
+        events, _ = self.get_events_page(user_id, page_size=limit, days=days)
+        return events
+    
+    def get_events_page(self, user_id: int, page_size: int = 100,
+                        cursor: Optional[Tuple] = None,
+                        days: int = None) -> Tuple[List[Dict], Optional[Tuple]]:
+        """按 (timestamp, id) 键集游标分页获取事件历史（新 → 旧）"""
         try:
-            cursor = self.conn.cursor()
+            cursor_obj = self._cursor(user_id)
+            where, args = self._keyset_where(user_id, cursor, days)
+            cursor_obj.execute(f"""
+                SELECT * FROM events 
+                WHERE {where}
+                ORDER BY timestamp DESC, id ASC
+                LIMIT ?
+            """, args + [page_size])
             
-            if days:
-                cursor.execute("""
-                    SELECT * FROM events 
-                    WHERE user_id=? AND timestamp > datetime('now', '-' || ? || ' days')
-                    ORDER BY timestamp DESC
-                    LIMIT ?
-                """, (user_id, days, limit))
-            else:
-                cursor.execute("""
-                    SELECT * FROM events 
-                    WHERE user_id=?
-                    ORDER BY timestamp DESC
-                    LIMIT ?
-                """, (user_id, limit))
+            events = [self._event_row_to_dict(row) for row in cursor_obj.fetchall()]
+            return events, self._next_cursor(events, page_size)
             
-            rows = cursor.fetchall()
-            events = []
-            
-            for row in rows:
-                if self.db_type == "sqlite":
-                    events.append({
-                        'id': row['id'],
-                        'event_type': row['event_type'],
-                        'event_description': row['event_description'],
-                        'timestamp': row['timestamp'],
-                        'amplitude': row['amplitude'],
-                        'duration': row['duration'],
-                        'ai_analysis': json.loads(row['ai_analysis'] or '{}')
-                    })
-            
-            return events
+        except Exception as e:
+            logger.error("获取事件历史失败: %s", e)
+            return [], None
+    
+    def iter_events(self, user_id: int, page_size: int = 500,
+                    days: int = None) -> Iterator[List[Dict]]:
+        """逐页流式遍历全部事件历史"""
+        cursor = None
+        while True:
+            events, cursor = self.get_events_page(user_id, page_size, cursor, days)
+            if events:
+                yield events
+            if cursor is None:
+                return
+    
+    # ===== 可穿戴设备数据 =====
+    
+    def add_wearable_samples(self, user_id: int, samples: List[Tuple],
+                             source: str = None) -> Tuple[bool, str]:
+        """
+        批量写入可穿戴样本（一次 executemany + 一次提交）
+        
+        参数:
+            samples: [(kind, ts_epoch_ms, value, end_epoch_ms), ...]
+                     同一 (kind, 时间戳) 的重复样本以最后一次为准，便于重复导入
+        """
+        try:
+            cursor = self._cursor(user_id)
+            # MySQL 下由 mysql_backend 合并为多行 REPLACE 分批执行
+            verb = "REPLACE" if self.db_type == "mysql" else "INSERT OR REPLACE"
+            cursor.executemany(f"""
+                {verb} INTO wearable_samples
+                (user_id, kind, ts_epoch_ms, value, end_epoch_ms, source)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, ((user_id, kind, ts, value, end, source) for kind, ts, value, end in samples))
+            cursor.connection.commit()
+            return True, f"已写入 {len(samples)} 个样本"
             
         except Exception as e:
-            print(f"获取事件历史失败: {e}")
-            return []
+            self._conn_for(user_id).rollback()
+            return False, f"写入失败: {str(e)}"
+    
+    def get_wearable_series(self, user_id: int, kind: str = 'hrv',
+                            start=None, end=None) -> Dict[str, np.ndarray]:
+        """列式读取某类可穿戴样本: {'timestamp', 'value', 'end'}（按时间升序）"""
+        clauses = ["user_id=?", "kind=?"]
+        args = [user_id, kind]
+        if start is not None:
+            clauses.append("ts_epoch_ms >= ?")
+            args.append(self._to_epoch_ms(start))
+        if end is not None:
+            clauses.append("ts_epoch_ms < ?")
+            args.append(self._to_epoch_ms(end))
+        
+        try:
+            cursor = self._cursor(user_id)
+            cursor.row_factory = None
+            cursor.execute(f"""
+                SELECT ts_epoch_ms, value, end_epoch_ms FROM wearable_samples
+                WHERE {' AND '.join(clauses)}
+                ORDER BY ts_epoch_ms ASC
+            """, args)
+            rows = cursor.fetchall()
+        except Exception as e:
+            logger.error("获取可穿戴数据失败: %s", e)
+            rows = []
+        
+        ts, values, ends = zip(*rows) if rows else ((), (), ())
+        return {
+            'timestamp': np.array(ts, dtype=np.int64).astype('datetime64[ms]'),
+            'value': np.array(values, dtype=np.float64),
+            'end': np.array([e if e is not None else -1 for e in ends], dtype=np.int64),
+        }
+    
+    # ===== 键集分页辅助 =====
+    
+    def _keyset_where(self, user_id: int, cursor: Optional[Tuple], days: int = None) -> Tuple[str, list]:
+        """
+        构造键集分页的 WHERE 子句
+        
+        排序为 timestamp DESC, id ASC，与 (user_id, timestamp DESC) 索引的
+        自然顺序一致（同一时间戳内按 rowid 升序），因此无需额外排序。
+        """
+        clauses = ["user_id=?"]
+        args = [user_id]
+        
+        if days:
+            clauses.append(f"timestamp > {self._days_ago_sql()}")
+            args.append(days)
+        
+        if cursor is not None:
+            last_ts, last_id = cursor
+            clauses.append("timestamp <= ? AND (timestamp < ? OR id > ?)")
+            args.extend([last_ts, last_ts, last_id])
+        
+        return " AND ".join(clauses), args
+    
+    def _days_ago_sql(self) -> str:
+        """距今 ? 天的 UTC 时间表达式（与 CURRENT_TIMESTAMP 写入的时间比较）"""
+        if self.db_type == "mysql":
+            return "UTC_TIMESTAMP() - INTERVAL ? DAY"
+        return "datetime('now', '-' || ? || ' days')"
+    
+    @staticmethod
+    def _next_cursor(rows: List[Dict], page_size: int) -> Optional[Tuple]:
+        """由本页最后一条记录生成下一页游标"""
+        if len(rows) < page_size:
+            return None
+        last = rows[-1]
+        return (last['timestamp'], last['id'])
+    
+    def _mood_row_to_dict(self, row) -> Dict:
+        """心情记录行 → 字典"""
+        return {
+            'id': row['id'],
+            'timestamp': row['timestamp'],
+            'mood_value': row['mood_value'],
+            'baseline': row['baseline'],
+            'sleep_pressure': row['sleep_pressure'],
+            'hrv_value': row['hrv_value'],
+            'parameters': json.loads(row['parameters'] or '{}'),
+            'notes': row['notes']
+        }
+    
+    def _event_row_to_dict(self, row) -> Dict:
+        """事件行 → 字典"""
+        return {
+            'id': row['id'],
+            'event_type': row['event_type'],
+            'event_description': row['event_description'],
+            'timestamp': row['timestamp'],
+            'amplitude': row['amplitude'],
+            'duration': row['duration'],
+            'ai_analysis': json.loads(row['ai_analysis'] or '{}')
+        }
     
     # ===== 用户参数 =====
     
     def get_user_parameters(self, user_id: int) -> Dict:
-        """获取用户个性化参数"""
+        """获取用户个性化参数（优先读进程缓存）"""
+        key = self._cache_key('params', user_id)
+        cached = user_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor(user_id)
             cursor.execute("""
                 SELECT tau_r, tau_d, circadian_k, circadian_amplitude, k, c, m, base_hrv, phi
                 FROM user_parameters 
@@ -402,53 +1396,129 @@ class Database:
             if not row:
                 return None
             
-            if self.db_type == "sqlite":
-                return {
-                    'tau_r': row['tau_r'],
-                    'tau_d': row['tau_d'],
-                    'circadian_k': row['circadian_k'],
-                    'circadian_amplitude': row['circadian_amplitude'],
-                    'k': row['k'],
-                    'c': row['c'],
-                    'm': row['m'],
-                    'base_hrv': row['base_hrv'],
-                    'phi': row['phi']
-                }
+            params = {name: row[name] for name in USER_PARAM_KEYS}
+            user_cache.put(key, params)
+            return dict(params)
         except Exception as e:
-            print(f"获取用户参数失败: {e}")
+            logger.error("获取用户参数失败: %s", e)
             return None
     
     def update_user_parameters(self, user_id: int, params: Dict) -> Tuple[bool, str]:
-        """更新用户个性化参数"""
+        """更新用户个性化参数（单条 UPDATE，写穿进程缓存）"""
         try:
-            cursor = self.conn.cursor()
-            
-            if 'tau_r' in params:
-                cursor.execute("UPDATE user_parameters SET tau_r=?, updated_at=? WHERE user_id=?", 
-                             (params['tau_r'], datetime.now(), user_id))
-            if 'tau_d' in params:
-                cursor.execute("UPDATE user_parameters SET tau_d=?, updated_at=? WHERE user_id=?", 
-                             (params['tau_d'], datetime.now(), user_id))
-            if 'k' in params:
-                cursor.execute("UPDATE user_parameters SET k=?, updated_at=? WHERE user_id=?", 
-                             (params['k'], datetime.now(), user_id))
-            if 'c' in params:
-                cursor.execute("UPDATE user_parameters SET c=?, updated_at=? WHERE user_id=?", 
-                             (params['c'], datetime.now(), user_id))
-            if 'circadian_amplitude' in params:
-                cursor.execute("UPDATE user_parameters SET circadian_amplitude=?, updated_at=? WHERE user_id=?", 
-                             (params['circadian_amplitude'], datetime.now(), user_id))
-            if 'base_hrv' in params:
-                cursor.execute("UPDATE user_parameters SET base_hrv=?, updated_at=? WHERE user_id=?", 
-                             (params['base_hrv'], datetime.now(), user_id))
+            changes = {name: params[name] for name in USER_PARAM_KEYS if name in params}
+            if not changes:
+                return False, "没有要更新的参数"
             
-            self.conn.commit()
+            assignments = ', '.join(f"{name}=?" for name in changes)
+            cursor = self._cursor(user_id)
+            cursor.execute(f"""
+                UPDATE user_parameters 
+                SET {assignments}, updated_at=?
+                WHERE user_id=?
+            """, (*changes.values(), datetime.now(), user_id))
+            
+            cursor.connection.commit()
+            user_cache.update(self._cache_key('params', user_id), changes)
             return True, "参数已更新"
             
         except Exception as e:
+            user_cache.invalidate(self._cache_key('params', user_id))
             return False, f"更新失败: {str(e)}"
     
+    # ===== 引擎状态 =====
+    
+    def save_engine_states(self, states: List[Dict]) -> Tuple[bool, List[int], str]:
+        """
+        按版本号比较并交换（CAS）保存引擎紧凑状态
+
+        参数:
+            states: [{'user_id', 'S', 'x', 'v', 'is_asleep', 'last_update_time', 'params',
+                      'anchor_real', 'anchor_sim', 'version'}, ...]
+                    version 为读取时的版本号（0 表示库中尚无该用户的状态），写入后变为 version + 1
+        返回: (是否成功, 版本冲突的用户ID列表, 消息)
+              冲突说明其它进程已写入更新的状态，调用方应重新 load_engine_state
+        """
+        by_conn = {}
+        for state in states:
+            by_conn.setdefault(id(self._conn_for(state['user_id'])), []).append(state)
+        
+        insert = "INSERT IGNORE" if self.db_type == "mysql" else "INSERT OR IGNORE"
+        conflicts = []
+        conn = None
+        try:
+            for group in by_conn.values():
+                cursor = self._cursor(group[0]['user_id'])
+                conn = cursor.connection
+                for state in group:
+                    values = (
+                        float(state['S']), float(state['x']), float(state['v']), int(bool(state['is_asleep'])),
+                        float(state['last_update_time']), json.dumps(state['params']),
+                        float(state['anchor_real']), float(state['anchor_sim']), datetime.now()
+                    )
+                    if state['version'] == 0:
+                        cursor.execute(f"""
+                            {insert} INTO engine_state
+                            (sleep_pressure, deviation, velocity, is_asleep, sim_time, parameters,
+                             anchor_real, anchor_sim, updated_at, user_id, version)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+                        """, (*values, state['user_id']))
+                    else:
+                        cursor.execute("""
+                            UPDATE engine_state
+                            SET sleep_pressure=?, deviation=?, velocity=?, is_asleep=?, sim_time=?,
+                                parameters=?, anchor_real=?, anchor_sim=?, updated_at=?, version=version+1
+                            WHERE user_id=? AND version=?
+                        """, (*values, state['user_id'], state['version']))
+                    if cursor.rowcount != 1:
+                        conflicts.append(state['user_id'])
+                conn.commit()
+            saved = len(states) - len(conflicts)
+            return True, conflicts, f"已保存 {saved} 个引擎状态，{len(conflicts)} 个版本冲突"
+        
+        except Exception as e:
+            # 回滚本组已执行的写入并释放写锁，避免下一次无关的 commit 把它们连同版本号一起提交
+            if conn is not None:
+                conn.rollback()
+            return False, conflicts, f"保存失败: {str(e)}"
+    
+    def load_engine_state(self, user_id: int) -> Optional[Dict]:
+        """读取引擎紧凑状态（含时钟锚点与版本号），没有保存过时返回 None"""
+        try:
+            cursor = self._cursor(user_id)
+            cursor.execute("""
+                SELECT sleep_pressure, deviation, velocity, is_asleep, sim_time, parameters,
+                       anchor_real, anchor_sim, version
+                FROM engine_state
+                WHERE user_id=?
+            """, (user_id,))
+            
+            row = cursor.fetchone()
+            
+            if not row:
+                return None
+            
+            return {
+                'user_id': user_id,
+                'S': row['sleep_pressure'],
+                'x': row['deviation'],
+                'v': row['velocity'],
+                'is_asleep': bool(row['is_asleep']),
+                'last_update_time': row['sim_time'],
+                'params': json.loads(row['parameters']),
+                'anchor_real': row['anchor_real'],
+                'anchor_sim': row['anchor_sim'],
+                'version': row['version'],
+            }
+        except Exception as e:
+            logger.error("读取引擎状态失败: %s", e)
+            return None
+    
     def close(self):
         """关闭数据库连接"""
+        self.flush_logins()
+        _open_databases.discard(self)
+        for shard in self.shards:
+            shard.close()
         if self.conn:
             self.conn.close()
@@ -0,0 +1,191 @@
+"""
+长时间范围心情曲线降采样
+一个月的心情记录有数十万点，全部交给 Plotly 会拖垮浏览器；屏幕上每个像素最多只需要一两个点。
+  - LTTB（Largest-Triangle-Three-Buckets）: 每个桶保留与相邻桶构成最大三角形面积的点，
+    折线形状与原曲线几乎一致
+  - 最小/最大包络: 每个桶的最小值和最大值，画成阴影带；压力/运动冲击这类窄峰即使
+    被 LTTB 折线略过，也保留在包络中
+  - 目标点数由图表宽度决定（target_points）
+  - mood_trend 在 Database.get_mood_series 的列式读取之上降采样，结果按
+    (库, 用户, 范围, 分辨率) 缓存；范围终点按桶宽取整，同一个桶内的重跑直接命中缓存
+
+环境变量:
+    DOWNSAMPLE_CACHE_TTL: 缓存有效期（秒，默认 60）
+"""
+
+import math
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+import numpy as np
+
+from db_module import UserCache
+from metrics import register_cache
+from ring_buffer import datetime_to_seconds
+
+# 默认图表宽度（像素）与每个点占用的像素
+DEFAULT_WIDTH_PX = 1200
+PX_PER_POINT = 2
+
+METHODS = ('lttb', 'minmax')
+
+# 进程级降采样结果缓存（LRU）
+downsample_cache = UserCache(max_entries=512)
+register_cache('downsample', downsample_cache)
+
+
+def target_points(width_px: int = DEFAULT_WIDTH_PX, px_per_point: float = PX_PER_POINT) -> int:
+    """图表宽度对应的目标点数（至少 3 个）"""
+    return max(int(width_px / px_per_point), 3)
+
+
+def _as_float(x: np.ndarray) -> np.ndarray:
+    """时间轴 → float（datetime64 按其自身单位的整数计）"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype(np.int64).astype(float)
+    return x.astype(float)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    LTTB 降采样，返回保留点的下标（升序）
+
+    参数:
+        x: 升序时间轴（数值或 datetime64）
+        y: 值
+        threshold: 目标点数（不少于 3；不少于原点数时原样返回）
+    首末点总是保留；中间的点均分为 threshold - 2 个桶，每个桶选出一个点。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    xf = _as_float(x)
+    yf = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    # 前缀和: 任意桶的均值 O(1)
+    cx = np.concatenate(([0.0], np.cumsum(xf)))
+    cy = np.concatenate(([0.0], np.cumsum(yf)))
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x = (cx[nhi] - cx[nlo]) / (nhi - nlo)
+            avg_y = (cy[nhi] - cy[nlo]) / (nhi - nlo)
+        else:
+            avg_x, avg_y = xf[-1], yf[-1]
+        ax, ay = xf[a], yf[a]
+        area = np.abs((ax - avg_x) * (yf[lo:hi] - ay) - (ax - xf[lo:hi]) * (avg_y - ay))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def _bucket_starts(n: int, buckets: int) -> np.ndarray:
+    return np.unique(np.linspace(0, n, min(buckets, n) + 1).astype(int)[:-1])
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    每个桶的最小值和最大值所在下标（升序，保持时间顺序）
+
+    折线经过每个桶的两个极值，窄峰不会被略过；点数约为 2 * buckets。
+    """
+    n = len(y)
+    if 2 * buckets >= n:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    starts = _bucket_starts(n, buckets)
+    sizes = np.diff(np.append(starts, n))
+    bucket = np.repeat(np.arange(len(starts)), sizes)
+
+    def first_match(extremes):
+        # 每个桶中第一个等于该桶极值的点
+        hits = np.flatnonzero(y == np.repeat(extremes, sizes))
+        _, first = np.unique(bucket[hits], return_index=True)
+        return hits[first]
+
+    return np.union1d(first_match(np.minimum.reduceat(y, starts)),
+                      first_match(np.maximum.reduceat(y, starts)))
+
+
+def minmax_envelope(x: np.ndarray, y: np.ndarray, buckets: int) -> Dict[str, np.ndarray]:
+    """
+    最小/最大包络
+
+    返回: {'x': 桶中点时间, 'min': 桶内最小值, 'max': 桶内最大值}
+    """
+    n = len(y)
+    if n == 0:
+        return {'x': np.asarray(x)[:0], 'min': np.empty(0), 'max': np.empty(0)}
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    starts = _bucket_starts(n, buckets)
+    ends = np.append(starts[1:], n) - 1
+    return {
+        'x': x[starts] + (x[ends] - x[starts]) / 2,
+        'min': np.minimum.reduceat(y, starts),
+        'max': np.maximum.reduceat(y, starts),
+    }
+
+
+def downsample(x: np.ndarray, y: np.ndarray, points: int, method: str = 'lttb') -> Dict[str, np.ndarray]:
+    """
+    降采样为约 points 个点
+
+    返回: {'x', 'y'（折线）, 'envelope'（minmax_envelope）, 'raw_points'}
+    """
+    if method not in METHODS:
+        raise ValueError(f"未知的降采样方法: {method}")
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    if method == 'lttb':
+        index = lttb_indices(x, y, points)
+    else:
+        index = minmax_indices(y, max(points // 2, 1))
+    return {
+        'x': x[index],
+        'y': y[index],
+        'envelope': minmax_envelope(x, y, max(points // 2, 1)),
+        'raw_points': len(y),
+    }
+
+
+def mood_trend(db, user_id: int, days: int, width_px: int = DEFAULT_WIDTH_PX,
+               method: str = 'lttb', now: datetime = None, ttl: float = None) -> Dict:
+    """
+    最近 days 天的降采样心情曲线（带缓存）
+
+    参数:
+        db: Database 实例
+        width_px: 图表宽度（像素），决定目标点数
+        now: 范围终点（UTC，默认当前时间）
+        ttl: 缓存有效期（秒，None 时读取 DOWNSAMPLE_CACHE_TTL）
+    返回: downsample() 的结果；范围内没有记录时 raw_points 为 0
+    """
+    if ttl is None:
+        ttl = float(os.environ.get("DOWNSAMPLE_CACHE_TTL", "60"))
+    points = target_points(width_px)
+    span = timedelta(days=days)
+    # 终点按桶宽向上取整: 同一个桶内的重跑使用同一个缓存键
+    bucket_seconds = span.total_seconds() / points
+    now = now or datetime.utcnow()
+    end_slot = math.ceil(datetime_to_seconds(now) / bucket_seconds)
+    key = (db.db_path, 'mood_trend', user_id, days, points, method, end_slot)
+
+    cached = downsample_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    end = datetime(1970, 1, 1) + timedelta(seconds=end_slot * bucket_seconds)
+    series = db.get_mood_series(user_id, start=end - span, end=end,
+                                columns=('timestamp', 'mood_value'))
+    result = downsample(series['timestamp'], series['mood_value'], points, method)
+    downsample_cache.put(key, (time.monotonic(), result))
+    return result
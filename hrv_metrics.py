@@ -0,0 +1,245 @@
+"""
+RR 间期 → HRV 指标模块
+从内存映射的二进制 RR 文件读取逐搏间期（每周可达数百万个），
+用 NumPy 滑动窗口视图 (stride tricks) 批量计算窗口化的
+rMSSD、SDNN、pNN50 以及基于 Welch 谱估计的 LF/HF。
+
+输出为按窗口结束时刻排列的时间序列，其中 rMSSD 可直接作为
+BioEngine.apply_event('hrv_update', value) 的输入（映射到 base_hrv / k / c）。
+
+RR 文件格式: 连续存放的小端 float32，单位毫秒（可用 write_rr_file 生成）。
+"""
+
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 频带定义 (Hz)，Task Force of ESC/NASPE (1996)
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.40)
+
+# 生理上合理的 RR 间期 (ms)，超出范围视为伪迹
+RR_VALID_RANGE_MS = (300.0, 2000.0)
+
+# NumPy 2.0 把 trapz 更名为 trapezoid
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+
+def write_rr_file(path: str, rr_ms, dtype: str = '<f4'):
+    """把 RR 间期数组写成二进制文件（追加写入可多次调用）"""
+    np.asarray(rr_ms, dtype=dtype).tofile(path)
+
+
+def load_rr_memmap(path: str, dtype: str = '<f4') -> np.memmap:
+    """只读内存映射 RR 文件，不把整个文件载入内存"""
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def artifact_mask(rr_ms: np.ndarray) -> np.ndarray:
+    """有效心搏掩码：超出生理范围的间期（伪迹/漏搏）为 False"""
+    lo, hi = RR_VALID_RANGE_MS
+    return (rr_ms >= lo) & (rr_ms <= hi)
+
+
+def beat_times_ms(rr_ms, chunk_beats: int = 1 << 20) -> np.ndarray:
+    """
+    每个心搏结束时刻（相对第一个心搏起点，ms）
+
+    按原始间期（含伪迹）分块累加：伪迹间期同样占用真实时间，剔除后再累加会让之后的
+    时间戳整体前移。分块读取 memmap，不生成整份 float64 的 RR 副本。
+    """
+    n = len(rr_ms)
+    times = np.empty(n, dtype=np.float64)
+    carry = 0.0
+    for lo in range(0, n, chunk_beats):
+        hi = min(lo + chunk_beats, n)
+        np.cumsum(rr_ms[lo:hi], dtype=np.float64, out=times[lo:hi])
+        times[lo:hi] += carry
+        carry = times[hi - 1]
+    return times
+
+
+def windowed_hrv(rr_ms, window_beats: int = 300, step_beats: int = 60,
+                 t0_ms: int = 0, spectral: bool = True, resample_hz: float = 4.0,
+                 batch_windows: int = 2048) -> Dict[str, np.ndarray]:
+    """
+    计算滑动窗口 HRV 指标
+
+    伪迹按窗口掩码处理：SDNN / 平均心率只用有效心搏，rMSSD / pNN50 只用两端都有效的
+    相邻差值（不跨越被剔除的心搏），频域插值只经过有效心搏。没有有效差值的窗口为 NaN。
+
+    参数:
+        rr_ms: RR 间期 (ms)，可以是 load_rr_memmap 返回的 memmap
+        window_beats / step_beats: 窗口长度与步长（以心搏计）
+        t0_ms: 第一个心搏的绝对时间 (epoch ms)，用于生成输出时间戳
+        spectral: 是否计算 LF/HF（需要 scipy）
+        resample_hz: 频域分析的等间隔重采样频率
+        batch_windows: 每批处理的窗口数，限制中间数组的内存（每批只把覆盖的心搏转为 float64）
+    返回:
+        {'t_end_ms', 'rmssd', 'sdnn', 'pnn50', 'mean_hr', 'lf', 'hf', 'lf_hf'}
+    """
+    if len(rr_ms) < window_beats:
+        return _empty_metrics()
+
+    beat_times = beat_times_ms(rr_ms)
+
+    n_windows = (len(rr_ms) - window_beats) // step_beats + 1
+    starts = np.arange(n_windows) * step_beats
+    ends = starts + window_beats - 1
+
+    result = {
+        't_end_ms': (t0_ms + beat_times[ends]).astype(np.int64),
+        'rmssd': np.empty(n_windows),
+        'sdnn': np.empty(n_windows),
+        'pnn50': np.empty(n_windows),
+        'mean_hr': np.empty(n_windows),
+        'lf': np.full(n_windows, np.nan),
+        'hf': np.full(n_windows, np.nan),
+        'lf_hf': np.full(n_windows, np.nan),
+    }
+
+    for lo in range(0, n_windows, batch_windows):
+        hi = min(lo + batch_windows, n_windows)
+        first, last = starts[lo], ends[hi - 1] + 1
+        # 多取前一个心搏，频域插值网格从它的结束时刻开始
+        pre = max(first - 1, 0)
+        rr_ext = np.asarray(rr_ms[pre:last], dtype=np.float64)
+        valid_ext = artifact_mask(rr_ext)
+        rr, valid = rr_ext[first - pre:], valid_ext[first - pre:]
+
+        # 零拷贝窗口视图: (批内窗口数, window_beats)
+        w = sliding_window_view(rr, window_beats)[::step_beats]
+        m = sliding_window_view(valid, window_beats)[::step_beats]
+        d = sliding_window_view(np.diff(rr), window_beats - 1)[::step_beats]
+        md = sliding_window_view(valid[1:] & valid[:-1], window_beats - 1)[::step_beats]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n_beats = m.sum(axis=1)
+            mean_rr = np.where(m, w, 0.0).sum(axis=1) / n_beats
+            sq_dev = np.where(m, (w - mean_rr[:, None]) ** 2, 0.0)
+            n_diffs = md.sum(axis=1)
+            d = np.where(md, d, 0.0)
+
+            result['rmssd'][lo:hi] = np.sqrt((d * d).sum(axis=1) / n_diffs)
+            result['sdnn'][lo:hi] = np.sqrt(sq_dev.sum(axis=1) / (n_beats - 1))
+            result['pnn50'][lo:hi] = 100.0 * (np.abs(d) > 50.0).sum(axis=1) / n_diffs
+            result['mean_hr'][lo:hi] = 60000.0 / mean_rr
+
+        if spectral:
+            window_start_ms = np.where(starts[lo:hi] > 0, beat_times[starts[lo:hi] - 1], 0.0)
+            window_end_ms = beat_times[ends[lo:hi]]
+            lf, hf = _welch_band_powers(beat_times[pre:last][valid_ext], rr_ext[valid_ext],
+                                        window_start_ms, window_end_ms, resample_hz)
+            result['lf'][lo:hi] = lf
+            result['hf'][lo:hi] = hf
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result['lf_hf'][lo:hi] = np.where(hf > 0, lf / hf, np.nan)
+
+    return result
+
+
+def _welch_band_powers(beat_times: np.ndarray, rr: np.ndarray,
+                       start_ms: np.ndarray, end_ms: np.ndarray,
+                       fs: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    一批窗口的 LF / HF 功率 (ms²)
+
+    RR 序列 (非等间隔) 先在 fs Hz 的等间隔网格上线性插值；批内心搏时刻
+    单调递增，所以整批窗口的网格点只需一次 np.interp。批内取最短窗口时长作为
+    公共网格长度，得到 (窗口数, M) 的矩阵后沿最后一维一次性做 Welch。
+    """
+    from scipy.signal import welch
+
+    step_ms = 1000.0 / fs
+    n_grid = int(np.min(end_ms - start_ms) // step_ms)
+    if n_grid < 16 or len(rr) < 2:
+        nan = np.full(len(start_ms), np.nan)
+        return nan, nan
+
+    grid = start_ms[:, None] + step_ms * np.arange(n_grid)[None, :]
+    tachogram = np.interp(grid.ravel(), beat_times, rr).reshape(grid.shape)
+
+    nperseg = min(256, n_grid)
+    freqs, psd = welch(tachogram, fs=fs, nperseg=nperseg, detrend='linear', axis=-1)
+    return _band_power(freqs, psd, LF_BAND), _band_power(freqs, psd, HF_BAND)
+
+
+def _band_power(freqs: np.ndarray, psd: np.ndarray, band: Tuple[float, float]) -> np.ndarray:
+    mask = (freqs >= band[0]) & (freqs < band[1])
+    if not mask.any():
+        return np.zeros(psd.shape[0])
+    return _trapezoid(psd[:, mask], freqs[mask], axis=-1)
+
+
+def _empty_metrics() -> Dict[str, np.ndarray]:
+    metrics = {name: np.array([], dtype=np.float64)
+               for name in ('rmssd', 'sdnn', 'pnn50', 'mean_hr', 'lf', 'hf', 'lf_hf')}
+    metrics['t_end_ms'] = np.array([], dtype=np.int64)
+    return metrics
+
+
+def metrics_from_file(path: str, t0_ms: int = 0, dtype: str = '<f4', **kwargs) -> Dict[str, np.ndarray]:
+    """从内存映射 RR 文件计算窗口化指标"""
+    return windowed_hrv(load_rr_memmap(path, dtype=dtype), t0_ms=t0_ms, **kwargs)
+
+
+def to_hrv_samples(metrics: Dict[str, np.ndarray]) -> Iterator[Tuple[str, int, float, None]]:
+    """
+    指标时间序列 → 可穿戴样本 ('hrv', ts_epoch_ms, rmssd, None)
+
+    可直接交给 Database.add_wearable_samples 入库，或交给
+    wearable_import.EngineReplayer 回放（触发 hrv_update → k / c 映射）。
+    """
+    for ts, rmssd in zip(metrics['t_end_ms'].tolist(), metrics['rmssd'].tolist()):
+        if np.isfinite(rmssd):
+            yield ('hrv', ts, rmssd, None)
+
+
+def feed_engine(engine, metrics: Dict[str, np.ndarray]) -> int:
+    """按时间顺序把窗口 rMSSD 回放到引擎（只写回校准参数，不推进引擎时钟），返回回放的样本数"""
+    from wearable_import import EngineReplayer
+
+    replayer = EngineReplayer(engine)
+    replayer.feed(to_hrv_samples(metrics))
+    replayer.apply()
+    return replayer.replayed
+
+
+def summarize(metrics: Dict[str, np.ndarray]) -> List[Dict]:
+    """指标转为字典列表（便于展示或导出为 DataFrame）"""
+    names = ('t_end_ms', 'rmssd', 'sdnn', 'pnn50', 'mean_hr', 'lf', 'hf', 'lf_hf')
+    return [dict(zip(names, row)) for row in zip(*(metrics[n].tolist() for n in names))]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="RR 间期文件 → 窗口化 HRV 指标")
+    parser.add_argument('file', help="float32 小端 RR 间期 (ms) 二进制文件")
+    parser.add_argument('--t0-ms', type=int, default=0, help="第一个心搏的 epoch 毫秒时间")
+    parser.add_argument('--window', type=int, default=300, help="窗口长度 (心搏)")
+    parser.add_argument('--step', type=int, default=60, help="窗口步长 (心搏)")
+    parser.add_argument('--no-spectral', action='store_true', help="跳过 LF/HF 计算")
+    parser.add_argument('--user-id', type=int, default=None, help="指定时把 rMSSD 写入 wearable_samples")
+    parser.add_argument('--db', default='bio_mood.db')
+    args = parser.parse_args()
+
+    result = metrics_from_file(args.file, t0_ms=args.t0_ms, window_beats=args.window,
+                               step_beats=args.step, spectral=not args.no_spectral)
+    n = len(result['t_end_ms'])
+    print(f"{n} 个窗口")
+    if n:
+        print(f"rMSSD 中位数 {np.nanmedian(result['rmssd']):.1f} ms, "
+              f"SDNN 中位数 {np.nanmedian(result['sdnn']):.1f} ms, "
+              f"pNN50 中位数 {np.nanmedian(result['pnn50']):.1f}%, "
+              f"LF/HF 中位数 {np.nanmedian(result['lf_hf']):.2f}")
+
+    if args.user_id is not None and n:
+        from db_module import Database
+
+        database = Database(db_type="sqlite", db_path=args.db)
+        success, msg = database.add_wearable_samples(args.user_id, list(to_hrv_samples(result)),
+                                                     source='rr_file')
+        print(msg)
+        database.close()
@@ -0,0 +1,153 @@
+"""
+增量实时曲线组件
+浏览器端（live_chart_frontend/index.html，原生 JS + 同目录下随组件分发的 plotly.min.js，
+不依赖外部 CDN）缓存图表、布局和事件标记，
+每次重跑服务端只发送上次渲染之后新增的点，由 Plotly.extendTraces 追加；
+布局/样式与事件标记只在内容变化时发送。每次重跑的负载和服务端开销与历史长度无关。
+
+数据源约定: source(since) -> (start, points)
+    since: 浏览器已有的点的绝对序号上界（下一个需要的点）
+    start: points[0] 的绝对序号（since 早于窗口起点时为窗口起点，超过末尾时为末尾）
+    points: [(x, y0, y1, ...), ...]，按时间顺序
+
+浏览器发现序号缺口（错过了一次渲染、iframe 被重新挂载）时通过组件返回值请求重新同步，
+服务端随后发送完整窗口。
+
+预测轨迹播放（可选 forecast）: 服务端一次发送一段带时间戳的预测轨迹，浏览器按真实时间
+逐点追加，不再需要服务端每秒重跑；此时增量渲染不再发送数据源的新点（只在完整窗口中发送）。
+预测段快播完时浏览器通过组件返回值 {'need': 段标识} 请求下一段。
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "live_chart_frontend")
+_component = components.declare_component("live_chart", path=_FRONTEND_DIR)
+
+
+def sequence_source(total: int, *columns: Sequence) -> Callable[[int], Tuple[int, List[tuple]]]:
+    """
+    由若干等长的序列（list/deque，末尾为最新点）构造数据源
+
+    参数:
+        total: 累计追加过的点数（窗口末尾点的绝对序号 + 1）
+        columns: x 序列和各条曲线的 y 序列
+    只按下标访问末尾新增的部分，不复制整个窗口。
+    """
+    def source(since: int) -> Tuple[int, List[tuple]]:
+        start = total - len(columns[0])
+        begin = min(max(since, start), total)
+        return begin, [tuple(column[i - start] for column in columns) for i in range(begin, total)]
+    return source
+
+
+def ring_source(buffer, x_field: str, y_fields: Sequence[str],
+                x_transform: Callable = None) -> Callable[[int], Tuple[int, List[tuple]]]:
+    """
+    由 ring_buffer.RingBuffer 构造数据源（只转换 since 之后的视图）
+
+    参数:
+        buffer: 环形缓冲区
+        x_field: x 字段名
+        y_fields: 各条曲线的 y 字段名
+        x_transform: x 视图的转换函数（例如 seconds_to_datetime64）
+    """
+    def source(since: int) -> Tuple[int, List[tuple]]:
+        begin, columns = buffer.since(since)
+        x = columns[x_field]
+        if x_transform is not None:
+            x = x_transform(x)
+        return begin, list(zip(x.tolist(), *(columns[name].tolist() for name in y_fields)))
+    return source
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # NumPy 标量
+        return value.item()
+    return value
+
+
+def _revision(obj) -> str:
+    return hashlib.md5(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def live_chart(key: str, source: Callable[[int], Tuple[int, List[tuple]]],
+               traces: List[Dict], layout: Dict, markers: Optional[List[Dict]] = None,
+               window: int = 288, height: int = 420, series_id=None,
+               forecast: Optional[Dict] = None):
+    """
+    渲染增量实时曲线
+
+    参数:
+        key: 组件键（同一页面内唯一，保证重跑之间复用同一个 iframe）
+        source: 数据源，见模块说明
+        traces: 每条曲线的 Plotly 样式（name/mode/line/fill 等，不含 x/y），顺序与 y 列一致
+        layout: Plotly 布局
+        markers: 事件标记 [{'x', 'y'(可选), 'label', 'text', 'color'}]，画为竖线 + 标注 + 星形点
+        window: 浏览器端保留的点数
+        height: 组件高度（像素）
+        series_id: 数据序列标识，变化时（例如孪生被换出后重新创建、序号重新计数）发送完整窗口
+        forecast: 预测轨迹段 {'id': 段标识, 'now': 服务端当前时间（秒）, 'lead': 提前请求下一段的秒数,
+                  'points': [(t, x, y0, y1, ...)]}，t 为与 now 同一时钟的秒数；
+                  段标识变化时才发送给浏览器
+    """
+    state_key = f"_live_chart_{key}"
+    sent = st.session_state.setdefault(state_key, {
+        'have': None, 'layout_rev': None, 'markers_rev': None, 'resync': None, 'series_id': None,
+        'forecast_id': None,
+    })
+
+    markers = [{name: _json_value(value) for name, value in marker.items()} for marker in markers or []]
+    layout_rev = _revision([traces, layout, window])
+    markers_rev = _revision(markers)
+
+    # 上一次渲染时浏览器返回的重新同步请求
+    request = st.session_state.get(key)
+    resync = isinstance(request, dict) and request.get('resync') not in (None, sent['resync'])
+    if resync:
+        sent['resync'] = request['resync']
+
+    reset = (resync or sent['have'] is None or layout_rev != sent['layout_rev']
+             or series_id != sent['series_id'])
+    if forecast is not None and not reset:
+        # 新点由浏览器按预测轨迹播放
+        start, points = sent['have'], []
+    else:
+        start, points = source(0 if reset else sent['have'])
+    if not reset and start != sent['have']:
+        # 上次渲染之后新增的点已超过窗口长度，或序号倒退，发送完整窗口
+        reset = True
+        start, points = source(0)
+    args = {
+        'reset': reset,
+        'base': start,
+        'points': [[_json_value(v) for v in point] for point in points],
+        'window': window,
+        'height': height,
+        'layout_rev': layout_rev,
+        'markers_rev': markers_rev,
+        'traces': traces if reset else None,
+        'layout': layout if reset else None,
+        'markers': markers if reset or markers_rev != sent['markers_rev'] else None,
+        'forecast': None,
+    }
+    forecast_id = forecast['id'] if forecast is not None else None
+    if forecast is not None and (reset or forecast_id != sent['forecast_id']):
+        args['forecast'] = {
+            'id': forecast_id,
+            'now': forecast['now'],
+            'lead': forecast.get('lead', 10),
+            'points': [[_json_value(v) for v in point] for point in forecast['points']],
+        }
+    sent.update(have=start + len(points), layout_rev=layout_rev, markers_rev=markers_rev,
+                series_id=series_id, forecast_id=forecast_id)
+    _component(key=key, default=None, **args)
@@ -0,0 +1,444 @@
+"""
+Prometheus 风格的运行指标
+进程内注册表（计数器 / 仪表，支持标签），按 Prometheus 文本格式 0.0.4 输出:
+  - 本地 HTTP 端点: 设置 METRICS_PORT 后后台线程监听，GET /metrics 返回全部指标
+  - 定期写文件: 设置 METRICS_FILE 后每 METRICS_FILE_INTERVAL 秒原子地重写一次
+    （可交给 node_exporter 的 textfile collector）
+  - 采集时计算: set_function() 的值在导出时才计算（活跃会话数、session_state 内存、缓存命中数）；
+    add_collector() 的回调在导出前从已有统计刷新指标，每个耗时只有一个来源:
+    数据库语句取自 query_stats（按 Database 方法汇总），引擎步进 / AI 调用等热点路径取自 perf_timings
+  - session_state 内存: 各会话在自己的重跑结束时调用 observe_session_state() 估算并登记，
+    导出时只累加仍然活跃的会话（不跨线程遍历其他会话的状态）
+
+已接入: BioEngine.step / step_engines（步进次数）、analyze_event_with_*（失败次数）、
+query_stats（register_query_stats）、perf_timings（register_timings）、UserCache（register_cache）、
+Streamlit 会话（活跃数与 session_state 内存）。
+导出器由入口脚本调用 start_exporters() 启动，同一进程只启动一次。
+
+环境变量:
+    METRICS_PORT: HTTP 端点端口（不设置则不启动）
+    METRICS_HOST: HTTP 端点监听地址（默认 127.0.0.1）
+    METRICS_FILE: 指标文件路径（不设置则不写）
+    METRICS_FILE_INTERVAL: 写文件间隔（秒，默认 15）
+"""
+
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: Tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Value:
+    """计数器 / 仪表的单个时间序列"""
+
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def set_function(self, function: Callable[[], float]):
+        """导出时调用 function() 取值（异常时导出 NaN）"""
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                logger.exception("指标取值失败")
+                return math.nan
+        with self._lock:
+            return self._value
+
+
+class _GaugeValue(_Value):
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = float(value)
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+
+class _Metric:
+    """指标族：按标签值保存各时间序列；无标签时直接在指标上调用"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self._child(())
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _child(self, key: Tuple[str, ...]):
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def labels(self, **values):
+        """按标签取时间序列（首次使用时创建）"""
+        if set(values) != set(self.labelnames):
+            raise ValueError(f"{self.name} 的标签应为 {self.labelnames}")
+        return self._child(tuple(str(values[name]) for name in self.labelnames))
+
+    def __getattr__(self, name):
+        # 无标签指标: inc/set/set_function 转给唯一的时间序列
+        if name.startswith('_') or self.labelnames:
+            raise AttributeError(name)
+        return getattr(self._default, name)
+
+    def clear(self):
+        """删除全部带标签的时间序列（采集回调重新填充前调用）"""
+        with self._lock:
+            self._children.clear()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """单调递增计数器（名称以 _total 结尾）"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value(threading.Lock())
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_label_text(self.labelnames, key)} {_format_value(child.get())}"
+                for key, child in list(self._children.items())]
+
+
+class Gauge(Counter):
+    """可增可减的仪表"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue(threading.Lock())
+
+
+class MetricsRegistry:
+    """指标注册表（同名重复注册返回已有指标）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        # HTTP 端点与写文件线程可能同时导出，采集与输出整体串行
+        self._collect_lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"指标 {name} 已注册为 {metric.type_name}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def add_collector(self, collect: Callable[[], None]):
+        """导出前调用 collect()，由它从其他模块已有的统计刷新指标（热点路径上不再另外记录）"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def exposition(self) -> str:
+        """全部指标的文本格式"""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        with self._collect_lock:
+            for collect in collectors:
+                try:
+                    collect()
+                except Exception:
+                    logger.exception("指标采集失败")
+            return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+# 进程内共享的注册表
+registry = MetricsRegistry()
+
+# ===== 应用指标 =====
+
+engine_steps_total = registry.counter(
+    "bio_engine_steps_total", "引擎步进次数（批量步进按引擎数计）", ("mode",))
+db_queries_total = registry.counter(
+    "bio_db_queries_total", "数据库语句执行次数，按 Database 方法汇总", ("method",))
+db_query_seconds_total = registry.counter(
+    "bio_db_query_seconds_total", "数据库语句累计耗时（秒，含读取结果），按 Database 方法汇总", ("method",))
+db_rows_total = registry.counter(
+    "bio_db_rows_total", "数据库语句返回 / 影响的行数，按 Database 方法汇总", ("method",))
+db_errors_total = registry.counter(
+    "bio_db_errors_total", "数据库语句执行失败次数，按 Database 方法汇总", ("method",))
+timer_calls_total = registry.counter(
+    "bio_timer_calls_total", "热点路径计时点的调用次数", ("name",))
+timer_seconds_total = registry.counter(
+    "bio_timer_seconds_total", "热点路径计时点的累计耗时（秒）", ("name",))
+timer_window_seconds = registry.gauge(
+    "bio_timer_window_seconds", "热点路径计时点最近样本的耗时分位数（秒）", ("name", "quantile"))
+ai_errors_total = registry.counter(
+    "bio_ai_errors_total", "AI 事件分析失败（回退到默认分析）次数", ("provider",))
+cache_hits_total = registry.counter("bio_cache_hits_total", "缓存命中次数", ("cache",))
+cache_misses_total = registry.counter("bio_cache_misses_total", "缓存未命中次数", ("cache",))
+cache_hit_ratio = registry.gauge("bio_cache_hit_ratio", "缓存累计命中率", ("cache",))
+cache_entries = registry.gauge("bio_cache_entries", "缓存条目数", ("cache",))
+active_sessions = registry.gauge("bio_active_sessions", "活跃的 Streamlit 会话数")
+session_state_bytes = registry.gauge("bio_session_state_bytes", "全部活跃会话的 session_state 估算内存（字节）")
+
+
+def register_cache(name: str, cache):
+    """把 UserCache（有 stats() 方法）的命中统计接入指标，导出时读取"""
+    cache_hits_total.labels(cache=name).set_function(lambda: cache.stats()['hits'])
+    cache_misses_total.labels(cache=name).set_function(lambda: cache.stats()['misses'])
+    cache_hit_ratio.labels(cache=name).set_function(lambda: cache.stats()['hit_rate'])
+    cache_entries.labels(cache=name).set_function(lambda: cache.stats()['entries'])
+
+
+def _collected(child, value: float):
+    """采集回调读到的外部累计值（计数器没有 set，导出时原样输出该值）"""
+    child.set_function(lambda: value)
+
+
+def register_query_stats(stats):
+    """把 QueryStats 的按方法汇总接入指标，导出时读取（语句计时只在 InstrumentedCursor 记录一次）"""
+    def collect():
+        # 先清空，统计被重置（管理面板的“重置统计”）后不保留旧序列
+        for metric in (db_queries_total, db_query_seconds_total, db_rows_total, db_errors_total):
+            metric.clear()
+        for row in stats.by_tag():
+            method = row['tag']
+            _collected(db_queries_total.labels(method=method), row['count'])
+            _collected(db_query_seconds_total.labels(method=method), row['total_ms'] / 1000)
+            _collected(db_rows_total.labels(method=method), row['rows'])
+            _collected(db_errors_total.labels(method=method), row['errors'])
+    registry.add_collector(collect)
+
+
+def register_timings(timings):
+    """把 PerfTimings 的各计时点接入指标，导出时读取（累计次数 / 耗时 + 滚动窗口分位数）"""
+    def collect():
+        for metric in (timer_calls_total, timer_seconds_total, timer_window_seconds):
+            metric.clear()
+        for row in timings.snapshot():
+            name = row['name']
+            _collected(timer_calls_total.labels(name=name), row['count'])
+            _collected(timer_seconds_total.labels(name=name), row['total_ms'] / 1000)
+            for key, value in row.items():
+                if key.startswith('p') and key.endswith('_ms'):
+                    quantile = str(int(key[1:-3]) / 100)
+                    _collected(timer_window_seconds.labels(name=name, quantile=quantile), value / 1000)
+    registry.add_collector(collect)
+
+
+def _streamlit_runtime():
+    """当前进程的 Streamlit 运行时；不在 streamlit run 下（或尚未导入 streamlit）时为 None"""
+    runtime = sys.modules.get('streamlit.runtime')
+    if runtime is None or not runtime.exists():
+        return None
+    return runtime.get_instance()
+
+
+def _active_session_count() -> float:
+    runtime = _streamlit_runtime()
+    return runtime._session_mgr.num_active_sessions() if runtime is not None else math.nan
+
+
+# 会话 id → 最近一次重跑结束时估算的 session_state 字节数
+_session_sizes: Dict[str, int] = {}
+
+
+def estimate_size(obj, max_depth: int = 8) -> int:
+    """对象及其引用的容器 / 属性的估算内存（NumPy 数组按 nbytes，同一对象只计一次）"""
+    seen = set()
+
+    def size(value, depth: int) -> int:
+        if id(value) in seen or depth > max_depth:
+            return 0
+        seen.add(id(value))
+        nbytes = getattr(value, 'nbytes', None)
+        if isinstance(nbytes, int):
+            return sys.getsizeof(value, 0) + (0 if getattr(value, 'base', None) is not None else nbytes)
+        total = sys.getsizeof(value, 0)
+        if isinstance(value, (str, bytes, bytearray, int, float, bool, type(None))):
+            return total
+        if isinstance(value, dict):
+            items = [item for pair in value.items() for item in pair]
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            items = list(value)
+        else:
+            items = list(getattr(value, '__dict__', {}).values())
+        return total + sum(size(item, depth + 1) for item in items)
+
+    try:
+        return size(obj, 0)
+    except RuntimeError:
+        # 估算期间被其他线程修改（dict changed size）
+        return 0
+
+
+def observe_session_state(state, session_id: str = None) -> int:
+    """在会话自己的重跑中调用：估算 session_state 内存并登记（session_id 默认取当前重跑的会话）"""
+    if session_id is None:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is None:
+            return 0
+        session_id = ctx.session_id
+    nbytes = estimate_size({key: state[key] for key in list(state.keys())})
+    _session_sizes[session_id] = nbytes
+    return nbytes
+
+
+def _session_state_bytes() -> float:
+    runtime = _streamlit_runtime()
+    if runtime is not None:
+        # 丢弃已关闭会话的登记
+        active = {info.session.id for info in runtime._session_mgr.list_active_sessions()}
+        for session_id in list(_session_sizes):
+            if session_id not in active:
+                _session_sizes.pop(session_id, None)
+    return float(sum(_session_sizes.values()))
+
+
+active_sessions.set_function(_active_session_count)
+session_state_bytes.set_function(_session_state_bytes)
+
+# ===== 导出 =====
+
+
+def start_http_server(port: int, host: str = "127.0.0.1"):
+    """在后台线程提供 GET /metrics（http.server 只在启用端点时导入，不计入各模块的冷启动）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("metrics %s - %s", self.address_string(), format % args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("指标端点已启动: http://%s:%d/metrics", host, server.server_port)
+    return server
+
+
+def write_metrics_file(path: str):
+    """原子地写入指标文件（先写临时文件再替换）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.exposition())
+    os.replace(tmp_path, path)
+
+
+def start_file_writer(path: str, interval: float = 15.0) -> threading.Thread:
+    """后台线程每 interval 秒重写一次指标文件"""
+    def run():
+        while True:
+            try:
+                write_metrics_file(path)
+            except Exception:
+                logger.exception("写入指标文件失败: %s", path)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-file", daemon=True)
+    thread.start()
+    logger.info("指标文件: %s（每 %.0f 秒更新）", path, interval)
+    return thread
+
+
+_exporters_lock = threading.Lock()
+_exporters_started = False
+
+
+def start_exporters(port: int = None, path: str = None) -> Tuple[bool, str]:
+    """
+    按参数或环境变量启动 HTTP 端点 / 指标文件（进程内只启动一次，Streamlit 重跑时重复调用无副作用）
+
+    返回: (是否已启动导出, 说明)
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return True, "指标导出已启动"
+        if port is None and os.environ.get("METRICS_PORT"):
+            port = int(os.environ["METRICS_PORT"])
+        if path is None:
+            path = os.environ.get("METRICS_FILE") or None
+        if port is None and path is None:
+            return False, "未设置 METRICS_PORT / METRICS_FILE，不导出指标"
+        try:
+            if port is not None:
+                start_http_server(port, os.environ.get("METRICS_HOST", "127.0.0.1"))
+            if path is not None:
+                start_file_writer(path, float(os.environ.get("METRICS_FILE_INTERVAL", "15")))
+        except OSError as e:
+            # 多个服务进程共用同一端口时只有第一个能监听
+            logger.warning("指标导出启动失败: %s", e)
+            return False, f"指标导出启动失败: {e}"
+        _exporters_started = True
+        return True, "指标导出已启动"
@@ -0,0 +1,319 @@
+"""
+心情记录冷存储归档模块
+将 SQLite 中超过保留期的 mood_records 按 用户/月份 写成压缩列式分区文件，
+并从数据库删除、增量回收空间。Database 配置 archive_dir 后，历史查询会
+透明地跨越热数据 (SQLite) 与冷数据 (归档文件)。
+
+分区格式:
+    <data_dir>/user_<id>/<YYYY-MM>.parquet   (安装了 pyarrow 时)
+    <data_dir>/user_<id>/<YYYY-MM>.npz       (否则使用 NumPy 压缩格式)
+
+命令行:
+    python mood_archive.py --db bio_mood.db --data-dir mood_archive --older-than-days 365
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# 分区中保存的列及其类型（文本列在 npz 中以 Unicode 数组保存，None 记为空串）
+ARCHIVE_COLUMNS = {
+    'ts_epoch_ms': np.int64,
+    'mood_value': np.float64,
+    'baseline': np.float64,
+    'sleep_pressure': np.float64,
+    'hrv_value': np.float64,
+    'parameters': str,
+    'notes': str,
+}
+TEXT_COLUMNS = ('parameters', 'notes')
+
+
+class MoodArchive:
+    """按用户/月份组织的心情记录冷存储"""
+
+    def __init__(self, data_dir: str = "mood_archive", fmt: str = None, cache_partitions: int = 8):
+        """
+        参数:
+            data_dir: 归档根目录
+            fmt: 'parquet' 或 'npz'，None 表示有 pyarrow 时用 parquet
+            cache_partitions: 内存中缓存最近读取的分区数（分页读取时避免重复解压）
+        """
+        if fmt is None:
+            fmt = 'parquet' if HAS_PYARROW else 'npz'
+        if fmt == 'parquet' and not HAS_PYARROW:
+            raise ImportError("Parquet 归档需要安装 pyarrow: pip install pyarrow")
+        if fmt not in ('parquet', 'npz'):
+            raise ValueError(f"未知的归档格式: {fmt}")
+
+        self.data_dir = data_dir
+        self.fmt = fmt
+        self.cache_partitions = cache_partitions
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(data_dir, exist_ok=True)
+
+    # ===== 分区路径 =====
+
+    def _user_dir(self, user_id: int) -> str:
+        return os.path.join(self.data_dir, f"user_{user_id}")
+
+    def partition_path(self, user_id: int, month: str) -> str:
+        """month 形如 '2025-01'"""
+        return os.path.join(self._user_dir(user_id), f"{month}.{self.fmt}")
+
+    def months(self, user_id: int) -> List[str]:
+        """该用户已归档的月份（升序）"""
+        user_dir = self._user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            return []
+        suffix = f".{self.fmt}"
+        return sorted(name[:-len(suffix)] for name in os.listdir(user_dir) if name.endswith(suffix))
+
+    # ===== 读写分区 =====
+
+    def read_partition(self, user_id: int, month: str) -> Dict[str, np.ndarray]:
+        """读取一个分区，返回按时间升序的列数组"""
+        path = self.partition_path(user_id, month)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None:
+                self._cache.move_to_end(path)
+                return cached
+
+        if not os.path.exists(path):
+            return _empty_columns()
+
+        if self.fmt == 'parquet':
+            table = pq.read_table(path)
+            data = {name: table.column(name).to_numpy(zero_copy_only=False) for name in ARCHIVE_COLUMNS}
+            data = {name: (arr.astype(str) if name in TEXT_COLUMNS else arr) for name, arr in data.items()}
+        else:
+            with np.load(path, allow_pickle=False) as npz:
+                data = {name: npz[name] for name in ARCHIVE_COLUMNS}
+
+        with self._lock:
+            self._cache[path] = data
+            while len(self._cache) > self.cache_partitions:
+                self._cache.popitem(last=False)
+        return data
+
+    def write_partition(self, user_id: int, month: str, data: Dict[str, np.ndarray]) -> int:
+        """
+        写入（合并）一个分区，返回新增条数
+
+        与已有数据按时间戳去重合并（已有数据优先），重复归档同一批记录不会产生重复行。
+        调用方需保证同一批内的时间戳互不相同（见 spread_duplicate_ms）。
+        """
+        existing = self.read_partition(user_id, month)
+        if len(existing['ts_epoch_ms']):
+            data = {name: np.concatenate([existing[name], data[name]]) for name in ARCHIVE_COLUMNS}
+
+        _, unique_idx = np.unique(data['ts_epoch_ms'], return_index=True)
+        data = {name: arr[unique_idx] for name, arr in data.items()}
+        written = len(unique_idx) - len(existing['ts_epoch_ms'])
+
+        os.makedirs(self._user_dir(user_id), exist_ok=True)
+        path = self.partition_path(user_id, month)
+        tmp_path = path + ".tmp"
+
+        if self.fmt == 'parquet':
+            table = pyarrow.table({name: data[name] for name in ARCHIVE_COLUMNS})
+            pq.write_table(table, tmp_path, compression='zstd')
+        else:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **{name: data[name] for name in ARCHIVE_COLUMNS})
+        # 先写临时文件再替换，避免中途失败留下损坏的分区
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._cache.pop(path, None)
+        return written
+
+    def append(self, user_id: int, data: Dict[str, np.ndarray]) -> int:
+        """把一批记录按月份拆分写入各分区，返回实际新增的条数"""
+        ts = data['ts_epoch_ms']
+        if not len(ts):
+            return 0
+        months = ts.astype('datetime64[ms]').astype('datetime64[M]').astype(str)
+        written = 0
+        for month in np.unique(months):
+            mask = months == month
+            written += self.write_partition(user_id, month, {name: arr[mask] for name, arr in data.items()})
+        return written
+
+    # ===== 范围读取 =====
+
+    def read_range(self, user_id: int, start_ms: int = None, end_ms: int = None) -> Dict[str, np.ndarray]:
+        """读取 [start_ms, end_ms) 范围内的归档记录（升序）"""
+        parts = []
+        for month in self._months_in_range(user_id, start_ms, end_ms):
+            data = self.read_partition(user_id, month)
+            ts = data['ts_epoch_ms']
+            lo = 0 if start_ms is None else np.searchsorted(ts, start_ms, side='left')
+            hi = len(ts) if end_ms is None else np.searchsorted(ts, end_ms, side='left')
+            if hi > lo:
+                parts.append({name: arr[lo:hi] for name, arr in data.items()})
+
+        if not parts:
+            return _empty_columns()
+        return {name: np.concatenate([p[name] for p in parts]) for name in ARCHIVE_COLUMNS}
+
+    def read_page_desc(self, user_id: int, before_ms: int = None, after_ms: int = None,
+                       limit: int = 100) -> Dict[str, np.ndarray]:
+        """从 before_ms（不含）往前读取至多 limit 条（降序），用于分页"""
+        parts = []
+        remaining = limit
+        for month in reversed(self._months_in_range(user_id, after_ms, before_ms)):
+            data = self.read_partition(user_id, month)
+            ts = data['ts_epoch_ms']
+            hi = len(ts) if before_ms is None else np.searchsorted(ts, before_ms, side='left')
+            lo = 0 if after_ms is None else np.searchsorted(ts, after_ms, side='right')
+            lo = max(lo, hi - remaining)
+            if hi > lo:
+                parts.append({name: arr[lo:hi][::-1] for name, arr in data.items()})
+                remaining -= hi - lo
+            if remaining <= 0:
+                break
+
+        if not parts:
+            return _empty_columns()
+        return {name: np.concatenate([p[name] for p in parts]) for name in ARCHIVE_COLUMNS}
+
+    def summarize(self, user_id: int, start_ms: int = None) -> Tuple[int, float, Optional[float], Optional[float]]:
+        """归档中 start_ms 之后记录的 (条数, 总和, 最大值, 最小值)，用于合并统计"""
+        moods = self.read_range(user_id, start_ms=start_ms)['mood_value']
+        if not len(moods):
+            return 0, 0.0, None, None
+        return len(moods), float(moods.sum()), float(moods.max()), float(moods.min())
+
+    def _months_in_range(self, user_id: int, start_ms: int = None, end_ms: int = None) -> List[str]:
+        months = self.months(user_id)
+        if start_ms is not None:
+            first = str(np.datetime64(int(start_ms), 'ms').astype('datetime64[M]'))
+            months = [m for m in months if m >= first]
+        if end_ms is not None:
+            last = str(np.datetime64(int(end_ms), 'ms').astype('datetime64[M]'))
+            months = [m for m in months if m <= last]
+        return months
+
+
+def _empty_columns() -> Dict[str, np.ndarray]:
+    return {name: np.array([], dtype=dtype) for name, dtype in ARCHIVE_COLUMNS.items()}
+
+
+def spread_duplicate_ms(ts: np.ndarray) -> np.ndarray:
+    """
+    升序时间戳中与前一条相同（或被顺延后重叠）的记录依次顺延 1 毫秒，使其严格递增
+
+    mood_records 的时间戳只精确到秒，同一秒内的多条记录会被顺延为 +0, +1, +2... ms
+    （与聚簇布局迁移的做法一致），否则在分区中按时间戳去重时会被合并。顺延量只取决于
+    记录在原表中的顺序，重复归档同一批记录得到相同的时间戳。
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    index = np.arange(len(ts))
+    return np.maximum.accumulate(ts - index) + index if len(ts) else ts
+
+
+def archive_to_records(data: Dict[str, np.ndarray]) -> List[Dict]:
+    """归档列数组 → 与 Database.get_mood_history 相同结构的字典列表"""
+    stamps = np.datetime_as_string(data['ts_epoch_ms'].astype('datetime64[ms]'), unit='s')
+    records = []
+    for i in range(len(data['ts_epoch_ms'])):
+        records.append({
+            'id': int(data['ts_epoch_ms'][i]),
+            'timestamp': stamps[i].replace('T', ' '),
+            'mood_value': float(data['mood_value'][i]),
+            'baseline': _nan_to_none(data['baseline'][i]),
+            'sleep_pressure': _nan_to_none(data['sleep_pressure'][i]),
+            'hrv_value': _nan_to_none(data['hrv_value'][i]),
+            'parameters': json.loads(data['parameters'][i] or '{}'),
+            'notes': data['notes'][i] or None,
+        })
+    return records
+
+
+def _nan_to_none(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def archive_old_records(db, older_than_days: int, archive: MoodArchive = None) -> Dict:
+    """
+    归档任务：把早于 older_than_days 天的心情记录写入冷存储并从 SQLite 删除
+
+    参数:
+        db: db_module.Database 实例（SQLite）
+        archive: 归档目标，默认使用 db.archive
+    返回: {'users': 涉及用户数, 'records': 实际写入归档的条数, 'freed_pages': 回收页数}
+    """
+    archive = archive or db.archive
+    if archive is None:
+        raise ValueError("未配置归档目录 (Database(archive_dir=...))")
+
+    cutoff_ms = int((time.time() - older_than_days * 86400) * 1000)
+    cutoff_dt = np.datetime64(cutoff_ms, 'ms').astype(object)
+
+    user_ids = db.list_user_ids()
+    summary = {'users': 0, 'records': 0, 'freed_pages': 0}
+
+    for user_id in user_ids:
+        # 仅取热数据：end 之前的部分在 get_mood_series 中也可能来自归档，这里直接读 SQLite
+        series = db.get_mood_series(
+            user_id, end=cutoff_dt,
+            columns=('timestamp', 'mood_value', 'baseline', 'sleep_pressure', 'hrv_value', 'parameters', 'notes'),
+            include_archive=False
+        )
+        if not len(series['timestamp']):
+            continue
+
+        data = {
+            'ts_epoch_ms': spread_duplicate_ms(series['timestamp'].astype('datetime64[ms]').astype(np.int64)),
+            'mood_value': series['mood_value'],
+            'baseline': series['baseline'],
+            'sleep_pressure': series['sleep_pressure'],
+            'hrv_value': series['hrv_value'],
+            'parameters': np.array([v or '' for v in series['parameters']], dtype=str),
+            'notes': np.array([v or '' for v in series['notes']], dtype=str),
+        }
+        # 先落盘归档，再删除热数据；中途失败最多造成重复而不会丢数据
+        archived = archive.append(user_id, data)
+        db.delete_mood_records_before(user_id, cutoff_dt)
+
+        summary['users'] += 1
+        summary['records'] += archived
+
+    if summary['records']:
+        summary['freed_pages'] = db.incremental_vacuum()
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_module import Database
+
+    parser = argparse.ArgumentParser(description="把旧心情记录归档到压缩列式分区")
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'bio_mood.db'))
+    parser.add_argument('--data-dir', default='mood_archive')
+    parser.add_argument('--older-than-days', type=int,
+                        default=int(os.environ.get('AUTO_CLEANUP_DAYS', 365)))
+    parser.add_argument('--format', choices=['parquet', 'npz'], default=None)
+    args = parser.parse_args()
+
+    database = Database(db_type="sqlite", db_path=args.db,
+                        archive_dir=args.data_dir, archive_format=args.format)
+    result = archive_old_records(database, args.older_than_days)
+    print(f"归档完成: {result['users']} 个用户, {result['records']} 条记录, 回收 {result['freed_pages']} 页")
+    database.close()
@@ -0,0 +1,617 @@
+"""
+MySQL / MariaDB 连接池后端
+
+为 Database(db_type="mysql") 提供与 sqlite3 连接相同的使用方式：
+  - 连接池: 队列式池，取出时对空闲过久的连接做 ping 健康检查，失效则重建
+  - 线程绑定: 同一线程在提交/回滚前的所有游标共用一个池连接（同一事务），
+    提交、回滚或该连接上的游标全部释放后归还连接池（未提交的事务回滚）
+  - 参数风格: SQL 中的 ? 占位符转换为 %s（字符串字面量中的 ? 不变，% 转义为 %%）
+  - 批量写入: executemany 的 INSERT/REPLACE ... VALUES 合并为多行 INSERT 分批执行
+  - 行映射: 结果行与 sqlite3.Row 一致，可按列名或下标访问、可解包；
+    时间列转换为 'YYYY-MM-DD HH:MM:SS' 文本，DECIMAL 转为 float
+
+连接池按连接配置在进程内共享：每个 Streamlit 会话各有一个 Database，但同一配置的
+所有 Database 共用一个池，进程内的 MySQL 连接总数不超过 pool_size。
+
+connect_factory 钩子用于替换真实的 pymysql 连接（例如指向本地 MariaDB 容器，
+或在测试中使用进程内的替身连接）。python mysql_backend.py 以 SQLite 替身连接
+自检参数风格转换与批量写入。
+"""
+
+import atexit
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 连接丢失类错误码: server has gone away / lost connection / 命令期间断开
+RECONNECT_ERRORS = (2006, 2013, 2055)
+
+# MySQL 建表语句（与 SQLite 表结构一一对应；索引随表创建，避免 CREATE INDEX IF NOT EXISTS 兼容问题）
+MYSQL_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        username VARCHAR(64) NOT NULL UNIQUE,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        password_hash CHAR(64) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP NULL,
+        is_active TINYINT(1) DEFAULT 1,
+        session_epoch INT NOT NULL DEFAULT 0,
+        preferences TEXT
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mood_records (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        mood_value DOUBLE NOT NULL,
+        baseline DOUBLE,
+        sleep_pressure DOUBLE,
+        hrv_value DOUBLE,
+        parameters TEXT,
+        notes TEXT,
+        INDEX idx_mood_user_time (user_id, timestamp DESC)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        event_type VARCHAR(64) NOT NULL,
+        event_description TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        amplitude DOUBLE,
+        duration DOUBLE,
+        ai_analysis TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_events_user_time (user_id, timestamp DESC)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_parameters (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL UNIQUE,
+        tau_r DOUBLE DEFAULT 17.0,
+        tau_d DOUBLE DEFAULT 5.5,
+        circadian_k DOUBLE DEFAULT 0.1,
+        circadian_amplitude DOUBLE DEFAULT 0.3,
+        k DOUBLE DEFAULT 12.0,
+        c DOUBLE DEFAULT 3.5,
+        m DOUBLE DEFAULT 1.0,
+        base_hrv DOUBLE DEFAULT 50.0,
+        phi DOUBLE DEFAULT 0.0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS wearable_samples (
+        user_id INT NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        ts_epoch_ms BIGINT NOT NULL,
+        value DOUBLE NOT NULL,
+        end_epoch_ms BIGINT,
+        source VARCHAR(64),
+        PRIMARY KEY (user_id, kind, ts_epoch_ms)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS engine_state (
+        user_id INT PRIMARY KEY,
+        sleep_pressure DOUBLE NOT NULL,
+        deviation DOUBLE NOT NULL,
+        velocity DOUBLE NOT NULL,
+        is_asleep TINYINT NOT NULL,
+        sim_time DOUBLE NOT NULL,
+        parameters TEXT NOT NULL,
+        anchor_real DOUBLE NOT NULL,
+        anchor_sim DOUBLE NOT NULL,
+        version INT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+)
+
+
+# ===== 参数风格转换 =====
+
+_TOKEN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|\?|%")
+
+
+@lru_cache(maxsize=512)
+def translate_sql(sql: str) -> str:
+    """
+    ? → %s；引号内的 ? 保持不变
+
+    驱动会对整条语句做 % 格式化，所以所有 %（包括字符串字面量中的）都转义为 %%。
+    """
+    def repl(match):
+        token = match.group(0)
+        if token == '?':
+            return '%s'
+        return token.replace('%', '%%')
+    return _TOKEN.sub(repl, sql)
+
+
+_INSERT_VALUES = re.compile(
+    r"^\s*((?:INSERT|REPLACE)\b.+?\bVALUES)\s*(\(.*\))\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+# ===== 行映射 =====
+
+@lru_cache(maxsize=256)
+def _row_class(columns: Tuple[str, ...]):
+    """按列名生成与 sqlite3.Row 行为一致的元组子类"""
+    index = {name: i for i, name in enumerate(columns)}
+
+    class Row(tuple):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                return tuple.__getitem__(self, index[key])
+            return tuple.__getitem__(self, key)
+
+        def keys(self):
+            return list(columns)
+
+    return Row
+
+
+def _convert(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+# ===== 连接池 =====
+
+class MySQLPool:
+    """
+    队列式连接池
+
+    参数:
+        connect_factory: 无参可调用对象，返回一个 DB-API 连接
+        size: 池中保留的最大连接数（同时借出数的上限）
+        ping_interval: 连接空闲超过该秒数后，借出前先 ping 检查
+        acquire_timeout: 池耗尽时等待的最长秒数
+    """
+
+    def __init__(self, connect_factory: Callable, size: int = 8,
+                 ping_interval: float = 30.0, acquire_timeout: float = 10.0):
+        self.connect_factory = connect_factory
+        self.size = size
+        self.ping_interval = ping_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reconnects = 0
+        self.closed = False
+
+    def acquire(self):
+        """借出一个健康的连接"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"MySQL 连接池已耗尽（{self.size} 个连接均在使用中）")
+        try:
+            while True:
+                try:
+                    raw, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if time.monotonic() - idle_since < self.ping_interval or self._ping(raw):
+                    return raw
+                self._discard(raw)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, raw, discard: bool = False):
+        """归还连接；discard=True 或池已关闭时直接关闭"""
+        try:
+            if discard or self.closed:
+                self._discard(raw)
+            else:
+                self._idle.put((raw, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def replace(self, raw):
+        """丢弃失效连接并新建一个（借出名额不变）"""
+        self._discard(raw)
+        with self._lock:
+            self.reconnects += 1
+        return self._create()
+
+    def _create(self):
+        raw = self.connect_factory()
+        with self._lock:
+            self.created += 1
+        return raw
+
+    def _ping(self, raw) -> bool:
+        try:
+            raw.ping(reconnect=True)
+            return True
+        except Exception as e:
+            logger.warning("MySQL 连接健康检查失败，重建连接: %s", e)
+            return False
+
+    @staticmethod
+    def _discard(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                raw, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(raw)
+
+    def stats(self) -> Dict:
+        return {'size': self.size, 'idle': self._idle.qsize(),
+                'created': self.created, 'reconnects': self.reconnects}
+
+
+class _Checkout:
+    """一次借出：一个池连接及其上仍存活的游标数"""
+
+    __slots__ = ('raw', 'refs', 'released', 'statements')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.refs = 0
+        self.released = False
+        self.statements = 0
+
+
+class MySQLConnection:
+    """
+    Database.conn 使用的连接门面（接口同 sqlite3.Connection 的常用部分）
+
+    cursor() 把当前线程绑定到一个池连接；commit() / rollback() 结束事务并归还连接。
+    """
+
+    def __init__(self, pool: MySQLPool, batch_rows: int = 500):
+        self.pool = pool
+        self.batch_rows = batch_rows
+        self._local = threading.local()
+
+    def _checkout(self) -> _Checkout:
+        checkout = getattr(self._local, 'checkout', None)
+        if checkout is None or checkout.released:
+            checkout = _Checkout(self.pool.acquire())
+            self._local.checkout = checkout
+        return checkout
+
+    def cursor(self) -> 'MySQLCursor':
+        return MySQLCursor(self, self._checkout())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def commit(self):
+        self._finish('commit')
+
+    def rollback(self):
+        self._finish('rollback')
+
+    def _finish(self, action: str, checkout: _Checkout = None):
+        checkout = checkout or getattr(self._local, 'checkout', None)
+        if checkout is None or checkout.released:
+            return
+        checkout.released = True
+        discard = False
+        try:
+            getattr(checkout.raw, action)()
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.pool.release(checkout.raw, discard=discard)
+
+    def _cursor_closed(self, checkout: _Checkout):
+        checkout.refs -= 1
+        if checkout.refs <= 0 and not checkout.released:
+            # 游标都已释放但未提交：回滚并归还，避免长时间持有事务快照
+            try:
+                self._finish('rollback', checkout)
+            except Exception as e:
+                logger.warning("归还 MySQL 连接时回滚失败: %s", e)
+
+    def close(self):
+        """结束当前线程未提交的事务并归还连接；连接池为进程共享，不随之关闭（见 close_pools）"""
+        self.rollback()
+
+
+class MySQLCursor:
+    """
+    池连接上的游标
+
+    属性 row_factory 为 None 时返回普通元组（与 sqlite3 游标一致），
+    否则返回可按列名访问的行。
+    """
+
+    def __init__(self, connection: MySQLConnection, checkout: _Checkout):
+        self.connection = connection
+        self.row_factory = True
+        self._checkout = checkout
+        self._raw = checkout.raw.cursor()
+        self._columns = None
+        self._closed = False
+        checkout.refs += 1
+
+    def __getattr__(self, name):
+        # rowcount / lastrowid / description 等
+        return getattr(self._raw, name)
+
+    def _ensure_checkout(self):
+        """提交后继续使用同一游标时，重新借出连接"""
+        if self._checkout.released:
+            self.connection._cursor_closed(self._checkout)
+            self._checkout = self.connection._checkout()
+            self._checkout.refs += 1
+            self._raw = self._checkout.raw.cursor()
+
+    def _run(self, method_name: str, sql: str, params):
+        self._ensure_checkout()
+        first = self._checkout.statements == 0
+        self._checkout.statements += 1
+        try:
+            getattr(self._raw, method_name)(sql, params)
+        except Exception as e:
+            code = e.args[0] if e.args else None
+            if not (first and code in RECONNECT_ERRORS):
+                raise
+            # 事务中的第一条语句遇到断线：换新连接重试一次
+            logger.warning("MySQL 连接已断开，重连后重试: %s", e)
+            self._checkout.raw = self.connection.pool.replace(self._checkout.raw)
+            self._raw = self._checkout.raw.cursor()
+            getattr(self._raw, method_name)(sql, params)
+        description = self._raw.description
+        self._columns = tuple(col[0] for col in description) if description else None
+
+    def execute(self, sql: str, params=()):
+        # 始终传参数元组，驱动才会把 %% 还原为 %
+        self._run('execute', translate_sql(sql), tuple(params or ()))
+        return self
+
+    def executemany(self, sql: str, seq_of_params):
+        """INSERT/REPLACE ... VALUES (...) 合并为多行语句，每 batch_rows 行执行一次"""
+        sql = translate_sql(sql)
+        match = _INSERT_VALUES.match(sql)
+        if match is None:
+            for params in seq_of_params:
+                self._run('execute', sql, tuple(params))
+            return self
+
+        head, row_sql = match.groups()
+        total = 0
+        batch: List = []
+        for params in seq_of_params:
+            batch.extend(params)
+            total += 1
+            if total % self.connection.batch_rows == 0:
+                self._run_batch(head, row_sql, batch, self.connection.batch_rows)
+                batch = []
+        if batch:
+            self._run_batch(head, row_sql, batch, total % self.connection.batch_rows)
+        return self
+
+    def _run_batch(self, head: str, row_sql: str, flat_params: List, n_rows: int):
+        self._run('execute', f"{head} {', '.join([row_sql] * n_rows)}", tuple(flat_params))
+
+    def _map(self, row):
+        if row is None:
+            return None
+        values = tuple(_convert(v) for v in row)
+        if self.row_factory is None or self._columns is None:
+            return values
+        return _row_class(self._columns)(values)
+
+    def fetchone(self):
+        return self._map(self._raw.fetchone())
+
+    def fetchall(self):
+        return [self._map(row) for row in self._raw.fetchall()]
+
+    def fetchmany(self, size: int = None):
+        rows = self._raw.fetchmany(size) if size is not None else self._raw.fetchmany()
+        return [self._map(row) for row in rows]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._raw.close()
+        except Exception:
+            pass
+        self.connection._cursor_closed(self._checkout)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# ===== 构造 =====
+
+def pymysql_factory(mysql_config: Dict) -> Callable:
+    """由配置字典生成 pymysql 连接工厂（会话时区固定为 UTC，与 SQLite 的 CURRENT_TIMESTAMP 一致）"""
+    try:
+        import pymysql
+    except ImportError:
+        raise ImportError("MySQL支持需要: pip install pymysql")
+
+    def connect():
+        return pymysql.connect(
+            host=mysql_config['host'],
+            port=int(mysql_config.get('port', 3306)),
+            user=mysql_config['user'],
+            password=mysql_config['password'],
+            database=mysql_config['database'],
+            charset='utf8mb4',
+            connect_timeout=int(mysql_config.get('connect_timeout', 10)),
+            init_command="SET time_zone='+00:00'",
+        )
+    return connect
+
+
+# 进程内共享的连接池: 配置键 → MySQLPool
+_pools: Dict[Tuple, MySQLPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(mysql_config: Dict, connect_factory: Optional[Callable]) -> Tuple:
+    return (tuple(sorted((k, v) for k, v in mysql_config.items() if k != 'connect_factory')),
+            connect_factory or mysql_config.get('connect_factory'))
+
+
+def shared_pool(mysql_config: Dict, connect_factory: Optional[Callable] = None) -> MySQLPool:
+    """取得（必要时创建）该连接配置在本进程内共享的连接池"""
+    key = _pool_key(mysql_config, connect_factory)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            factory = connect_factory or mysql_config.get('connect_factory') or pymysql_factory(mysql_config)
+            pool = _pools[key] = MySQLPool(
+                factory,
+                size=int(mysql_config.get('pool_size', 8)),
+                ping_interval=float(mysql_config.get('ping_interval', 30.0)),
+            )
+        return pool
+
+
+@atexit.register
+def close_pools():
+    """关闭本进程内的全部连接池（进程退出时自动调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def connect(mysql_config: Dict, connect_factory: Optional[Callable] = None) -> MySQLConnection:
+    """
+    返回使用进程共享连接池的连接门面
+
+    mysql_config 除连接参数外还可包含:
+        pool_size (默认 8), ping_interval (秒, 默认 30), batch_rows (默认 500),
+        connect_factory (返回 DB-API 连接的可调用对象，替代默认的 pymysql 工厂)
+    配置相同（含 connect_factory）的调用共用同一个池，池参数以首次创建时为准。
+    """
+    pool = shared_pool(mysql_config, connect_factory)
+    return MySQLConnection(pool, batch_rows=int(mysql_config.get('batch_rows', 500)))
+
+
+# ===== 自检（SQLite 替身连接） =====
+
+class _SQLiteShimCursor:
+    """把驱动风格的 %s / %% 还原为 sqlite3 的 ? / %，并记录执行的语句"""
+
+    def __init__(self, shim: '_SQLiteShim'):
+        self._shim = shim
+        self._raw = shim.conn.cursor()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def execute(self, sql: str, params=()):
+        self._shim.statements.append(sql)
+        self._raw.execute(sql.replace('%s', '?').replace('%%', '%'), params)
+
+
+class _SQLiteShim:
+    """DB-API 替身连接：共享内存 SQLite 库，供 connect_factory 使用"""
+
+    def __init__(self, uri: str, statements: List[str]):
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.statements = statements
+
+    def cursor(self):
+        return _SQLiteShimCursor(self)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def ping(self, reconnect=True):
+        self.conn.execute("SELECT 1")
+
+    def close(self):
+        self.conn.close()
+
+
+def self_check(batch_rows: int = 3, rows: int = 7) -> Dict:
+    """
+    以 SQLite 替身连接走一遍连接门面：参数风格转换、executemany 分批合并、
+    行映射与连接池共享。失败时抛出 AssertionError，成功返回统计。
+    """
+    assert translate_sql("SELECT '?', a FROM t WHERE b=? AND c LIKE '%x'") == \
+        "SELECT '?', a FROM t WHERE b=%s AND c LIKE '%%x'"
+
+    uri = f"file:mysql_backend_check_{id(object())}?mode=memory&cache=shared"
+    statements: List[str] = []
+    anchor = sqlite3.connect(uri, uri=True)  # 保持共享内存库存活
+    try:
+        config = {'database': uri, 'pool_size': 2, 'batch_rows': batch_rows,
+                  'connect_factory': lambda: _SQLiteShim(uri, statements)}
+        conn = connect(config)
+        assert connect(config).pool is conn.pool, "相同配置应共用连接池"
+
+        # 与 Database 相同：提交前保持游标存活（游标全部释放时未提交的事务会被回滚）
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, note TEXT)")
+        conn.commit()
+        del statements[:]
+        values = [(i, f"{i}% ? 'q'") for i in range(rows)]
+        cursor.executemany("INSERT INTO t (id, note) VALUES (?, ?)", values)
+        conn.commit()
+        batches = len(statements)
+        expected_batches = -(-rows // batch_rows)
+        assert batches == expected_batches, f"应分 {expected_batches} 批执行，实际 {batches}"
+
+        cursor.execute("SELECT id, note FROM t WHERE note LIKE '%?%' ORDER BY id")
+        fetched = cursor.fetchall()
+        conn.commit()
+        assert [(row['id'], row['note']) for row in fetched] == values
+        return {'batches': batches, 'rows': len(fetched), **conn.pool.stats()}
+    finally:
+        close_pools()
+        anchor.close()
+
+
+if __name__ == "__main__":
+    result = self_check()
+    print(f"自检通过: {result['rows']} 行分 {result['batches']} 批写入，"
+          f"连接池创建 {result['created']} 个连接")
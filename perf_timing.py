@@ -0,0 +1,281 @@
+"""
+热点路径计时
+会话变慢时定位耗时来自哪里：引擎步进、图表构建还是 AI 调用（数据库语句见 query_stats）。
+  - 计时点: timer(name) 上下文管理器 / timed(name) 装饰器，记录一次耗时（毫秒）
+  - 滚动分位数: 每个计时点保留最近 window 个样本（环形缓冲区），按样本计算 p50/p90/p99；
+    次数、总耗时、最大值为累计值
+  - 进程级与会话级: 进程内共享 perf_timings；bind_session() 把当前线程（一次 Streamlit 重跑）
+    的记录同时计入该会话自己的 PerfTimings
+  - 采样剖析（可选，默认关闭）: profiler 后台线程定时读取正处于计时区间内的线程的调用栈，
+    统计各函数的自身 / 累计采样次数
+  - 导出: dump_jsonl() 把窗口内的原始样本按时间顺序导出为 JSON Lines；
+    进程级统计由 metrics 在导出时读取（register_timings）
+
+环境变量:
+    PERF_TIMING: 设为 0 关闭计时（默认开启）
+    PERF_WINDOW: 每个计时点保留的样本数（默认 512）
+    PERF_PROFILE_INTERVAL_MS: 采样剖析间隔（毫秒，默认 5）
+"""
+
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from metrics import register_timings
+from ring_buffer import RingBuffer
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+
+class TimingWindow:
+    """单个计时点：累计统计 + 最近样本（ts, ms）"""
+
+    __slots__ = ('name', 'count', 'total_ms', 'max_ms', 'samples')
+
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = RingBuffer(window, fields=('ts', 'ms'))
+
+    def observe(self, ts: float, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.samples.append(ts, elapsed_ms)
+
+    def to_dict(self) -> Dict:
+        recent = self.samples.view('ms')
+        row = {
+            'name': self.name,
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+        }
+        values = np.percentile(recent, PERCENTILES) if len(recent) else [0.0] * len(PERCENTILES)
+        for q, value in zip(PERCENTILES, values):
+            row[f'p{q}_ms'] = round(float(value), 3)
+        row['max_ms'] = round(self.max_ms, 3)
+        row['last_ms'] = round(float(recent[-1]), 3) if len(recent) else 0.0
+        row['window'] = len(recent)
+        return row
+
+
+class PerfTimings:
+    """
+    计时统计（线程安全）
+
+    参数:
+        window: 每个计时点保留的样本数（None 时读取 PERF_WINDOW）
+        enabled: 是否计时（None 时读取 PERF_TIMING）
+    """
+
+    def __init__(self, window: int = None, enabled: bool = None):
+        if window is None:
+            window = int(os.environ.get("PERF_WINDOW", "512"))
+        if enabled is None:
+            enabled = os.environ.get("PERF_TIMING", "1") != "0"
+        self.window = window
+        self.enabled = enabled
+        self._windows: Dict[str, TimingWindow] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # 正处于计时区间内的线程 → 嵌套深度，供采样剖析只采这些线程
+        self._active: Dict[int, int] = {}
+
+    def bind_session(self, timings: Optional['PerfTimings']):
+        """当前线程之后的记录同时计入会话级统计（None 解除绑定）"""
+        self._local.session = timings
+
+    def record(self, name: str, elapsed_ms: float, ts: float = None):
+        """记录一次耗时"""
+        if not self.enabled:
+            return
+        ts = ts or time.time()
+        with self._lock:
+            entry = self._windows.get(name)
+            if entry is None:
+                entry = self._windows[name] = TimingWindow(name, self.window)
+            entry.observe(ts, elapsed_ms)
+        session = getattr(self._local, 'session', None)
+        if session is not None and session is not self:
+            session.record(name, elapsed_ms, ts)
+
+    @contextmanager
+    def timer(self, name: str):
+        """计时区间（异常同样计入）"""
+        if not self.enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        self._active[ident] = self._active.get(ident, 0) + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+            depth = self._active.get(ident, 1) - 1
+            if depth:
+                self._active[ident] = depth
+            else:
+                self._active.pop(ident, None)
+
+    def timed(self, name: str):
+        """计时装饰器"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def active_threads(self) -> List[int]:
+        return list(self._active)
+
+    def snapshot(self) -> List[Dict]:
+        """按总耗时降序返回各计时点统计"""
+        with self._lock:
+            rows = [entry.to_dict() for entry in self._windows.values()]
+        rows.sort(key=lambda r: r['total_ms'], reverse=True)
+        return rows
+
+    def dump_jsonl(self, path: str = None) -> str:
+        """窗口内的原始样本按时间顺序导出为 JSON Lines，指定 path 时同时写入文件"""
+        with self._lock:
+            samples = [(float(ts), name, float(ms))
+                       for name, entry in self._windows.items()
+                       for ts, ms in zip(entry.samples.view('ts'), entry.samples.view('ms'))]
+        samples.sort()
+        payload = ''.join(json.dumps({'ts': ts, 'name': name, 'ms': round(ms, 3)}, ensure_ascii=False) + '\n'
+                          for ts, name, ms in samples)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+        return payload
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+
+
+# 进程内共享的计时统计
+perf_timings = PerfTimings()
+register_timings(perf_timings)
+timer = perf_timings.timer
+timed = perf_timings.timed
+
+
+class SamplingProfiler:
+    """
+    采样剖析器
+
+    后台线程每 interval_ms 读取一次 sys._current_frames()，只采正处于计时区间内的线程，
+    统计每个函数出现在栈顶（自身）和栈中（累计）的采样次数。开启后才有额外开销。
+
+    参数:
+        timings: 用于判断哪些线程在计时区间内的 PerfTimings
+        interval_ms: 采样间隔（None 时读取 PERF_PROFILE_INTERVAL_MS）
+        max_depth: 每次采样最多回溯的栈帧数
+    """
+
+    def __init__(self, timings: PerfTimings, interval_ms: float = None, max_depth: int = 64):
+        if interval_ms is None:
+            interval_ms = float(os.environ.get("PERF_PROFILE_INTERVAL_MS", "5"))
+        self.timings = timings
+        self.interval_ms = interval_ms
+        self.max_depth = max_depth
+        self.samples = 0
+        self._self_counts: Dict[tuple, int] = {}
+        self._total_counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="perf-profiler", daemon=True)
+        self._thread.start()
+        logger.info("采样剖析已开启（间隔 %.1f ms）", self.interval_ms)
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        logger.info("采样剖析已关闭（共 %d 次采样）", self.samples)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_ms / 1000.0):
+            active = set(self.timings.active_threads())
+            active.discard(own)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in active:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._sample(frame)
+
+    def _sample(self, frame):
+        self.samples += 1
+        top = True
+        seen = set()
+        depth = 0
+        while frame is not None and depth < self.max_depth:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            if top:
+                self._self_counts[key] = self._self_counts.get(key, 0) + 1
+                top = False
+            if key not in seen:
+                seen.add(key)
+                self._total_counts[key] = self._total_counts.get(key, 0) + 1
+            frame = frame.f_back
+            depth += 1
+
+    def report(self, top: int = 25) -> List[Dict]:
+        """按自身采样次数降序返回最热的函数"""
+        with self._lock:
+            total = self.samples or 1
+            rows = [{
+                'function': name,
+                'file': os.path.basename(filename),
+                'line': line,
+                'self': self._self_counts.get(key, 0),
+                'total': count,
+                'self_pct': round(100.0 * self._self_counts.get(key, 0) / total, 1),
+                'total_pct': round(100.0 * count / total, 1),
+            } for key, count in self._total_counts.items() for name, filename, line in (key,)]
+        rows.sort(key=lambda r: (r['self'], r['total']), reverse=True)
+        return rows[:top]
+
+    def reset(self):
+        with self._lock:
+            self.samples = 0
+            self._self_counts.clear()
+            self._total_counts.clear()
+
+
+# 进程内共享的采样剖析器（默认关闭，由管理面板开启）
+profiler = SamplingProfiler(perf_timings)
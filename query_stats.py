@@ -0,0 +1,309 @@
+"""
+查询统计模块
+包装数据库游标，按语句统计执行次数、延迟直方图、返回/影响行数与错误数；
+超过阈值的慢查询连同 EXPLAIN QUERY PLAN 一起写入日志。
+
+Database 通过 _cursor() 取得 InstrumentedCursor，业务代码无需改动调用方式。
+统计数据进程内共享（query_stats），可在管理面板查看或导出为 JSON；
+metrics 导出时按方法读取 by_tag()（register_query_stats），执行语句时不另行计时。
+
+环境变量:
+    SLOW_QUERY_MS: 慢查询阈值（毫秒，默认 100）
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from metrics import register_query_stats
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图桶上界 (ms)，最后一个桶为 +inf
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    """压缩空白，作为统计的语句键"""
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class StatementStats:
+    """单条语句的累计统计"""
+
+    __slots__ = ('sql', 'tags', 'count', 'errors', 'rows', 'total_ms', 'max_ms', 'buckets', 'plan')
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tags = set()
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.plan = None
+
+    def observe(self, elapsed_ms: float, rows: int):
+        self.count += 1
+        self.rows += max(rows, 0)
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, q: float) -> float:
+        """由直方图估计分位数（取所在桶的上界）"""
+        if self.count == 0:
+            return 0.0
+        target = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets[:-1]):
+            seen += n
+            if seen >= target:
+                return float(LATENCY_BUCKETS_MS[i])
+        return self.max_ms
+
+    def to_dict(self) -> Dict:
+        return {
+            'sql': self.sql,
+            'tags': sorted(self.tags),
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ['+inf'], self.buckets)),
+            'plan': self.plan,
+        }
+
+
+class QueryStats:
+    """进程内查询统计（线程安全）"""
+
+    def __init__(self, slow_ms: float = None):
+        if slow_ms is None:
+            slow_ms = float(os.environ.get("SLOW_QUERY_MS", "100"))
+        self.slow_ms = slow_ms
+        self.enabled = True
+        self._stats: Dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, sql: str) -> StatementStats:
+        entry = self._stats.get(sql)
+        if entry is None:
+            entry = self._stats[sql] = StatementStats(sql)
+        return entry
+
+    def record(self, sql: str, elapsed_ms: float, rows: int, tag: str = None) -> bool:
+        """记录一次执行，返回是否为慢查询且尚未取得执行计划"""
+        with self._lock:
+            entry = self._entry(sql)
+            entry.observe(elapsed_ms, rows)
+            if tag:
+                entry.tags.add(tag)
+            return elapsed_ms >= self.slow_ms and entry.plan is None
+
+    def record_error(self, sql: str, tag: str = None):
+        with self._lock:
+            entry = self._entry(sql)
+            entry.errors += 1
+            if tag:
+                entry.tags.add(tag)
+
+    def set_plan(self, sql: str, plan: List[str]):
+        with self._lock:
+            self._entry(sql).plan = plan
+
+    def get_plan(self, sql: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._stats.get(sql)
+            return entry.plan if entry else None
+
+    def snapshot(self) -> List[Dict]:
+        """按总耗时降序返回各语句统计"""
+        with self._lock:
+            rows = [entry.to_dict() for entry in self._stats.values()]
+        rows.sort(key=lambda r: r['total_ms'], reverse=True)
+        return rows
+
+    def by_tag(self) -> List[Dict]:
+        """按调用方法汇总（get_mood_history、login_user_simple 等）"""
+        totals: Dict[str, Dict] = {}
+        for row in self.snapshot():
+            for tag in row['tags'] or ['(untagged)']:
+                agg = totals.setdefault(tag, {'tag': tag, 'count': 0, 'rows': 0, 'errors': 0, 'total_ms': 0.0})
+                agg['count'] += row['count']
+                agg['rows'] += row['rows']
+                agg['errors'] += row['errors']
+                agg['total_ms'] = round(agg['total_ms'] + row['total_ms'], 3)
+        return sorted(totals.values(), key=lambda r: r['total_ms'], reverse=True)
+
+    def dump_json(self, path: str = None) -> str:
+        """导出为 JSON 字符串，指定 path 时同时写入文件"""
+        payload = json.dumps({
+            'generated_at': time.time(),
+            'slow_ms': self.slow_ms,
+            'by_tag': self.by_tag(),
+            'statements': self.snapshot(),
+        }, ensure_ascii=False, indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+        return payload
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+# 进程内共享的统计实例
+query_stats = QueryStats()
+register_query_stats(query_stats)
+
+
+class InstrumentedCursor:
+    """
+    计时游标包装
+
+    一次“执行”的耗时 = execute 本身 + 随后读取结果（fetch*/迭代）的时间；
+    读取完成、下一次 execute 或 close 时把这次执行计入统计。
+    未定义的属性（lastrowid、rowcount、description 等）透传给原游标。
+    """
+
+    def __init__(self, cursor, stats: QueryStats, conn=None, db_type: str = "sqlite", tag: str = None):
+        self._cursor = cursor
+        self._stats = stats
+        self._conn = conn
+        self._db_type = db_type
+        self._tag = tag
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # row_factory 等游标属性直接设置到原游标上
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def _run(self, method, sql, args):
+        self._flush()
+        if not self._stats.enabled:
+            method(sql, *args)
+            return self
+        key = normalize_sql(sql)
+        start = time.perf_counter()
+        try:
+            method(sql, *args)
+        except Exception:
+            self._stats.record_error(key, self._tag)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if self._cursor.description is None:
+            # 写语句：无结果集，立即计入
+            self._finish(key, args, elapsed_ms, self._cursor.rowcount)
+        else:
+            self._pending = [key, args, elapsed_ms, 0]
+        return self
+
+    def execute(self, sql, *args):
+        return self._run(self._cursor.execute, sql, args)
+
+    def executemany(self, sql, seq_of_params):
+        # 参数序列可能是生成器，不保留用于 EXPLAIN
+        return self._run(self._cursor.executemany, sql, (seq_of_params,))
+
+    def _timed_fetch(self, method, *args):
+        if self._pending is None:
+            return method(*args)
+        start = time.perf_counter()
+        result = method(*args)
+        self._pending[2] += (time.perf_counter() - start) * 1000
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(self._cursor.fetchone)
+        if self._pending is not None:
+            self._pending[3] += row is not None
+            self._flush()
+        return row
+
+    def fetchall(self):
+        rows = self._timed_fetch(self._cursor.fetchall)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            self._flush()
+        return rows
+
+    def fetchmany(self, size=None):
+        rows = self._timed_fetch(self._cursor.fetchmany, *(() if size is None else (size,)))
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            if not rows:
+                self._flush()
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(256)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
+
+    def _flush(self):
+        if self._pending is not None:
+            key, args, elapsed_ms, rows = self._pending
+            self._pending = None
+            self._finish(key, args, elapsed_ms, rows)
+
+    def _finish(self, key, args, elapsed_ms, rows):
+        rows = max(rows, 0)
+        needs_plan = self._stats.record(key, elapsed_ms, rows, self._tag)
+        if elapsed_ms < self._stats.slow_ms:
+            return
+        if needs_plan:
+            self._stats.set_plan(key, self._explain(key, args))
+        logger.warning("慢查询 %.1f ms (%d 行) [%s]: %s | 计划: %s",
+                       elapsed_ms, rows, self._tag or '-', key,
+                       '; '.join(self._stats.get_plan(key) or []))
+
+    def _explain(self, sql: str, args) -> List[str]:
+        """在独立游标上获取执行计划；失败时返回错误说明而不影响业务"""
+        if self._conn is None:
+            return []
+        params = args[0] if args and isinstance(args[0], (tuple, list, dict)) else ()
+        if isinstance(params, list) and params and isinstance(params[0], (tuple, list, dict)):
+            # executemany 的参数列表：用第一组参数生成计划
+            params = params[0]
+        try:
+            cursor = self._conn.cursor()
+            if self._db_type == "sqlite":
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = [str(row[-1]) for row in cursor.fetchall()]
+            else:
+                cursor.execute(f"EXPLAIN {sql}", params)
+                plan = [json.dumps(row if isinstance(row, dict) else list(row), ensure_ascii=False, default=str)
+                        for row in cursor.fetchall()]
+            cursor.close()
+            return plan
+        except Exception as e:
+            return [f"EXPLAIN 失败: {e}"]
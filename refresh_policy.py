@@ -0,0 +1,89 @@
+"""
+自适应刷新策略
+固定 1 秒刷新在曲线平坦（睡眠中、x≈0）或标签页在后台时白白消耗服务端 CPU。
+按模型当前的变化速率选择下一次刷新间隔:
+  - 变化速率: |v| + circadian_k * |dS/dt| + |dC/dt|（心情值每模拟小时的变化上界），
+    换算为每真实秒的变化
+  - 可见分辨率: 心情变化达到 resolution（约一个像素）所需的时间即为刷新间隔，
+    限制在 [min_interval, max_interval]
+  - 事件后回到最快刷新: notify_event() 之后 burst_seconds 内使用 min_interval
+  - 后台标签页: 使用 hidden_interval（由浏览器端 refresh_timer 组件按可见性选择）
+
+环境变量:
+    REFRESH_MIN_INTERVAL: 最快刷新间隔（秒，默认 0.5）
+    REFRESH_MAX_INTERVAL: 可见时最慢刷新间隔（秒，默认 10）
+    REFRESH_HIDDEN_INTERVAL: 标签页隐藏时的刷新间隔（秒，默认 60）
+"""
+
+import os
+import time
+
+
+def mood_rate(engine, t: float) -> float:
+    """心情值变化速率的上界（每模拟小时）"""
+    dS, _, _ = engine.derivatives(t, engine.state)
+    _, _, v = engine.state
+    h = 1e-3
+    dC = (engine.circadian_process(t + h) - engine.circadian_process(t - h)) / (2 * h)
+    K = engine.params.get('circadian_k', 0.1)
+    return abs(v) + K * abs(dS) + abs(dC)
+
+
+class RefreshPolicy:
+    """
+    刷新间隔选择器（每个会话一个）
+
+    参数:
+        min_interval: 最快刷新间隔（秒）
+        max_interval: 可见时最慢刷新间隔（秒）
+        hidden_interval: 标签页隐藏时的刷新间隔（秒）
+        resolution: 用户可见的最小心情变化（默认 0.005，约为 420 像素高的图表上的一个像素）
+        burst_seconds: 事件后保持最快刷新的时长（秒）
+    """
+
+    def __init__(self, min_interval: float = None, max_interval: float = None,
+                 hidden_interval: float = None, resolution: float = 0.005,
+                 burst_seconds: float = 5.0):
+        if min_interval is None:
+            min_interval = float(os.environ.get("REFRESH_MIN_INTERVAL", "0.5"))
+        if max_interval is None:
+            max_interval = float(os.environ.get("REFRESH_MAX_INTERVAL", "10"))
+        if hidden_interval is None:
+            hidden_interval = float(os.environ.get("REFRESH_HIDDEN_INTERVAL", "60"))
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.hidden_interval = max(hidden_interval, self.max_interval)
+        self.resolution = resolution
+        self.burst_seconds = burst_seconds
+        self.burst_until = 0.0
+        # 最近一次选择的间隔和原因，供指标面板显示
+        self.interval = min_interval
+        self.reason = '启动'
+
+    def notify_event(self, now: float = None):
+        """施加事件后调用：接下来 burst_seconds 内以最快速度刷新"""
+        self.burst_until = (now or time.time()) + self.burst_seconds
+
+    def next_interval(self, engine, sim_time: float, time_scale: float, now: float = None) -> float:
+        """
+        下一次刷新的间隔（秒，标签页可见时）
+
+        参数:
+            engine: BioEngine
+            sim_time: 当前模拟时间（小时）
+            time_scale: 1 秒真实时间对应的模拟秒数
+        """
+        now = now or time.time()
+        if now < self.burst_until:
+            self.interval, self.reason = self.min_interval, '事件后'
+            return self.interval
+        # 每真实秒的心情变化
+        rate = mood_rate(engine, sim_time) * time_scale / 3600.0
+        interval = self.resolution / rate if rate > 0 else self.max_interval
+        if interval <= self.min_interval:
+            self.interval, self.reason = self.min_interval, '快速变化'
+        elif interval >= self.max_interval:
+            self.interval, self.reason = self.max_interval, '平稳'
+        else:
+            self.interval, self.reason = interval, '跟随变化速率'
+        return self.interval
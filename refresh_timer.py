@@ -0,0 +1,25 @@
+"""
+浏览器端刷新计时器组件
+放在 st.fragment 中：计时器到期时组件返回值变化，只重跑所在的片段。
+间隔由服务端每次渲染时下发（见 refresh_policy），浏览器按标签页可见性选择:
+  - 可见: interval
+  - 隐藏: hidden_interval（后台退避）
+  - 从隐藏切回可见: 立即触发一次，然后恢复 interval
+"""
+
+import os
+
+import streamlit.components.v1 as components
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "refresh_timer_frontend")
+_component = components.declare_component("refresh_timer", path=_FRONTEND_DIR)
+
+
+def refresh_timer(key: str, interval: float, hidden_interval: float):
+    """
+    在 interval 秒（标签页隐藏时 hidden_interval 秒）后重跑所在的片段
+
+    返回: 浏览器上一次触发时上报的 {'tick': 次数, 'hidden': 标签页是否隐藏}，首次渲染为 None
+    """
+    return _component(key=key, default=None,
+                      interval_ms=int(interval * 1000), hidden_interval_ms=int(hidden_interval * 1000))
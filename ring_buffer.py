@@ -0,0 +1,147 @@
+"""
+环形缓冲区
+固定容量、NumPy 存储的曲线历史，取代 list.append + list.pop(0)：
+  - 追加 O(1): 每个点（一行）同时写入第 pos 和 pos + capacity 行（镜像双倍存储，
+    一次步长切片赋值完成），任意时刻最近 n 个点在底层数组中都是连续的一段
+  - 有序视图零拷贝: view()/window()/since() 返回底层数组的切片视图，可直接用于绘图和导出
+  - 绝对计数: total 为累计追加过的点数，增量图表据此只取新增的点
+  - 溢出回调（可选）: 尚未交给回调的点即将被覆盖时，按批调用 on_spill(columns)，
+    columns 为 {字段: 数组}，可用于把完整分辨率的历史写入数据库
+
+视图在下一次 append 之前有效（之后可能被覆盖），需要保留时请 copy()。
+"""
+
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_FIELDS = ('time', 'mood', 'baseline', 'S', 'x')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_seconds(value: datetime) -> float:
+    """不带时区的 datetime → 秒（按原样的墙上时间，不做时区换算）"""
+    return (value - _EPOCH).total_seconds()
+
+
+def seconds_to_datetime64(values: np.ndarray) -> np.ndarray:
+    """datetime_to_seconds 的逆变换（数组），用于绘图"""
+    return (np.asarray(values) * 1e6).astype('datetime64[us]')
+
+
+class RingBuffer:
+    """
+    固定容量的多字段环形缓冲区
+
+    参数:
+        capacity: 容量（点数）
+        fields: 字段名，每个字段一列 float64
+        on_spill: 溢出回调 on_spill({字段: 数组})，None 表示直接覆盖
+        spill_batch: 每次交给回调的点数（不超过容量）
+    """
+
+    def __init__(self, capacity: int, fields: Sequence[str] = DEFAULT_FIELDS,
+                 on_spill: Optional[Callable[[Dict[str, np.ndarray]], None]] = None,
+                 spill_batch: int = 64):
+        if capacity <= 0:
+            raise ValueError("容量必须为正数")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._index = {name: i for i, name in enumerate(self.fields)}
+        self._data = np.zeros((2 * capacity, len(self.fields)), dtype=float)
+        self.total = 0
+        self.on_spill = on_spill
+        self.spill_batch = max(1, min(spill_batch, capacity))
+        # 已交给溢出回调的点数（绝对计数）
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    @property
+    def nbytes(self) -> int:
+        """预分配存储占用的字节数（镜像双倍存储）"""
+        return self._data.nbytes
+
+    @property
+    def start(self) -> int:
+        """窗口中最早一个点的绝对序号"""
+        return self.total - len(self)
+
+    def append(self, *values, **named):
+        """追加一个点（按字段顺序的位置参数，或字段名关键字参数）"""
+        if self.on_spill is not None and self.total - self.spilled >= self.capacity:
+            self._spill(self.spill_batch)
+        if named:
+            values = tuple(named.get(name, np.nan) for name in self.fields)
+        pos = self.total % self.capacity
+        self._data[pos:pos + self.capacity + 1:self.capacity] = values
+        self.total += 1
+
+    def _spill(self, count: int):
+        count = min(count, self.total - self.spilled)
+        if count > 0:
+            self.on_spill(self._columns(self.spilled, self.spilled + count))
+            self.spilled += count
+
+    def flush(self):
+        """把尚未交给溢出回调的点全部交出（例如换出或会话结束时）"""
+        if self.on_spill is not None:
+            self._spill(self.total - max(self.spilled, self.start))
+
+    def _slice(self, begin: int, end: int) -> slice:
+        """绝对序号 [begin, end) 在底层数组中的连续切片（要求在窗口内）"""
+        offset = begin % self.capacity
+        return slice(offset, offset + (end - begin))
+
+    def _columns(self, begin: int, end: int) -> Dict[str, np.ndarray]:
+        cols = self._slice(begin, end)
+        return {name: self._data[cols, i] for i, name in enumerate(self.fields)}
+
+    def view(self, field: str, last: int = None) -> np.ndarray:
+        """某字段按时间顺序的零拷贝视图（last 为只取最近的点数）"""
+        n = len(self) if last is None else min(last, len(self))
+        return self._data[self._slice(self.total - n, self.total), self._index[field]]
+
+    def window(self, last: int = None) -> Dict[str, np.ndarray]:
+        """全部字段按时间顺序的零拷贝视图"""
+        n = len(self) if last is None else min(last, len(self))
+        return self._columns(self.total - n, self.total)
+
+    def since(self, index: int) -> Tuple[int, Dict[str, np.ndarray]]:
+        """
+        绝对序号 index 之后的点
+
+        返回: (首个返回点的绝对序号, {字段: 视图})；index 早于窗口起点时从窗口起点返回
+        """
+        begin = min(max(index, self.start), self.total)
+        return begin, self._columns(begin, self.total)
+
+    def clear(self):
+        self.total = 0
+        self.spilled = 0
+
+    def to_dict(self) -> Dict[str, list]:
+        """按时间顺序导出为 {字段: 列表}（用于 JSON / DataFrame）"""
+        return {name: values.tolist() for name, values in self.window().items()}
+
+    @classmethod
+    def from_columns(cls, capacity: int, columns: Dict[str, Sequence], fields: Sequence[str] = None,
+                     **kwargs) -> 'RingBuffer':
+        """由 {字段: 序列} 构造（超出容量时只保留最近的点）"""
+        fields = tuple(fields or columns.keys())
+        buffer = cls(capacity, fields, **kwargs)
+        length = min((len(columns.get(name, ())) for name in fields if name in columns), default=0)
+        n = min(length, capacity)
+        if n:
+            block = np.full((n, len(fields)), np.nan)
+            for i, name in enumerate(fields):
+                if name in columns:
+                    block[:, i] = np.asarray(columns[name][length - n:], dtype=float)
+            buffer._data[:n] = block
+            buffer._data[capacity:capacity + n] = block
+            buffer.total = n
+            buffer.spilled = n
+        return buffer
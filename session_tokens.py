@@ -0,0 +1,94 @@
+"""
+会话令牌模块
+签发与校验带过期时间的 HMAC-SHA256 会话令牌，用于新标签页/断线重连时
+直接恢复登录状态，无需重新哈希密码。
+
+令牌格式: base64url(JSON 载荷) + "." + base64url(签名)
+载荷: {"u": 用户ID, "n": 用户名, "s": 会话纪元, "e": 过期时间(epoch 秒)}
+
+登出: 签名本身无法撤销，作废靠 users.session_epoch —— 登出时递增该列
+(Database.revoke_sessions)，恢复会话时与令牌中的纪元比较 (Database.get_session_epoch)，
+所有进程、重启之后都同样生效。登出会作废该用户在所有设备上的令牌。
+
+注意: 令牌放在 URL 查询参数 (?session=...) 中，会随分享的链接、浏览器历史、
+书签和反向代理访问日志泄露；持有链接的人在令牌过期或用户登出之前都能以该用户身份登录。
+
+环境变量:
+    SESSION_SECRET: 签名密钥。未设置时每个进程随机生成，重启后旧令牌失效
+    SESSION_TTL_HOURS: 令牌有效期（小时，默认 168 即 7 天）
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_HOURS = 168
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class SessionTokenSigner:
+    """会话令牌签发与校验（纯内存操作；纪元由调用方与数据库比较）"""
+
+    def __init__(self, secret: bytes = None, ttl_seconds: float = None):
+        if secret is None:
+            env_secret = os.environ.get("SESSION_SECRET")
+            if env_secret:
+                secret = env_secret.encode()
+            else:
+                logger.warning("未设置 SESSION_SECRET，使用进程内随机密钥（重启后会话令牌失效）")
+                secret = secrets.token_bytes(32)
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("SESSION_TTL_HOURS", DEFAULT_TTL_HOURS)) * 3600
+        self._secret = secret
+        self.ttl_seconds = ttl_seconds
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, user_id: int, username: str, epoch: int = 0) -> str:
+        """签发令牌（epoch 为签发时账户的会话纪元）"""
+        body = json.dumps({'u': user_id, 'n': username, 's': epoch,
+                           'e': int(time.time() + self.ttl_seconds)},
+                          separators=(',', ':'), ensure_ascii=False)
+        payload = _b64encode(body.encode('utf-8'))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[Tuple[int, str, int]]:
+        """校验签名与有效期，有效时返回 (user_id, username, 会话纪元)，否则返回 None"""
+        if not token or token.count('.') != 1:
+            return None
+        payload, signature = token.split('.')
+        try:
+            expected = self._sign(payload)
+        except UnicodeEncodeError:
+            return None
+        if not hmac.compare_digest(signature, expected):
+            return None
+        try:
+            body = json.loads(_b64decode(payload))
+            user_id, username, expires = int(body['u']), str(body['n']), float(body['e'])
+            epoch = int(body.get('s', 0))
+        except (ValueError, KeyError, TypeError):
+            return None
+        if expires < time.time():
+            return None
+        return user_id, username, epoch
+
+
+# 进程内共享的签名器
+token_signer = SessionTokenSigner()
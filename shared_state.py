@@ -0,0 +1,297 @@
+"""
+共享内存状态平面
+同一台机器上的多个 Streamlit 服务进程通过 multiprocessing.shared_memory 共享孪生的最新状态，
+不必每个 tick 都经过数据库。
+
+布局: 64 字节头部（魔数、槽位数、槽位大小）+ 定长结构化槽位数组（SLOT_DTYPE）
+  - 槽位目录: 以 user_id 为键的开放寻址哈希表（线性探测），user_id 直接存在槽位里，
+    读者无锁探测；认领/释放槽位时用 fcntl 文件锁串行化
+  - 单写者: 每个槽位记录写者进程 PID，只有认领到槽位的进程写入；写者进程退出后
+    其它进程可以接管
+  - 无锁读: 顺序锁（seqlock），写者写入前后各把 seq 加一，读者在 seq 为偶数且前后一致时
+    才接受读到的记录；view() 直接返回共享内存中的记录视图（零拷贝，不保证一致）
+
+环境变量:
+    STATE_PLANE_NAME: 共享内存名称，设置后应用启用状态平面
+    STATE_PLANE_SLOTS: 槽位数（默认 4096，需大于同时在线的用户数）
+"""
+
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOTS = 4096
+_MAGIC = 0x42494F4D4F4F4431  # "BIOMOOD1"
+_HEADER_BYTES = 64
+
+# 槽位中按固定顺序保存的引擎参数
+PARAM_KEYS = ('tau_r', 'tau_d', 'circadian_k', 'circadian_amplitude', 'k', 'c', 'm',
+              'phi', 'base_hrv', 'hrv_stress_sensitivity')
+
+SLOT_DTYPE = np.dtype([
+    ('user_id', '<i8'),      # 0 表示空槽位
+    ('owner_pid', '<i8'),    # 0 表示无写者
+    ('seq', '<u8'),          # 顺序锁计数，奇数表示正在写入
+    ('version', '<i8'),      # engine_state 版本号
+    ('sim_time', '<f8'),
+    ('S', '<f8'),
+    ('x', '<f8'),
+    ('v', '<f8'),
+    ('mood', '<f8'),
+    ('baseline', '<f8'),
+    ('is_asleep', '<i8'),
+    ('params', '<f8', (len(PARAM_KEYS),)),
+    ('updated_at', '<f8'),
+])
+
+SlotState = namedtuple('SlotState', [
+    'user_id', 'owner_pid', 'version', 'sim_time', 'S', 'x', 'v',
+    'mood', 'baseline', 'is_asleep', 'params', 'updated_at',
+])
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StatePlane:
+    """
+    共享内存状态平面
+
+    参数:
+        name: 共享内存名称（同一台机器上的进程用相同名称连接同一平面）
+        slots: 槽位数，仅在首个进程创建平面时生效
+    """
+
+    def __init__(self, name: str = None, slots: int = None):
+        self.name = name or os.environ.get("STATE_PLANE_NAME", "bio_mood_state")
+        slots = slots or int(os.environ.get("STATE_PLANE_SLOTS", DEFAULT_SLOTS))
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{self.name}.lock")
+        self._lock_file = open(self._lock_path, 'a+')
+        self._thread_lock = threading.Lock()
+        self._pid = os.getpid()
+
+        with self._directory_lock():
+            try:
+                self._shm = shared_memory.SharedMemory(name=self.name)
+                created = False
+            except FileNotFoundError:
+                self._shm = shared_memory.SharedMemory(
+                    name=self.name, create=True, size=_HEADER_BYTES + slots * SLOT_DTYPE.itemsize)
+                created = True
+            # 平面的生命周期独立于任何一个进程，不让 resource_tracker 在进程退出时回收
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+            header = np.ndarray((3,), dtype='<u8', buffer=self._shm.buf)
+            if created:
+                header[:] = (_MAGIC, slots, SLOT_DTYPE.itemsize)
+            elif header[0] != _MAGIC or header[2] != SLOT_DTYPE.itemsize:
+                self._shm.close()
+                raise ValueError(f"共享内存 {self.name} 的布局与当前版本不一致")
+        self.capacity = int(header[1])
+        self.slots = np.ndarray((self.capacity,), dtype=SLOT_DTYPE,
+                                buffer=self._shm.buf, offset=_HEADER_BYTES)
+        # 本进程认领的槽位: user_id → 槽位下标
+        self._owned: Dict[int, int] = {}
+
+    @contextmanager
+    def _directory_lock(self):
+        """跨进程（fcntl）+ 进程内（线程锁）互斥，用于创建平面和认领/释放槽位"""
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _probe(self, user_id: int):
+        start = (user_id * 2654435761 & 0xFFFFFFFF) % self.capacity
+        for i in range(self.capacity):
+            yield (start + i) % self.capacity
+
+    # ===== 槽位目录 =====
+
+    def slot_of(self, user_id: int) -> Optional[int]:
+        """查找用户的槽位（无锁）"""
+        ids = self.slots['user_id']
+        for index in self._probe(user_id):
+            slot_user = ids[index]
+            if slot_user == user_id:
+                return index
+            if slot_user == 0:
+                return None
+        return None
+
+    def owner_of(self, user_id: int) -> Optional[int]:
+        """槽位写者的 PID，没有存活的写者时返回 None"""
+        index = self.slot_of(user_id)
+        if index is None:
+            return None
+        pid = int(self.slots['owner_pid'][index])
+        return pid if _pid_alive(pid) else None
+
+    def claim(self, user_id: int) -> Optional[int]:
+        """
+        认领用户槽位成为唯一写者，返回槽位下标
+
+        已被其它存活进程认领或平面已满时返回 None。
+        探测链上没有该用户时，优先复用链上无存活写者的旧槽位，其次使用空槽位。
+        """
+        if user_id in self._owned:
+            return self._owned[user_id]
+        with self._directory_lock():
+            reusable = None
+            target = None
+            for index in self._probe(user_id):
+                slot = self.slots[index]
+                if slot['user_id'] == user_id:
+                    if slot['owner_pid'] != self._pid and _pid_alive(int(slot['owner_pid'])):
+                        return None
+                    target = index
+                    break
+                if slot['user_id'] == 0:
+                    target = reusable if reusable is not None else index
+                    break
+                if reusable is None and not _pid_alive(int(slot['owner_pid'])):
+                    reusable = index
+            else:
+                target = reusable
+            if target is None:
+                logger.warning("状态平面 %s 已满，无法为用户 %s 分配槽位", self.name, user_id)
+                return None
+
+            slot = self.slots[target:target + 1]
+            if slot['user_id'][0] != user_id:
+                # 新分配或复用的槽位: 先作废旧内容，读者不会读到其它用户的数据
+                slot['seq'] += 1
+                slot['user_id'] = user_id
+                slot['version'] = 0
+                slot['updated_at'] = 0
+                slot['seq'] += 1
+            slot['owner_pid'] = self._pid
+        self._owned[user_id] = target
+        return target
+
+    def release(self, user_id: int):
+        """放弃写者身份（槽位和最新状态保留，供其它进程读取或接管）"""
+        index = self._owned.pop(user_id, None)
+        if index is None:
+            return
+        with self._directory_lock():
+            if self.slots['owner_pid'][index] == self._pid:
+                self.slots['owner_pid'][index] = 0
+
+    def release_all(self):
+        for user_id in list(self._owned):
+            self.release(user_id)
+
+    # ===== 读写 =====
+
+    def write(self, user_id: int, version: int, sim_time: float, S: float, x: float, v: float,
+              mood: float, baseline: float, is_asleep: bool, params: Dict):
+        """写入本进程认领的槽位（顺序锁保护）"""
+        index = self._owned.get(user_id)
+        if index is None:
+            raise PermissionError(f"本进程不是用户 {user_id} 槽位的写者")
+        record = self.slots[index:index + 1]
+        record['seq'] += 1
+        record['version'] = version
+        record['sim_time'] = sim_time
+        record['S'] = S
+        record['x'] = x
+        record['v'] = v
+        record['mood'] = mood
+        record['baseline'] = baseline
+        record['is_asleep'] = int(is_asleep)
+        record['params'] = [params.get(key, np.nan) for key in PARAM_KEYS]
+        record['updated_at'] = time.time()
+        record['seq'] += 1
+
+    def read(self, user_id: int, retries: int = 100) -> Optional[SlotState]:
+        """一致地读取用户的最新状态（无锁，写入中则重试）；从未写入过时返回 None"""
+        index = self.slot_of(user_id)
+        if index is None:
+            return None
+        seq = self.slots['seq']
+        for _ in range(retries):
+            before = int(seq[index])
+            if before & 1:
+                continue
+            record = self.slots[index].copy()
+            if int(seq[index]) == before:
+                if record['user_id'] != user_id or record['updated_at'] == 0:
+                    return None
+                return SlotState(
+                    user_id=user_id, owner_pid=int(record['owner_pid']), version=int(record['version']),
+                    sim_time=float(record['sim_time']), S=float(record['S']), x=float(record['x']),
+                    v=float(record['v']), mood=float(record['mood']), baseline=float(record['baseline']),
+                    is_asleep=bool(record['is_asleep']),
+                    params={key: float(value) for key, value in zip(PARAM_KEYS, record['params'])
+                            if not np.isnan(value)},
+                    updated_at=float(record['updated_at']),
+                )
+        return None
+
+    def view(self, user_id: int) -> Optional[np.void]:
+        """共享内存中记录的零拷贝视图（读取时可能与写者交错）"""
+        index = self.slot_of(user_id)
+        return None if index is None else self.slots[index]
+
+    def stats(self) -> Dict:
+        used = int(np.count_nonzero(self.slots['user_id']))
+        return {
+            'name': self.name,
+            'capacity': self.capacity,
+            'used': used,
+            'owned': len(self._owned),
+            'memory_kb': round(self._shm.size / 1024, 1),
+        }
+
+    def close(self):
+        """释放本进程的写者身份并断开共享内存（平面本身保留）"""
+        self.release_all()
+        self.slots = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # 仍有 view() 返回的记录在使用，交给进程退出时回收
+            pass
+        self._lock_file.close()
+
+    def unlink(self):
+        """删除共享内存（所有进程都停止后调用）"""
+        shared_memory.SharedMemory(name=self.name).unlink()
+
+
+# ===== 进程级单例 =====
+
+_plane: Optional[StatePlane] = None
+_plane_lock = threading.Lock()
+
+
+def get_state_plane(**kwargs) -> StatePlane:
+    """取得本进程连接的状态平面，首次调用时创建或连接（之后的参数被忽略）"""
+    global _plane
+    with _plane_lock:
+        if _plane is None:
+            _plane = StatePlane(**kwargs)
+        return _plane
@@ -0,0 +1,648 @@
+"""
+仿真调度器
+每个服务进程一个后台线程，按固定 tick 批量推进所有在线的数字孪生：
+  - 注册表: user_id → TwinHandle（引擎、锁、模拟时钟锚点、历史曲线、最新快照）
+  - 批量步进: 每个 tick 用 bio_model.step_engines 一次向量化积分全部引擎
+  - 持久化: 每 persist_every 个 tick 把各孪生的快照用 add_mood_records 批量写库；
+    启用 history_spill 时改为写入这段时间内的全部曲线点（完整分辨率）
+  - 发布: 每个 tick 结束后原子替换各孪生的 TwinSnapshot，页面重跑只读快照
+  - 换出: 闲置超时或超过孪生数/内存上限时按 LRU 换出，紧凑状态写入 engine_state 表，
+    下次 register 时透明恢复
+  - 无状态多进程: engine_state 带版本号，所有写入都是比较并交换（CAS）；模拟时钟锚点
+    （真实时间, 模拟时间）随状态保存，任何进程加载后都用 BioEngine.fast_forward
+    解析快进到当前时刻。版本冲突说明其它进程写过更新的状态，本进程重新加载
+  - 共享内存状态平面（可选，shared_state.StatePlane）: 同机多进程时每个孪生只由认领到
+    槽位的进程步进并每个 tick 写入平面，其它进程的同一孪生只从平面跟随最新状态
+
+环境变量:
+    ENGINE_MAX_TWINS: 常驻孪生数上限（默认 1000）
+    ENGINE_IDLE_TIMEOUT: 闲置多少秒后换出（默认 1800）
+    ENGINE_MEMORY_LIMIT_MB: 常驻孪生估算内存上限（MB，默认不限）
+    HISTORY_CAPACITY: 每个孪生保留的曲线点数（默认 288）
+    HISTORY_SPILL: 设为 1 时把每个曲线点都写入心情记录，而不只是每 persist_every 个 tick 的快照
+
+页面代码修改引擎（施加事件、切换睡眠、改参数）时必须通过 locked(user_id)，
+与调度线程的步进互斥；进入前先加载其它进程写入的新版本，退出时立即 CAS 写回并重新发布快照。
+
+孪生锁 (handle.lock) 只在读取/修改内存中的引擎与历史时持有，数据库读写都在它之外进行；
+同一孪生的 "取紧凑状态 → CAS 写库 → 更新版本号" 由写回锁 (handle.save_lock) 串行化，
+写回期间调度线程照常步进、页面照常读取快照。
+
+锁顺序: 注册表锁 → 写回锁 → 孪生锁（多个时均按 user_id 升序）→ 数据库锁。
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bio_model import step_engines
+from ring_buffer import DEFAULT_FIELDS, RingBuffer
+
+logger = logging.getLogger(__name__)
+
+# 内存估算: 引擎对象（参数字典、状态数组等）+ 历史环形缓冲区（预分配，镜像双倍存储）
+_TWIN_BASE_BYTES = 4096
+
+TwinSnapshot = namedtuple('TwinSnapshot', [
+    'user_id', 'sim_time', 'mood', 'baseline', 'x', 'v', 'S',
+    'is_asleep', 'params', 'tick', 'published_at',
+])
+
+
+class TwinHandle:
+    """一个在线数字孪生：引擎 + 模拟时钟 + 曲线历史 + 最新快照"""
+
+    def __init__(self, user_id: int, engine, sim_start: float, time_scale: float, history_size: int,
+                 spill: bool = False):
+        self.user_id = user_id
+        self.engine = engine
+        self.lock = threading.RLock()
+        # 串行化本孪生的状态写回（见模块说明），不阻塞步进与读取
+        self.save_lock = threading.RLock()
+        self.time_scale = time_scale
+        # 模拟时钟: sim_time = sim_anchor + (real - real_anchor) * time_scale / 3600
+        self.real_anchor = time.time()
+        self.sim_anchor = sim_start
+        # 曲线历史 (模拟时间, 心情, 基线, S, x)；history.total 为累计点数，供增量图表使用
+        self.history = RingBuffer(history_size, DEFAULT_FIELDS,
+                                  on_spill=self._queue_spill if spill else None)
+        # 已从历史溢出、等待写入心情记录的点
+        self.spilled_points: List[Dict] = []
+        # 历史序列标识，孪生换出后重新创建时变化，图表据此整体重绘
+        self.series_id = f"{user_id}:{self.real_anchor}"
+        self.snapshot: Optional[TwinSnapshot] = None
+        self.last_access = time.monotonic()
+        self.ticks_since_persist = 0
+        # engine_state 中的版本号，0 表示尚未保存过
+        self.version = 0
+        # 是否为状态平面中该用户槽位的写者
+        self.plane_writer = False
+
+    def append_history(self, snap: TwinSnapshot):
+        self.history.append(snap.sim_time, snap.mood, snap.baseline, snap.S, snap.x)
+
+    def _queue_spill(self, columns: Dict[str, np.ndarray]):
+        self.spilled_points.extend(
+            {'mood_value': mood, 'baseline': baseline, 'sleep_pressure': S}
+            for mood, baseline, S in zip(columns['mood'].tolist(), columns['baseline'].tolist(),
+                                         columns['S'].tolist()))
+
+    def take_spilled(self) -> List[Dict]:
+        """交出尚未写入的曲线点，转为 add_mood_records 的记录"""
+        self.history.flush()
+        points, self.spilled_points = self.spilled_points, []
+        params = self.snapshot.params if self.snapshot else self.engine.params
+        for point in points:
+            point.update(user_id=self.user_id, hrv_value=params['c'], parameters=params)
+        return points
+
+    def drop_spilled(self):
+        """放弃尚未写入的曲线点（由其它进程负责记录时）"""
+        self.history.spilled = self.history.total
+        self.spilled_points = []
+
+    def estimated_bytes(self) -> int:
+        return _TWIN_BASE_BYTES + self.history.nbytes
+
+    def compact_state(self) -> Dict:
+        """写入 engine_state 的紧凑状态（调用方持有 lock）"""
+        engine = self.engine
+        S, x, v = engine.state
+        return {
+            'user_id': self.user_id, 'S': S, 'x': x, 'v': v,
+            'is_asleep': engine.is_asleep, 'last_update_time': engine.last_update_time,
+            'params': dict(engine.params),
+            'anchor_real': self.real_anchor, 'anchor_sim': self.sim_anchor,
+            'version': self.version,
+        }
+
+    def apply_state(self, state: Dict, now: float):
+        """载入紧凑状态并解析快进到 now 对应的模拟时间（调用方持有 lock）"""
+        engine = self.engine
+        engine.state = np.array([state['S'], state['x'], state['v']], dtype=float)
+        engine.is_asleep = state['is_asleep']
+        engine.last_update_time = state['last_update_time']
+        engine.params.update(state['params'])
+        self.real_anchor, self.sim_anchor = state['anchor_real'], state['anchor_sim']
+        self.version = state['version']
+        engine.fast_forward(self.sim_time_at(now) - engine.last_update_time)
+
+    def follow(self, state) -> bool:
+        """
+        跟随状态平面中写者发布的状态（调用方持有 lock），返回是否有更新
+
+        版本号低于本地的记录（本进程刚写回的修改尚未被写者加载）不采用。
+        """
+        engine = self.engine
+        if state is None or state.version < self.version or state.sim_time <= engine.last_update_time:
+            return False
+        engine.state = np.array([state.S, state.x, state.v], dtype=float)
+        engine.is_asleep = state.is_asleep
+        engine.last_update_time = state.sim_time
+        engine.params.update(state.params)
+        self.version = state.version
+        return True
+
+    def sim_time_at(self, real_time: float) -> float:
+        return self.sim_anchor + (real_time - self.real_anchor) * self.time_scale / 3600.0
+
+    def publish(self, tick: int = None) -> TwinSnapshot:
+        """按引擎当前状态生成快照并原子替换（调用方持有 lock）"""
+        engine = self.engine
+        t = engine.last_update_time
+        mood, baseline, x, S = engine.get_mood_value(t)
+        self.snapshot = TwinSnapshot(
+            user_id=self.user_id, sim_time=float(t), mood=float(mood), baseline=float(baseline),
+            x=float(x), v=float(engine.state[2]), S=float(S), is_asleep=engine.is_asleep,
+            params=dict(engine.params),
+            tick=tick if tick is not None else (self.snapshot.tick if self.snapshot else 0),
+            published_at=time.time(),
+        )
+        return self.snapshot
+
+
+class SimulationScheduler:
+    """
+    后台仿真调度线程
+
+    参数:
+        tick_seconds: 真实时间 tick 间隔（秒）
+        time_scale: 1 秒真实时间对应的模拟秒数（默认 600，即 1 秒 = 10 分钟）
+        persist_every: 每隔多少个 tick 持久化一次快照（0 为不持久化）
+        history_size: 每个孪生保留的曲线点数（None 时读取 HISTORY_CAPACITY，默认 288）
+        history_spill: 是否把全部曲线点写入心情记录（None 时读取 HISTORY_SPILL）
+        db_factory: 无参可调用对象，返回调度器专用的 Database 实例
+        max_twins: 常驻孪生数上限
+        idle_timeout: 闲置换出时间（秒）
+        memory_limit_mb: 常驻孪生估算内存上限（MB，None 为不限）
+        state_plane: 同机多进程共享的 StatePlane（None 为不启用）
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, time_scale: float = 600.0,
+                 persist_every: int = 10, history_size: int = None,
+                 db_factory: Callable = None, max_twins: int = None,
+                 idle_timeout: float = None, memory_limit_mb: float = None,
+                 state_plane=None, history_spill: bool = None):
+        self.tick_seconds = tick_seconds
+        self.time_scale = time_scale
+        self.persist_every = persist_every
+        if history_size is None:
+            history_size = int(os.environ.get("HISTORY_CAPACITY", "288"))
+        if history_spill is None:
+            history_spill = os.environ.get("HISTORY_SPILL", "0") == "1"
+        self.history_size = history_size
+        self.history_spill = history_spill and db_factory is not None
+        self.db_factory = db_factory
+        if max_twins is None:
+            max_twins = int(os.environ.get("ENGINE_MAX_TWINS", "1000"))
+        if idle_timeout is None:
+            idle_timeout = float(os.environ.get("ENGINE_IDLE_TIMEOUT", "1800"))
+        if memory_limit_mb is None and os.environ.get("ENGINE_MEMORY_LIMIT_MB"):
+            memory_limit_mb = float(os.environ["ENGINE_MEMORY_LIMIT_MB"])
+        self.max_twins = max_twins
+        self.idle_timeout = idle_timeout
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self.state_plane = state_plane
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._twins: Dict[int, TwinHandle] = {}
+        # 正在写回数据库的孪生，换出完成前再次访问直接放回注册表
+        self._evicting: Dict[int, TwinHandle] = {}
+        self._registry_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ticks = 0
+        self.last_tick_ms = 0.0
+        self.evictions = 0
+        self.rehydrations = 0
+
+    # ===== 生命周期 =====
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="simulation-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """停止调度线程，并把全部常驻孪生写回数据库"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._registry_lock:
+            handles = list(self._twins.values())
+            self._evicting.update(self._twins)
+            self._twins.clear()
+        self._evict(handles)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.exception("仿真 tick 失败: %s", e)
+            next_tick += self.tick_seconds
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # 落后时跳过积压的 tick，而不是连续补跑
+                next_tick = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    # ===== 注册表 =====
+
+    def register(self, user_id: int, engine_factory: Callable, sim_start: float = 8.0) -> TwinHandle:
+        """
+        注册（或取回已注册的）孪生
+
+        同一用户的多个标签页共用一个孪生；页面每次重跑都应调用本方法取得孪生，
+        不要跨重跑持有引擎引用（孪生可能已被换出并重新恢复）。
+        engine_factory 只在孪生不在内存中时调用；若数据库中有保存的状态（本进程换出的
+        或其它进程写入的），会载入到新引擎上并快进到当前时刻，否则模拟时钟从 sim_start（小时）起走。
+        """
+        handle = self._reuse(user_id)
+        if handle is None:
+            # 创建引擎与读取库中状态都在注册表锁之外进行，不阻塞其它用户的注册与查找
+            created = TwinHandle(user_id, engine_factory(), sim_start,
+                                 self.time_scale, self.history_size, self.history_spill)
+            state = self._load_state(user_id)
+            with created.lock:
+                if state is not None:
+                    created.apply_state(state, time.time())
+                created.publish(self.ticks)
+            with self._registry_lock:
+                # 期间被并发的 register 抢先创建时沿用已注册的孪生
+                handle = self._twins.get(user_id) or self._evicting.pop(user_id, None)
+                if handle is None:
+                    handle = created
+                    if state is not None:
+                        self.rehydrations += 1
+                self._twins[user_id] = handle
+                handle.last_access = time.monotonic()
+        self._claim_plane(handle)
+        self._evict(self._select_victims(time.monotonic(), exclude=user_id))
+        return handle
+
+    def _reuse(self, user_id: int) -> Optional[TwinHandle]:
+        """取回常驻或正在换出的孪生并刷新访问时间，不在内存中时返回 None"""
+        with self._registry_lock:
+            handle = self._twins.get(user_id) or self._evicting.pop(user_id, None)
+            if handle is not None:
+                self._twins[user_id] = handle
+                handle.last_access = time.monotonic()
+            return handle
+
+    def unregister(self, user_id: int) -> Optional[TwinHandle]:
+        with self._registry_lock:
+            handle = self._twins.pop(user_id, None)
+        if handle is not None:
+            self._release_plane(handle)
+        return handle
+
+    def _claim_plane(self, handle: TwinHandle):
+        """尝试成为状态平面中该孪生的写者（已有存活的写者进程时保持跟随）"""
+        if self.state_plane is not None and not handle.plane_writer:
+            handle.plane_writer = self.state_plane.claim(handle.user_id) is not None
+
+    def _release_plane(self, handle: TwinHandle):
+        if self.state_plane is not None and handle.plane_writer:
+            self.state_plane.release(handle.user_id)
+            handle.plane_writer = False
+
+    def handle(self, user_id: int) -> Optional[TwinHandle]:
+        handle = self._twins.get(user_id)
+        if handle is None and user_id in self._evicting:
+            with self._registry_lock:
+                handle = self._evicting.pop(user_id, None)
+                if handle is not None:
+                    self._twins[user_id] = handle
+        if handle is not None:
+            handle.last_access = time.monotonic()
+        return handle
+
+    def snapshot(self, user_id: int) -> Optional[TwinSnapshot]:
+        """最新快照（无锁读取）"""
+        handle = self.handle(user_id)
+        return handle.snapshot if handle else None
+
+    def history(self, user_id: int) -> Tuple[List[float], List[float], List[float]]:
+        """曲线历史: (模拟时间, 心情, 基线)"""
+        handle = self.handle(user_id)
+        if handle is None:
+            return [], [], []
+        with handle.lock:
+            window = handle.history.window()
+            return window['time'].tolist(), window['mood'].tolist(), window['baseline'].tolist()
+
+    def history_since(self, user_id: int, since: int) -> Tuple[int, List[tuple]]:
+        """
+        绝对序号 since 之后的曲线点 [(模拟时间, 心情, 基线), ...]，只复制新增部分
+
+        返回: (首个返回点的绝对序号, 点列表)；since 早于窗口起点时从窗口起点返回
+        """
+        handle = self.handle(user_id)
+        if handle is None:
+            return 0, []
+        with handle.lock:
+            begin, columns = handle.history.since(since)
+            return begin, list(zip(columns['time'].tolist(), columns['mood'].tolist(),
+                                   columns['baseline'].tolist()))
+
+    @contextmanager
+    def locked(self, user_id: int):
+        """与调度线程互斥地修改引擎：先同步其它进程的新版本，退出时 CAS 写回并重新发布快照"""
+        handle = self.handle(user_id)
+        if handle is None:
+            raise KeyError(f"用户 {user_id} 的孪生未注册")
+        with handle.save_lock:
+            state = self._load_state(user_id)
+            with handle.lock:
+                self._apply_newer(handle, state)
+                yield handle.engine
+                saved = handle.compact_state()
+                handle.publish()
+            try:
+                if self._save_states([(handle, saved)]):
+                    # 同步之后仍被其它进程抢先写入，本次修改作废，以库中状态为准
+                    logger.warning("用户 %s 的孪生状态版本冲突，已重新加载", user_id)
+                    self._reload(handle)
+            except RuntimeError as e:
+                # 写库失败时保留本地修改，下次持久化时重试
+                logger.error("保存孪生状态失败: %s", e)
+
+    # ===== 状态同步 =====
+
+    def _load_state(self, user_id: int) -> Optional[Dict]:
+        if self.db_factory is None:
+            return None
+        with self._db_lock:
+            return self._database().load_engine_state(user_id)
+
+    @staticmethod
+    def _apply_newer(handle: TwinHandle, state: Optional[Dict]):
+        """库中版本比本地新时载入（调用方持有 handle.lock）"""
+        if state is not None and state['version'] > handle.version:
+            handle.apply_state(state, time.time())
+
+    def _reload(self, handle: TwinHandle, tick: int = None, drop_spilled: bool = False):
+        """重新读取库中状态（锁外），再在孪生锁内载入并发布快照（调用方持有 handle.save_lock）"""
+        state = self._load_state(handle.user_id)
+        with handle.lock:
+            self._apply_newer(handle, state)
+            handle.publish(tick)
+            if drop_spilled:
+                handle.drop_spilled()
+
+    def _save_states(self, saves: List[Tuple[TwinHandle, Dict]]) -> List[int]:
+        """
+        CAS 写回 [(孪生, 紧凑状态)]（调用方持有各 handle.save_lock，不持有 handle.lock）
+
+        返回版本冲突的用户ID；写库失败时抛出 RuntimeError。
+        """
+        if self.db_factory is None or not saves:
+            return []
+        with self._db_lock:
+            success, conflicts, msg = self._database().save_engine_states([state for _, state in saves])
+        if not success:
+            raise RuntimeError(msg)
+        conflicted = set(conflicts)
+        for handle, state in saves:
+            if handle.user_id not in conflicted:
+                with handle.lock:
+                    handle.version = max(handle.version, state['version'] + 1)
+        return conflicts
+
+    # ===== 换出 =====
+
+    def _select_victims(self, now: float, exclude: int = None) -> List[TwinHandle]:
+        """从注册表摘下应换出的孪生：先闲置超时的，再按 LRU 直到满足数量/内存上限"""
+        with self._registry_lock:
+            victims, remaining = [], []
+            for handle in self._twins.values():
+                if handle.user_id == exclude:
+                    continue
+                if now - handle.last_access > self.idle_timeout:
+                    victims.append(handle)
+                else:
+                    remaining.append(handle)
+            remaining.sort(key=lambda h: h.last_access)
+            count = len(self._twins) - len(victims)
+            total = (sum(h.estimated_bytes() for h in self._twins.values())
+                     - sum(h.estimated_bytes() for h in victims))
+            while remaining and (count > self.max_twins or
+                                 (self.memory_limit_bytes and total > self.memory_limit_bytes)):
+                victim = remaining.pop(0)
+                victims.append(victim)
+                count -= 1
+                total -= victim.estimated_bytes()
+            for handle in victims:
+                del self._twins[handle.user_id]
+                self._evicting[handle.user_id] = handle
+        return victims
+
+    def _evict(self, handles: List[TwinHandle]):
+        """
+        把孪生的紧凑状态写回数据库；写失败时放回注册表，避免丢失状态
+
+        版本冲突的孪生直接丢弃，库中已有其它进程写入的更新状态。
+        """
+        if not handles:
+            return
+        handles = sorted(handles, key=lambda h: h.user_id)
+        success = True
+        for handle in handles:
+            handle.save_lock.acquire()
+        try:
+            saves = []
+            for handle in handles:
+                with handle.lock:
+                    saves.append((handle, handle.compact_state()))
+            conflicts = set(self._save_states(saves))
+            if self.history_spill:
+                records = []
+                for handle in handles:
+                    if handle.user_id not in conflicts:
+                        with handle.lock:
+                            records.extend(handle.take_spilled())
+                self._write_records(records)
+        except RuntimeError as e:
+            success, msg = False, str(e)
+        finally:
+            for handle in handles:
+                handle.save_lock.release()
+        with self._registry_lock:
+            evicted = []
+            for handle in handles:
+                if self._evicting.pop(handle.user_id, None) is None:
+                    # 写回期间已被 register 取回
+                    continue
+                if success:
+                    evicted.append(handle)
+                else:
+                    self._twins[handle.user_id] = handle
+        for handle in evicted:
+            self._release_plane(handle)
+        if success:
+            self.evictions += len(evicted)
+        else:
+            logger.error("换出引擎状态失败: %s", msg)
+
+    # ===== tick =====
+
+    def tick(self):
+        """推进全部孪生到当前模拟时间，发布快照并按需持久化"""
+        t0 = time.perf_counter()
+        now = time.time()
+        with self._registry_lock:
+            handles = sorted(self._twins.values(), key=lambda h: h.user_id)
+        self.ticks += 1
+
+        locked = []
+        try:
+            for handle in handles:
+                handle.lock.acquire()
+                locked.append(handle)
+
+            plane = self.state_plane
+            due, durations = [], []
+            for handle in handles:
+                if plane is not None and not handle.plane_writer:
+                    # 写者进程退出后接管，否则只跟随平面中的最新状态
+                    if plane.owner_of(handle.user_id) is None:
+                        self._claim_plane(handle)
+                    if not handle.plane_writer:
+                        if handle.follow(plane.read(handle.user_id)):
+                            snap = handle.publish(self.ticks)
+                            handle.append_history(snap)
+                            handle.drop_spilled()
+                        continue
+                dt = handle.sim_time_at(now) - handle.engine.last_update_time
+                if dt > 0:
+                    due.append(handle)
+                    durations.append(dt)
+            step_engines([handle.engine for handle in due], durations)
+
+            to_persist = []
+            for handle in due:
+                snap = handle.publish(self.ticks)
+                handle.append_history(snap)
+                if handle.plane_writer:
+                    plane.write(handle.user_id, handle.version, snap.sim_time, snap.S, snap.x,
+                                snap.v, snap.mood, snap.baseline, snap.is_asleep, snap.params)
+                handle.ticks_since_persist += 1
+                if self.persist_every and handle.ticks_since_persist >= self.persist_every:
+                    to_persist.append(handle)
+        finally:
+            for handle in locked:
+                handle.lock.release()
+
+        # 写库在孪生锁之外进行，不阻塞页面读取与修改
+        self._persist(to_persist)
+
+        self._evict(self._select_victims(time.monotonic()))
+        self.last_tick_ms = (time.perf_counter() - t0) * 1000
+
+    def _database(self):
+        """调度器专用数据库连接（调用方持有 _db_lock）"""
+        if self._db is None:
+            self._db = self.db_factory()
+        return self._db
+
+    def _persist(self, handles: List[TwinHandle]):
+        """
+        CAS 写回孪生状态并记录心情快照（调用方不持有 handle.lock）
+
+        正在由页面写回的孪生（save_lock 被占用）本次跳过，下个 tick 重试。
+        版本冲突的孪生由其它进程负责记录，这里重新加载它们的状态，不写心情记录。
+        """
+        if self.db_factory is None or not handles:
+            return
+        saving = []
+        for handle in handles:
+            if handle.save_lock.acquire(blocking=False):
+                handle.ticks_since_persist = 0
+                saving.append(handle)
+        try:
+            saves = []
+            for handle in saving:
+                with handle.lock:
+                    saves.append((handle, handle.compact_state()))
+            try:
+                conflicts = set(self._save_states(saves))
+            except RuntimeError as e:
+                logger.error("保存孪生状态失败: %s", e)
+                return
+            records = []
+            for handle in saving:
+                if handle.user_id in conflicts:
+                    self._reload(handle, self.ticks, drop_spilled=True)
+                    continue
+                if self.history_spill:
+                    with handle.lock:
+                        records.extend(handle.take_spilled())
+                    continue
+                snap = handle.snapshot
+                records.append({
+                    'user_id': handle.user_id,
+                    'mood_value': snap.mood,
+                    'baseline': snap.baseline,
+                    'sleep_pressure': snap.S,
+                    'hrv_value': snap.params['c'],
+                    'parameters': snap.params,
+                })
+        finally:
+            for handle in saving:
+                handle.save_lock.release()
+        self._write_records(records)
+
+    def _write_records(self, records: List[Dict]):
+        if records:
+            with self._db_lock:
+                success, msg = self._database().add_mood_records(records)
+            if not success:
+                logger.error("持久化快照失败: %s", msg)
+
+    def stats(self) -> Dict:
+        with self._registry_lock:
+            memory_bytes = sum(h.estimated_bytes() for h in self._twins.values())
+        return {
+            'twins': len(self._twins),
+            'memory_mb': round(memory_bytes / 1024 / 1024, 3),
+            'evictions': self.evictions,
+            'rehydrations': self.rehydrations,
+            'ticks': self.ticks,
+            'last_tick_ms': round(self.last_tick_ms, 3),
+            'running': self.running,
+            'plane': self.state_plane.stats() if self.state_plane is not None else None,
+        }
+
+
+# ===== 进程级单例 =====
+
+_scheduler: Optional[SimulationScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(**kwargs) -> SimulationScheduler:
+    """取得本进程的调度器，首次调用时按参数创建并启动（之后的参数被忽略）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SimulationScheduler(**kwargs)
+            _scheduler.start()
+        return _scheduler
@@ -0,0 +1,356 @@
+"""
+可穿戴设备数据批量导入模块
+以生成器流水线分块读取大型 CSV / JSON / JSON Lines 导出文件，
+校验并统一单位后通过 executemany 写入 wearable_samples 表，
+同时可按时间顺序回放到 BioEngine。内存占用只与分块大小有关，与文件大小无关。
+
+支持的样本:
+    hrv:   rMSSD (毫秒)，字段如 rmssd / hrv / hrv_rmssd，可带 unit 列 (ms / s)
+    sleep: 睡眠时段，字段 sleep_start + sleep_end，或 timestamp + sleep_duration (+ unit: h / min / s)
+"""
+
+import io
+import csv
+import copy
+import json
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 各字段可接受的别名（不同厂商导出的列名不同）
+TIMESTAMP_KEYS = ('timestamp', 'time', 'datetime', 'date', 'start', 'startDate')
+HRV_KEYS = ('rmssd', 'hrv', 'hrv_rmssd', 'rMSSD', 'hrv_ms')
+SLEEP_START_KEYS = ('sleep_start', 'bedtime_start', 'sleepStart')
+SLEEP_END_KEYS = ('sleep_end', 'bedtime_end', 'sleepEnd', 'end', 'endDate')
+SLEEP_DURATION_KEYS = ('sleep_duration', 'sleep_hours', 'sleep_minutes', 'duration', 'total_sleep')
+UNIT_KEYS = ('unit', 'units')
+
+# 合理取值范围
+HRV_RANGE_MS = (5.0, 300.0)
+SLEEP_RANGE_HOURS = (0.25, 24.0)
+
+# 持续时间单位 → 小时
+DURATION_UNITS = {'h': 1.0, 'hour': 1.0, 'hours': 1.0,
+                  'min': 1 / 60.0, 'minute': 1 / 60.0, 'minutes': 1 / 60.0,
+                  's': 1 / 3600.0, 'sec': 1 / 3600.0, 'seconds': 1 / 3600.0}
+
+
+# ===== 读取：逐条产出原始记录 =====
+
+def iter_raw_records(source, fmt: str = None) -> Iterator[Dict]:
+    """
+    逐条读取原始记录
+
+    参数:
+        source: 文件路径，或文本/二进制文件对象（如 Streamlit 的 UploadedFile）
+        fmt: 'csv' / 'json' / 'jsonl'，None 时按扩展名或首个非空白字符判断
+    """
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from _iter_text(f, fmt or _format_from_name(source))
+    else:
+        f = source
+        if isinstance(source.read(0), bytes):
+            f = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+        yield from _iter_text(f, fmt or _format_from_name(getattr(source, 'name', '') or ''))
+
+
+def _format_from_name(name: str) -> Optional[str]:
+    lower = name.lower()
+    if lower.endswith('.csv'):
+        return 'csv'
+    if lower.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if lower.endswith('.json'):
+        return None  # .json 既可能是数组也可能是 JSON Lines，需要看内容
+    return None
+
+
+def _iter_text(f, fmt: Optional[str]) -> Iterator[Dict]:
+    if fmt is None:
+        # 根据第一个非空白字符判断：'[' → JSON 数组，'{' → JSON Lines，其他 → CSV
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        fmt = 'json' if head == '[' else 'jsonl' if head == '{' else 'csv'
+        f = _PrefixedReader(head, f)
+
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    elif fmt == 'jsonl':
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    elif fmt == 'json':
+        yield from _iter_json_array(f)
+    else:
+        raise ValueError(f"不支持的格式: {fmt}")
+
+
+class _PrefixedReader:
+    """把探测格式时读出的前缀放回文本流前面"""
+
+    def __init__(self, prefix: str, f):
+        self.prefix = prefix
+        self.f = f
+
+    def read(self, size: int = -1) -> str:
+        if not self.prefix:
+            return self.f.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.f.read(), ''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.f.read(size - len(data))
+        return data
+
+    def __iter__(self):
+        first = self.prefix + self.f.readline()
+        self.prefix = ''
+        if first:
+            yield first
+        yield from self.f
+
+
+def _iter_json_array(f, buffer_size: int = 1 << 16) -> Iterator[Dict]:
+    """流式解析顶层 JSON 数组，缓冲区大小固定，不会整体载入文件"""
+    decoder = json.JSONDecoder()
+    buf = f.read(buffer_size).lstrip()
+    if not buf.startswith('['):
+        raise ValueError("JSON 文件顶层必须是数组")
+    buf = buf[1:]
+    eof = False
+
+    while True:
+        buf = buf.lstrip().lstrip(',').lstrip()
+        if buf.startswith(']'):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(buffer_size)
+            eof = not chunk
+            buf += chunk
+            continue
+        yield obj
+        buf = buf[end:]
+        if len(buf) < buffer_size // 4 and not eof:
+            chunk = f.read(buffer_size)
+            eof = not chunk
+            buf += chunk
+
+
+# ===== 校验与单位换算 =====
+
+def parse_timestamp_ms(value) -> int:
+    """ISO 文本 / 秒级或毫秒级 epoch → UTC 毫秒时间戳（无时区的文本按 UTC 处理）"""
+    if value is None or value == '':
+        raise ValueError("缺少时间戳")
+    if isinstance(value, (int, float)) or str(value).replace('.', '', 1).isdigit():
+        number = float(value)
+        # 大于 1e11 视为毫秒（1e11 秒已是公元 5000 年以后）
+        return int(number if number > 1e11 else number * 1000)
+    text = str(value).strip().replace('Z', '+00:00')
+    dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def _first(raw: Dict, keys) -> Optional[object]:
+    for key in keys:
+        value = raw.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def normalize_record(raw: Dict) -> List[Tuple[str, int, float, Optional[int]]]:
+    """
+    原始记录 → 标准化样本列表 [(kind, ts_epoch_ms, value, end_ms)]
+
+    一条原始记录可能同时包含 HRV 和睡眠字段。
+    不合法的记录抛出 ValueError，由调用方计入拒绝数。
+    """
+    samples = []
+    unit = str(_first(raw, UNIT_KEYS) or '').strip().lower()
+
+    hrv = _first(raw, HRV_KEYS)
+    if hrv is not None:
+        ts = parse_timestamp_ms(_first(raw, TIMESTAMP_KEYS))
+        value = float(hrv)
+        # 部分设备以秒为单位导出 RR 差值（如 0.045）
+        if unit in ('s', 'sec', 'seconds') or (not unit and value < 1.0):
+            value *= 1000.0
+        if not HRV_RANGE_MS[0] <= value <= HRV_RANGE_MS[1]:
+            raise ValueError(f"HRV 超出合理范围: {value:.1f} ms")
+        samples.append(('hrv', ts, value, None))
+
+    sleep_start = _first(raw, SLEEP_START_KEYS)
+    duration = _first(raw, SLEEP_DURATION_KEYS)
+    if sleep_start is not None or duration is not None:
+        start_ms = parse_timestamp_ms(sleep_start if sleep_start is not None else _first(raw, TIMESTAMP_KEYS))
+        end = _first(raw, SLEEP_END_KEYS)
+        if end is not None:
+            end_ms = parse_timestamp_ms(end)
+            hours = (end_ms - start_ms) / 3.6e6
+        else:
+            factor = DURATION_UNITS.get(unit)
+            if factor is None:
+                # 无单位时按字段名推断，默认小时
+                factor = 1 / 60.0 if 'sleep_minutes' in raw else 1.0
+            hours = float(duration) * factor
+            end_ms = start_ms + int(hours * 3.6e6)
+        if not SLEEP_RANGE_HOURS[0] <= hours <= SLEEP_RANGE_HOURS[1]:
+            raise ValueError(f"睡眠时长超出合理范围: {hours:.2f} h")
+        samples.append(('sleep', start_ms, hours, end_ms))
+
+    if not samples:
+        raise ValueError("记录中没有可识别的 HRV 或睡眠字段")
+    return samples
+
+
+def iter_samples(raw_records: Iterator[Dict], stats: Dict = None) -> Iterator[Tuple[str, int, float, Optional[int]]]:
+    """校验并展开样本；stats 中累计 read / rejected 计数"""
+    stats = stats if stats is not None else {}
+    stats.setdefault('read', 0)
+    stats.setdefault('rejected', 0)
+    for raw in raw_records:
+        stats['read'] += 1
+        try:
+            yield from normalize_record(raw)
+        except (ValueError, TypeError):
+            stats['rejected'] += 1
+
+
+def iter_chunks(iterable, size: int) -> Iterator[List]:
+    """把任意可迭代对象切成固定大小的列表块"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ===== 回放到引擎 =====
+
+class EngineReplayer:
+    """
+    按时间顺序把样本回放到 BioEngine 的副本，再把得到的校准参数应用到原引擎
+
+    回放在构造时复制出的副本上进行：第一个样本的时刻对齐到副本的模拟时间，之后按真实
+    时间差（小时）推进；HRV 样本触发 hrv_update，睡眠样本触发 sleep_start / sleep_end。
+    文件跨度可能长达数天，直接在在线引擎上推进会把它的模拟时钟拨快同样的时长，
+    因此原引擎的状态向量与时钟保持不变，apply() 只写回回放改变了的参数（如 k / c）。
+    乱序（早于已回放时刻）的样本只入库不回放。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.scratch = copy.deepcopy(engine)
+        self._initial_params = dict(engine.params)
+        self.anchor_ms = None
+        self.anchor_hours = self.scratch.last_update_time
+        self.replayed = 0
+        self.skipped = 0
+
+    def _advance_to(self, ts_ms: int) -> bool:
+        if self.anchor_ms is None:
+            self.anchor_ms = ts_ms
+        t = self.anchor_hours + (ts_ms - self.anchor_ms) / 3.6e6
+        dt = t - self.scratch.last_update_time
+        if dt < 0:
+            return False
+        if dt > 0:
+            self.scratch.step(dt)
+        return True
+
+    def feed(self, samples):
+        for kind, ts_ms, value, end_ms in samples:
+            if not self._advance_to(ts_ms):
+                self.skipped += 1
+                continue
+            if kind == 'hrv':
+                self.scratch.apply_event('hrv_update', value)
+            elif kind == 'sleep':
+                self.scratch.apply_event('sleep_start')
+                self._advance_to(end_ms)
+                self.scratch.apply_event('sleep_end')
+            self.replayed += 1
+
+    def calibration(self) -> Dict[str, float]:
+        """回放改变了的参数 {name: value}"""
+        return {name: value for name, value in self.scratch.params.items()
+                if self._initial_params.get(name) != value}
+
+    def apply(self, engine=None) -> Dict[str, float]:
+        """把回放得到的参数写入原引擎（或 engine），返回写入的参数"""
+        engine = engine if engine is not None else self.engine
+        changes = self.calibration()
+        if changes:
+            engine.params.update(changes)
+            engine.mark_changed()
+        return changes
+
+
+def import_wearable_file(db, user_id: int, source, fmt: str = None, engine=None,
+                         chunk_size: int = 5000, source_name: str = None,
+                         replayer: EngineReplayer = None) -> Dict:
+    """
+    流式导入可穿戴设备导出文件
+
+    参数:
+        db: db_module.Database
+        source: 文件路径或文件对象
+        engine: 可选 BioEngine，导入的同时按时间回放（在副本上回放，结束后只写回校准参数）
+        chunk_size: 每次 executemany 的样本数
+        replayer: 调用方创建的 EngineReplayer（代替 engine）；只回放不写回，由调用方在
+                  合适的时机（如持有引擎锁时）调用 replayer.apply()
+    返回: {'read', 'imported', 'rejected', 'replayed', 'skipped'}
+    """
+    stats = {'read': 0, 'imported': 0, 'rejected': 0, 'replayed': 0, 'skipped': 0}
+    apply_after = replayer is None and engine is not None
+    if apply_after:
+        replayer = EngineReplayer(engine)
+    if source_name is None:
+        source_name = source if isinstance(source, str) else getattr(source, 'name', None)
+
+    samples = iter_samples(iter_raw_records(source, fmt), stats)
+    for chunk in iter_chunks(samples, chunk_size):
+        ok, msg = db.add_wearable_samples(user_id, chunk, source=source_name)
+        if not ok:
+            raise RuntimeError(msg)
+        stats['imported'] += len(chunk)
+        if replayer is not None:
+            replayer.feed(chunk)
+
+    if replayer is not None:
+        if apply_after:
+            replayer.apply()
+        stats['replayed'] = replayer.replayed
+        stats['skipped'] = replayer.skipped
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    from db_module import Database
+
+    parser = argparse.ArgumentParser(description="导入可穿戴设备 HRV / 睡眠数据")
+    parser.add_argument('file')
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--db', default='bio_mood.db')
+    parser.add_argument('--format', choices=['csv', 'json', 'jsonl'], default=None)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    database = Database(db_type="sqlite", db_path=args.db)
+    result = import_wearable_file(database, args.user_id, args.file, fmt=args.format,
+                                  chunk_size=args.chunk_size)
+    print(f"读取 {result['read']} 条, 导入 {result['imported']} 个样本, 拒绝 {result['rejected']} 条")
+    database.close()